@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+全流程基准测试：合成 50 / 500 / 5000 / 50000 只持仓的组合（data/portfolio.json 的格式）和离线 OHLCV 回放数据，
+逐阶段计时、测内存峰值，并把整条流水线作为端到端结果；结果写成 JSON，与仓库里提交的基线比较，
+超出阈值时返回非零。完全离线：行情走 ReplayProvider，AI 走 StubModel，邮件只渲染不投递
+
+用法:
+  python benchmarks/bench.py                              # 默认规模 50,500,5000，和 benchmarks/baseline.json 比较
+  python benchmarks/bench.py --scales 50000 --repeat 1
+  python benchmarks/bench.py --time-threshold 0.3         # 覆盖基线里的阈值
+  python benchmarks/bench.py --update-baseline            # 用本次结果覆盖基线
+
+阶段:
+  collect_cold  空的本地行情存储，首次补齐历史 + 滚动相关性/技术指标全量计算
+  collect_warm  同一份存储再采集一次，只拉增量 bar（每日定时运行的常态，假定各市场都有新的交易时段）
+  collect_idle  各市场自上次抓取后都没有交易时段，按交易日历跳过下载，只读本地收盘
+  alerts        提醒规则评估
+  analyze       AI 分析的 prompt 构建/分片/解析（StubModel，不走缓存）
+  dashboard     面板 HTML（片段缓存为空）
+  json          data.json
+  columnar      列式分片 + 预压缩
+  email         邮件 HTML
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from metrics import metrics
+from renderer import load_json, atomic_write_json
+from llm_cache import ResponseCache, ModelChoiceCache
+from bar_store import BarStore
+from market_data import ReplayProvider, generate_synthetic
+from download_scheduler import DownloadScheduler
+from correlation import CorrelationEngine
+from indicators import IndicatorEngine
+from risk import RiskEngine
+from data_collector import DataCollector
+from alerts import AlertEngine
+from analyzer import PortfolioAnalyzer, StubModel
+from site_generator import SiteGenerator
+from email_sender import EmailSender
+from outbox import Outbox, StubTransport
+
+DEFAULT_SCALES = (50, 500, 5000)
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+RESULTS_PATH = os.path.join(ROOT, 'benchmarks', 'results', 'latest.json')
+FIXTURE_DIR = os.path.join(ROOT, 'data', 'cache', 'bench')
+# 回放数据的长度要覆盖首次补齐的 6mo（126 根 bar）
+FIXTURE_DAYS = 130
+FIXTURE_END = '2026-01-30'
+# 压测时钟固定在回放数据最后一天各市场收盘之后，交易日历按这个时间判断休市和前收
+FIXTURE_CLOCK = datetime.fromisoformat(f"{FIXTURE_END}T22:00:00+00:00").timestamp()
+# 基线里没有写阈值时的默认值：time/memory 为允许的相对增幅，min_* 为低于它不算回退的绝对噪声
+DEFAULT_THRESHOLDS = {'time': 0.5, 'memory': 0.25, 'min_seconds': 0.05, 'min_bytes': 1 << 20, 'stages': {}}
+
+HK_SECTORS = ['互联网', '消费电子', '新能源汽车', '医药', '银行', '地产', '能源', '有色金属']
+A_SECTORS = ['白酒', '半导体', '光伏', '券商', '医疗器械', '电力', '化工', '军工']
+
+STAGES = ('collect_cold', 'collect_warm', 'collect_idle', 'alerts', 'analyze', 'dashboard', 'json', 'columnar', 'email')
+
+
+# ---------- 合成数据 ----------
+
+def synthetic_config(n, seed=0):
+    """生成 n 只持仓（港股/A股各半）的组合配置；美股板块 ETF 沿用 data/portfolio.json"""
+    rng = random.Random(seed)
+    with open(os.path.join(ROOT, 'data', 'portfolio.json'), 'r', encoding='utf-8') as f:
+        etfs = json.load(f)['us_sector_etfs']
+    us_sectors = list(etfs)
+    n_hk = n // 2
+    hk = [{'code': f"{i + 1:04d}.HK", 'name': f"港股{i + 1}", 'weight': round(rng.uniform(0.5, 3), 1),
+           'sector': rng.choice(HK_SECTORS), 'us_sector': rng.choice(us_sectors), 'keywords': []}
+          for i in range(n_hk)]
+    a = []
+    for i in range(n - n_hk):
+        # 沪市 6 开头 .SH，深市 0 开头 .SZ，交替生成
+        code = f"{600000 + i // 2}.SH" if i % 2 == 0 else f"{1 + i // 2:06d}.SZ"
+        a.append({'code': code, 'name': f"A股{i + 1}", 'weight': round(rng.uniform(0.5, 3), 1),
+                  'sector': rng.choice(A_SECTORS), 'us_sector': rng.choice(us_sectors), 'keywords': []})
+    return {'version': '1.0', 'last_updated': FIXTURE_END, 'hk_stocks': hk, 'a_stocks': a,
+            'us_sector_etfs': etfs}
+
+
+def make_collector(replay_dir, workspace):
+    store = BarStore(os.path.join(workspace, 'bars'))
+    provider = ReplayProvider(replay_dir)
+    # 离线回放不需要限流和退避，令牌桶放开，免得基准里测的是 sleep
+    scheduler = DownloadScheduler(provider, rate=1e9, burst=1e9, deadline=None)
+    correlation = CorrelationEngine(store, state_path=os.path.join(workspace, 'correlation.npz'))
+    indicators = IndicatorEngine(store, state_path=os.path.join(workspace, 'indicators.npz'))
+    risk = RiskEngine(store, state_path=os.path.join(workspace, 'risk.npz'))
+    return DataCollector(provider=provider, store=store, scheduler=scheduler, correlation=correlation,
+                         indicators=indicators, state_path=os.path.join(workspace, 'fetch_state.json'),
+                         clock=lambda: FIXTURE_CLOCK, risk=risk)
+
+
+def ensure_fixture(n, root=FIXTURE_DIR, seed=0):
+    """生成（或复用已有的）规模 n 的组合配置和回放目录，返回 (配置, 回放目录)"""
+    fixture = os.path.join(root, f"{n}-{FIXTURE_DAYS}-{seed}")
+    config_path = os.path.join(fixture, 'portfolio.json')
+    replay_dir = os.path.join(fixture, 'replay')
+    ready = os.path.join(fixture, 'ready')
+    # 配置生成很快，每次按当前代码重新生成；只有回放数据缓存复用（代码列表与配置里的其它字段无关）
+    config = synthetic_config(n, seed)
+    if os.path.exists(ready):
+        atomic_write_json(config_path, config)
+        return config, replay_dir
+
+    shutil.rmtree(fixture, ignore_errors=True)
+    atomic_write_json(config_path, config)
+    workspace = tempfile.mkdtemp(prefix='bench-')
+    try:
+        symbols = list(make_collector(replay_dir, workspace).build_universe(config)) + ['^GSPC', '^IXIC']
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+    print(f"   🧪 生成回放数据: {len(symbols)} 只标的 × {FIXTURE_DAYS} 天")
+    generate_synthetic(symbols, root=replay_dir, days=FIXTURE_DAYS, end=FIXTURE_END, seed=seed)
+    with open(ready, 'w') as f:
+        f.write(datetime.now().isoformat())
+    return config, replay_dir
+
+
+# ---------- 执行 ----------
+
+def pipeline_stages(config, replay_dir, workspace):
+    """按流水线顺序返回 [(阶段名, 函数)]，后面的阶段用前面阶段的结果"""
+    collector = make_collector(replay_dir, workspace)
+    generator = SiteGenerator(output_dir=os.path.join(workspace, 'docs'),
+                              fragment_dir=os.path.join(workspace, 'fragments'))
+    sender = EmailSender(None, 'Bench <bench@example.com>', transport=StubTransport(),
+                         outbox=Outbox(os.path.join(workspace, 'outbox')))
+    analyzer = PortfolioAnalyzer(None, model=StubModel(),
+                                 cache=ResponseCache(os.path.join(workspace, 'llm_responses.json')),
+                                 model_cache=ModelChoiceCache(os.path.join(workspace, 'model_choice.json')))
+    alert_engine = AlertEngine(rules_path=os.path.join(ROOT, 'data', 'alerts.json'),
+                               state_path=os.path.join(workspace, 'alert_state.json'), store=collector.store)
+    r = {}
+
+    def collect_warm():
+        # 清掉抓取记录，相当于所有市场都开过盘
+        if os.path.exists(collector.state_path):
+            os.remove(collector.state_path)
+        r['md'] = collector.collect_all(config)
+        return r['md']
+
+    def alerts():
+        r['md']['alerts'] = alert_engine.evaluate_market_data(r['md'])
+
+    def analyze():
+        r['analysis'] = analyzer.analyze(r['md'])
+
+    return [
+        ('collect_cold', lambda: collector.collect_all(config)),
+        ('collect_warm', collect_warm),
+        ('collect_idle', lambda: collector.collect_all(config)),
+        ('alerts', alerts),
+        ('analyze', analyze),
+        ('dashboard', lambda: generator.generate_dashboard(r['md'], r['analysis'])),
+        ('json', lambda: generator.generate_json_data(r['md'], r['analysis'])),
+        ('columnar', lambda: generator.generate_columnar_data(r['md'], r['analysis'])),
+        ('email', lambda: sender.create_email_html(r['md'], r['analysis'])),
+    ]
+
+
+def span_totals():
+    """本阶段内 metrics 记录的子 span，按名称汇总耗时"""
+    totals = {}
+    for s in metrics.to_dict()['spans']:
+        totals[s['name']] = round(totals.get(s['name'], 0) + s.get('duration', 0), 6)
+    return totals
+
+
+def run_pass(config, replay_dir, trace=False, verbose=False):
+    """在临时工作目录里完整跑一遍流水线；trace=True 时测每个阶段的内存峰值（相对阶段开始时的增量）"""
+    workspace = tempfile.mkdtemp(prefix='bench-')
+    out = {}
+    try:
+        if trace:
+            tracemalloc.start()
+        for name, func in pipeline_stages(config, replay_dir, workspace):
+            metrics.reset()
+            if trace:
+                start_bytes = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            t0 = time.perf_counter()
+            with redirect_stdout(sys.stdout if verbose else io.StringIO()):
+                func()
+            stage = {'seconds': time.perf_counter() - t0, 'spans': span_totals()}
+            if trace:
+                current, peak = tracemalloc.get_traced_memory()
+                stage.update(peak_bytes=max(0, peak - start_bytes), absolute_peak_bytes=peak)
+            out[name] = stage
+    finally:
+        if trace:
+            tracemalloc.stop()
+        shutil.rmtree(workspace, ignore_errors=True)
+    return out
+
+
+def bench_scale(n, repeat, memory=True, verbose=False):
+    config, replay_dir = ensure_fixture(n)
+    passes = [run_pass(config, replay_dir, verbose=verbose) for _ in range(repeat)]
+    # 计时取多次中的最小值；内存另跑一遍（tracemalloc 本身会拖慢计时）
+    traced = run_pass(config, replay_dir, trace=True, verbose=verbose) if memory else {}
+    stages = {}
+    for name in STAGES:
+        best = min(passes, key=lambda p: p[name]['seconds'])[name]
+        stage = {'seconds': round(best['seconds'], 6), 'spans': best['spans']}
+        if name in traced:
+            stage['peak_bytes'] = traced[name]['peak_bytes']
+        stages[name] = stage
+    end_to_end = {'seconds': round(min(sum(p[s]['seconds'] for s in STAGES) for p in passes), 6)}
+    if traced:
+        end_to_end['peak_bytes'] = max(traced[s]['absolute_peak_bytes'] for s in STAGES)
+    return {'tickers': n, 'repeat': repeat, 'stages': stages, 'end_to_end': end_to_end}
+
+
+# ---------- 基线比较 ----------
+
+def compare(results, baseline, thresholds):
+    """逐规模、逐阶段比较耗时和内存，返回 [{'scale', 'stage', 'metric', 'baseline', 'current', 'ratio', 'regressed'}]"""
+    rows = []
+    for scale, cur in results['scales'].items():
+        base = baseline.get('scales', {}).get(scale)
+        if not base:
+            continue
+        pairs = [(s, cur['stages'][s], base['stages'].get(s)) for s in cur['stages']]
+        pairs.append(('end_to_end', cur['end_to_end'], base.get('end_to_end')))
+        for stage, c, b in pairs:
+            if not b:
+                continue
+            limits = {**thresholds, **thresholds.get('stages', {}).get(stage, {})}
+            for metric, key, floor in (('seconds', 'time', 'min_seconds'), ('peak_bytes', 'memory', 'min_bytes')):
+                if metric not in c or not b.get(metric):
+                    continue
+                ratio = c[metric] / b[metric]
+                regressed = ratio > 1 + limits[key] and c[metric] - b[metric] > limits[floor]
+                rows.append({'scale': scale, 'stage': stage, 'metric': metric, 'baseline': b[metric],
+                             'current': c[metric], 'ratio': round(ratio, 3), 'regressed': regressed})
+    return rows
+
+
+def fmt(metric, value):
+    return f"{value * 1000:9.1f}ms" if metric == 'seconds' else f"{value / (1 << 20):9.1f}MB"
+
+
+def print_report(results, rows):
+    for scale, r in results['scales'].items():
+        print(f"\n📏 {scale} 只持仓")
+        for stage in STAGES + ('end_to_end',):
+            s = r['end_to_end'] if stage == 'end_to_end' else r['stages'][stage]
+            mem = fmt('peak_bytes', s['peak_bytes']) if 'peak_bytes' in s else ''
+            print(f"   {stage:<13}{fmt('seconds', s['seconds'])}  {mem}")
+    regressed = [row for row in rows if row['regressed']]
+    if rows:
+        print(f"\n🔍 与基线比较: {len(rows)} 项, 回退 {len(regressed)} 项")
+    for row in regressed:
+        print(f"   ❌ {row['scale']} {row['stage']} {row['metric']}: "
+              f"{fmt(row['metric'], row['baseline']).strip()} → {fmt(row['metric'], row['current']).strip()} (x{row['ratio']})")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流水线各阶段的离线基准测试")
+    parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)),
+                        help="持仓规模，逗号分隔（可选 50,500,5000,50000）")
+    parser.add_argument('--repeat', type=int, default=3, help="计时重复次数，取最小值")
+    parser.add_argument('--no-memory', action='store_true', help="不测内存峰值")
+    parser.add_argument('--out', default=RESULTS_PATH, help="结果 JSON 输出路径")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="基线 JSON")
+    parser.add_argument('--update-baseline', action='store_true', help="用本次结果覆盖基线（保留基线里的阈值）")
+    parser.add_argument('--time-threshold', type=float, help="耗时允许的相对增幅，如 0.5 表示 +50%%")
+    parser.add_argument('--memory-threshold', type=float, help="内存峰值允许的相对增幅")
+    parser.add_argument('--verbose', action='store_true', help="显示各阶段自己的输出")
+    args = parser.parse_args()
+
+    scales = [int(s) for s in args.scales.split(',') if s.strip()]
+    baseline = load_json(args.baseline, {})
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get('thresholds', {})}
+    if args.time_threshold is not None:
+        thresholds['time'] = args.time_threshold
+    if args.memory_threshold is not None:
+        thresholds['memory'] = args.memory_threshold
+
+    results = {
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpus': os.cpu_count()},
+        'scales': {},
+    }
+    for n in scales:
+        print(f"⏱️ 基准测试: {n} 只持仓 (重复 {args.repeat} 次)")
+        results['scales'][str(n)] = bench_scale(n, args.repeat, memory=not args.no_memory, verbose=args.verbose)
+
+    rows = compare(results, baseline, thresholds)
+    results['thresholds'] = thresholds
+    results['comparison'] = rows
+    atomic_write_json(args.out, results)
+    regressed = print_report(results, rows)
+    print(f"\n   📄 结果: {os.path.relpath(args.out, ROOT)}")
+
+    if args.update_baseline:
+        merged = {**baseline, 'created_at': results['created_at'], 'machine': results['machine'],
+                  'thresholds': thresholds, 'scales': {**baseline.get('scales', {}), **results['scales']}}
+        atomic_write_json(args.baseline, merged)
+        print(f"   📌 基线已更新: {os.path.relpath(args.baseline, ROOT)}")
+        return 0
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -2,102 +2,445 @@
 """
 自选股监控系统主程序
 每日定时执行：采集数据 → AI分析 → 生成站点 → 发送邮件
+
+子命令（不带子命令时等同 run-all）：
+  collect   采集行情并评估提醒，结果写到 data/cache/stages/collect.json / alerts.json
+  analyze   读取采集结果做 AI 分析，结果写到 data/cache/stages/analyze.json
+  render    生成面板和数据文件；--from-data-json 直接用各组合已有的 data.json 重新渲染
+  send      生成并投递邮件简报
+  run-all   全流程，按依赖关系并发执行
+  watch     常驻盯盘
+
+每个子命令只导入自己用到的模块，pandas / yfinance / google.generativeai 推迟到第一次真正使用时
+
+各阶段的输出连同输入指纹落盘为检查点，失败或超时后重跑只执行缺失或输入变化的阶段；
+--force collect,analyze（或环境变量 FORCE_STAGES）强制重跑指定阶段，--force all 全部重跑
 """
 
 import os
 import sys
 import json
-from datetime import datetime
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 
 # 添加src目录到路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from data_collector import DataCollector
-from analyzer import PortfolioAnalyzer
-from site_generator import SiteGenerator
-from email_sender import EmailSender
+from metrics import metrics
+from checkpoint import Checkpoints
+from renderer import hash_inputs, strip_volatile, load_json
+from portfolios import load_portfolios, merge_configs, holdings_of, slice_view, slice_alerts, slice_analysis
+
+# AI 分析最多等待的时间(秒)，超时后面板和邮件使用默认分析
+ANALYSIS_TIMEOUT = int(os.getenv('ANALYSIS_TIMEOUT', '180'))
+# 渲染/写盘/发信等阶段的超时(秒)
+STAGE_TIMEOUT = 120
+# 运行指标输出位置（与 data.json 同目录）
+METRICS_PATH = 'docs/metrics.json'
+# 多组合时并发渲染/发信的线程数
+PUBLISH_WORKERS = int(os.getenv('PUBLISH_WORKERS', '4'))
+# 内容无变化时默认不重复发邮件，设置 FORCE_EMAIL=1 强制发送
+FORCE_EMAIL = os.getenv('FORCE_EMAIL') == '1'
+# 各阶段检查点的落盘位置
+STAGE_DIR = 'data/cache/stages'
+# 行情检查点的有效期(秒)：失败后及时重跑可以复用，下一个定时时段要重新采集
+COLLECT_MAX_AGE = int(os.getenv('CHECKPOINT_MAX_AGE', '3600'))
+ALERT_RULES = 'data/alerts.json'
+
+def default_analysis(summary):
+    """AI 不可用时的默认分析结果"""
+    return {
+        "market_summary": summary,
+        "sector_analysis": [],
+        "top_picks": [],
+        "trading_strategy": "建议参考美股板块表现自行判断",
+        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "fallback": True
+    }
+
+def make_collector():
+    from data_collector import DataCollector
+    from market_data import ReplayProvider
+    # 设置 MARKET_DATA_REPLAY=<目录> 时走离线回放，不访问网络
+    replay_dir = os.getenv('MARKET_DATA_REPLAY')
+    provider = ReplayProvider(replay_dir) if replay_dir else None
+    # 回放历史数据时用 MARKET_DATA_NOW=<ISO 时间> 固定"当前时间"，交易日历据此判断休市和前收
+    clock = None
+    if os.getenv('MARKET_DATA_NOW'):
+        now = datetime.fromisoformat(os.getenv('MARKET_DATA_NOW'))
+        if now.tzinfo is None:
+            now = now.replace(tzinfo=timezone.utc)
+        clock = now.timestamp
+    return DataCollector(provider=provider, clock=clock)
+
+def make_transport(api_key):
+    from outbox import ResendTransport, StubTransport
+    # 设置 EMAIL_TRANSPORT=stub 时邮件只记录不投递，用于本地联调
+    if os.getenv('EMAIL_TRANSPORT') == 'stub':
+        return StubTransport()
+    return ResendTransport(api_key)
+
+def make_checkpoints(force=''):
+    stages = (force or os.getenv('FORCE_STAGES', '')).split(',')
+    # 强制发信时发布阶段不能复用，否则不会重新入队
+    if FORCE_EMAIL:
+        stages.append('publish')
+    return Checkpoints(STAGE_DIR, force=stages, max_age={'collect': COLLECT_MAX_AGE})
+
+def load_last_analysis(output_dir='docs'):
+    """盯盘模式不调用 AI，沿用上一次一次性运行写出的分析结果"""
+    try:
+        with open(os.path.join(output_dir, 'data.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)['analysis']
+    except (OSError, ValueError, KeyError):
+        return default_analysis("盯盘模式：暂无 AI 分析")
+
+def watch(interval, max_ticks=None):
+    """常驻盯盘：交易时段内按 interval 秒轮询，只增量刷新变动的标的
+
+    和 run-all 一样按全部组合的并集采集，每次有变动时各组合切出自己的视图分别刷新面板
+    """
+    from watcher import IntradayWatcher
+    from alerts import AlertEngine
+    print(f"👀 盯盘模式启动，轮询间隔 {interval}s")
+    desks, config = load_desks()
+    attach_generators(desks)
+    # 各组合沿用自己上一次写出的分析（已经是切好的），盯盘不调用 AI
+    analyses = {name: load_last_analysis(d['output_dir']) for name, d in desks.items()}
+    collector = make_collector()
+
+    def publish(deltas, market_data):
+        # 分段哈希保证每个组合只重写自己有变化的市场
+        def refresh(d):
+            view, analysis = desk_view(d, market_data, market_data.get('alerts'), analyses[d['name']], False)
+            publish_desk(d, view, analysis, d['generator'].render_market_sections(view))
+        fan_out(refresh, desks, 'watch.portfolio')
+        print(f"   🔔 {datetime.now().strftime('%H:%M:%S')} 变动 {len(deltas)} 只: "
+              f"{', '.join(list(deltas)[:10])}")
+
+    watcher = IntradayWatcher(collector, config, interval=interval, on_delta=publish,
+                              alert_engine=AlertEngine(rules_path=ALERT_RULES, store=collector.store))
+    watcher.run(max_ticks=max_ticks)
+    return 0
+
+def cmd_watch(args):
+    return watch(args.interval)
+
+def report_changed(changed):
+    """把本次是否有内容变化告诉 GitHub Actions，无变化时跳过部署"""
+    print(f"   {'🔄 站点内容有更新' if changed else '⏭️ 站点内容无变化'}")
+    output = os.getenv('GITHUB_OUTPUT')
+    if output:
+        with open(output, 'a', encoding='utf-8') as f:
+            f.write(f"changed={'true' if changed else 'false'}\n")
+
+def fan_out(func, desks, stage):
+    """每个组合一个任务并发执行；单个组合失败不影响其他组合，全部结束后再统一报错"""
+    parent = metrics.current()
+    results, errors = {}, {}
+
+    def task(name, desk):
+        with metrics.span(stage, parent=parent, portfolio=name):
+            return metrics.run_profiled(func, desk)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(PUBLISH_WORKERS, len(desks)))) as pool:
+        futures = {pool.submit(task, name, desk): name for name, desk in desks.items()}
+        for fut in as_completed(futures):
+            name = futures[fut]
+            try:
+                results[name] = fut.result()
+            except Exception as e:
+                errors[name] = e
+                print(f"   ❌ 组合 {name} 失败: {e}")
+    if errors:
+        raise RuntimeError(f"{stage} 失败的组合: {', '.join(sorted(errors))}")
+    return results
+
+# ---------- 各阶段：run-all 和分步子命令共用 ----------
+
+def load_desks():
+    """加载全部组合；data/portfolios/ 下的多个组合在采集时合并去重"""
+    print("\n📋 步骤1: 加载自选股配置...")
+    to_email = os.getenv('TO_EMAIL')
+    portfolios = load_portfolios(default_recipients=[to_email] if to_email else [])
+    config = merge_configs(portfolios)
+    print(f"   组合: {len(portfolios)} 个")
+    print(f"   港股: {len(config['hk_stocks'])} 只")
+    print(f"   A股: {len(config['a_stocks'])} 只")
+    desks = {p['name']: {**p, 'holdings': holdings_of(p)} for p in portfolios}
+    return desks, config
+
+def attach_generators(desks):
+    from site_generator import SiteGenerator
+    for d in desks.values():
+        d['generator'] = SiteGenerator(output_dir=d['output_dir'])
+    return desks
+
+def make_sender(desks):
+    resend_key = os.getenv('RESEND_API_KEY')
+    if not (resend_key or os.getenv('EMAIL_TRANSPORT') == 'stub') or not any(d['recipients'] for d in desks.values()):
+        return None
+    from email_sender import EmailSender
+    return EmailSender(
+        api_key=resend_key,
+        from_email="Stock Monitor <onboarding@resend.dev>",
+        transport=make_transport(resend_key)
+    )
+
+def collect_market_data(checkpoints, collector, config):
+    print("\n📊 步骤2: 采集市场数据...")
+    return checkpoints.run('collect', hash_inputs(config), lambda: collector.collect_all(config))
+
+def evaluate_alerts(checkpoints, collector, market_data):
+    def evaluate():
+        from alerts import AlertEngine
+        alerts = AlertEngine(rules_path=ALERT_RULES, store=collector.store).evaluate_market_data(market_data)
+        for a in alerts['fired']:
+            print(f"   🔔 {a['message']}")
+        return alerts
+    # 提醒有冷却状态，同一份行情重跑不会再次触发，所以本次触发的结果必须落盘复用；
+    # 指纹绑定采集的那一次执行而不只是内容：之后重新采集到相同行情时要重新评估（由冷却去重），
+    # 不能把上一次触发的提醒当成刚触发的再发一遍
+    fingerprint = hash_inputs(checkpoints.digest('collect'), checkpoints.stamp('collect'),
+                              load_json(ALERT_RULES, None))
+    return checkpoints.run('alerts', fingerprint, evaluate)
+
+def analyze_market_data(checkpoints, market_data):
+    print("\n🤖 步骤3: AI智能分析...")
+    gemini_key = os.getenv('GEMINI_API_KEY')
+    if not gemini_key:
+        print("   ⚠️ 未设置 GEMINI_API_KEY，使用默认分析")
+        # 也写成检查点，分步的 render / send 和全流程看到的是同一份分析
+        return checkpoints.save('analyze', default_analysis("AI分析未启用，请查看原始数据"))['output']
+    from analyzer import PortfolioAnalyzer, PROMPT_VERSION
 
-def load_config():
-    """加载配置"""
-    with open('data/portfolio.json', 'r', encoding='utf-8') as f:
-        return json.load(f)
+    def analyze():
+        # 对全部组合的并集只分析一次，各组合再切出自己的部分
+        return PortfolioAnalyzer(gemini_key).analyze(market_data)
+    # 降级结果不落盘，重跑时再试一次模型
+    return checkpoints.run('analyze', hash_inputs(checkpoints.digest('collect'), PROMPT_VERSION), analyze,
+                           keep=lambda a: not a.get('fallback'))
 
-def main():
+def desk_view(desk, market_data, alerts, analysis, multi):
+    """单个组合的 (行情视图, 分析)"""
+    view = slice_view(market_data, desk['holdings'], desk['name'])
+    view['alerts'] = slice_alerts(alerts, view)
+    return view, slice_analysis(analysis, view) if multi else analysis
+
+def stored_views(checkpoints, desks, from_data_json=False):
+    """分步执行时的输入：优先用 collect/analyze 阶段的检查点，没有时用各组合已有的 data.json"""
+    market_data = None if from_data_json else checkpoints.output('collect')
+    if market_data is None:
+        views = {}
+        for name, d in desks.items():
+            saved = load_json(os.path.join(d['output_dir'], 'data.json'), None)
+            if saved is None:
+                raise RuntimeError(f"组合 {name} 没有 data.json，请先运行 collect 或 run-all")
+            views[name] = (saved['data'], saved['analysis'])
+        return views
+    alerts = checkpoints.output('alerts')
+    analysis = checkpoints.output('analyze') or default_analysis("AI分析未运行，请查看原始数据")
+    return {name: desk_view(d, market_data, alerts, analysis, len(desks) > 1) for name, d in desks.items()}
+
+def publish_desk(d, view, analysis, site_sections=None, write_json=True):
+    generator = d['generator']
+    outputs = [generator.generate_dashboard(view, analysis, site_sections)]
+    if write_json:
+        outputs.append(generator.generate_json_data(view, analysis))
+    generator.generate_columnar_data(view, analysis)
+    return outputs
+
+def queue_email(d, sender, view, analysis, sections=None, tag=""):
+    if sender is None or not d['recipients']:
+        print(f"   ⚠️ {tag}未设置 RESEND_API_KEY 或收件人，跳过邮件发送")
+        return None
+    fired = view['alerts']['fired'] if view.get('alerts') else []
+    generator = d.get('generator')
+    if generator is not None and not generator.changes.get('data.json', True) and not fired and not FORCE_EMAIL:
+        print(f"   ⏭️ {tag}行情与分析均无变化，跳过邮件发送")
+        return None
+    # 只放进发件箱，所有组合渲染完后统一批量投递
+    key = sender.queue_daily_report(d['recipients'], view, analysis, sections, force=FORCE_EMAIL)
+    if key is None:
+        print(f"   ⏭️ {tag}相同内容的邮件已发送过，跳过")
+    return key
+
+def deliver(sender):
+    print("\n📧 步骤5: 发送邮件简报...")
+    if sender is None:
+        return None
+    # 同时补发之前运行中断时遗留在发件箱里的邮件
+    report = sender.deliver()
+    if report.failed:
+        print(f"   ❌ 邮件发送失败: {report.failed}")
+    return {**report.summary(), 'sent_keys': report.sent}
+
+# ---------- 子命令 ----------
+
+def cmd_collect(args):
+    checkpoints = make_checkpoints(args.force)
+    desks, config = load_desks()
+    collector = make_collector()
+    market_data = collect_market_data(checkpoints, collector, config)
+    evaluate_alerts(checkpoints, collector, market_data)
+    return 0
+
+def cmd_analyze(args):
+    checkpoints = make_checkpoints(args.force)
+    market_data = checkpoints.output('collect')
+    if market_data is None:
+        print("❌ 没有采集结果，请先运行 collect")
+        return 1
+    analyze_market_data(checkpoints, market_data)
+    return 0
+
+def cmd_render(args):
+    desks, _ = load_desks()
+    attach_generators(desks)
+    views = stored_views(make_checkpoints(args.force), desks, args.from_data_json)
+    print("\n🌐 步骤4: 生成监控面板...")
+    # 从 data.json 重渲染时输入就是它本身，不需要再写回
+    fan_out(lambda d: publish_desk(d, *views[d['name']], write_json=not args.from_data_json),
+            desks, 'publish.portfolio')
+    report_changed(any(d['generator'].changed() for d in desks.values()))
+    return 0
+
+def cmd_send(args):
+    desks, _ = load_desks()
+    sender = make_sender(desks)
+    views = stored_views(make_checkpoints(args.force), desks, args.from_data_json)
+    multi = len(desks) > 1
+    for name, d in desks.items():
+        queue_email(d, sender, *views[name], tag=f"[{name}] " if multi else "")
+    deliver(sender)
+    return 0
+
+def run_all(args=None):
+    from pipeline import Pipeline
+    checkpoints = make_checkpoints(getattr(args, 'force', None))
+    desks, config = load_desks()
+    attach_generators(desks)
+    sender = make_sender(desks)
+    collector = make_collector()
+    multi = len(desks) > 1
+
+    def render_views(r):
+        # 只依赖行情：切出各组合视图并渲染行情段落，和 AI 分析并发
+        def render(d):
+            view = slice_view(r['collect'], d['holdings'], d['name'])
+            email_sections = sender.render_market_sections(view) if sender and d['recipients'] else None
+            return view, d['generator'].render_market_sections(view), email_sections
+        return fan_out(render, desks, 'render.portfolio')
+
+    def publish(r):
+        print("\n🌐 步骤4: 生成监控面板...")
+        # 行情用检查点摘要，提醒和分析体量小，直接对内容取哈希（降级结果不落盘，没有检查点摘要）
+        upstream = [checkpoints.digest('collect'), strip_volatile(r['alerts']), strip_volatile(r['analyze'])]
+
+        def run_desk(d):
+            name = d['name']
+
+            def work():
+                view, site_sections, email_sections = r['views'][name]
+                view['alerts'] = slice_alerts(r['alerts'], view)
+                analysis = slice_analysis(r['analyze'], view) if multi else r['analyze']
+                outputs = publish_desk(d, view, analysis, site_sections)
+                email = queue_email(d, sender, view, analysis, email_sections, tag=f"[{name}] " if multi else "")
+                return {'outputs': outputs, 'email': email}
+            fingerprint = hash_inputs(upstream, name, d['output_dir'], d['recipients'], d['config'])
+            # 产物文件不在了（例如 CI 里重新 checkout）就重新生成
+            return checkpoints.run(f'publish.{name}', fingerprint, work,
+                                   valid=lambda out: all(os.path.exists(p) for p in out['outputs']))
+        return fan_out(run_desk, desks, 'publish.portfolio')
+
+    def deliver_all(r):
+        # 投递不做检查点：每次都要把发件箱里遗留的邮件（包括之前中断的运行留下的）冲刷出去，
+        # 已经发过的 key 由发件箱自己去重
+        return deliver(sender)
+
+    # 2~5. 按依赖关系并发执行：行情渲染与 AI 分析同时进行，各组合的面板和邮件在线程池里并发生成
+    # 每个阶段完成即写检查点，失败或超时后重跑只执行缺失或输入变化的阶段
+    pipeline = Pipeline()
+    pipeline.add('collect', lambda r: collect_market_data(checkpoints, collector, config))
+    pipeline.add('analyze', lambda r: analyze_market_data(checkpoints, r['collect']), deps=['collect'],
+                 timeout=ANALYSIS_TIMEOUT,
+                 fallback=lambda r, e: default_analysis(f"AI 分析超时或失败: {str(e)[:50]}"))
+    pipeline.add('alerts', lambda r: evaluate_alerts(checkpoints, collector, r['collect']), deps=['collect'],
+                 timeout=STAGE_TIMEOUT, fallback=lambda r, e: {'fired': [], 'recent': []})
+    pipeline.add('views', render_views, deps=['collect'], timeout=STAGE_TIMEOUT)
+    # 面板、数据文件、邮件按组合并发；组合内先写 data.json 再据此判断是否发信
+    pipeline.add('publish', publish, deps=['collect', 'analyze', 'alerts', 'views'], timeout=STAGE_TIMEOUT)
+    # 投递失败的邮件留在发件箱里，下次运行重试，不让整次运行失败
+    pipeline.add('deliver', deliver_all, deps=['publish'], timeout=STAGE_TIMEOUT,
+                 fallback=lambda r, e: None)
+    results = pipeline.run()
+    market_data = results['collect']
+    analysis = results['analyze']
+    report_changed(any(d['generator'].changed() for d in desks.values()))
+
+    print("\n" + "="*60)
+    print("✅ 所有任务执行完成！")
     print("="*60)
-    print(f"🚀 自选股监控系统启动 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    # 输出摘要
+    print(f"\n📈 今日摘要:")
+    print(f"   标普500: {market_data['us_market']['sp500']['change_pct']:+.2f}%")
+    print(f"   纳斯达克: {market_data['us_market']['nasdaq']['change_pct']:+.2f}%")
+    print(f"   关注个股: {len(analysis.get('top_picks', []))} 只")
+    print(f"   面板地址: https://your-username.github.io/stock-monitor/")
+    return 0
+
+COMMANDS = {
+    'collect': cmd_collect,
+    'analyze': cmd_analyze,
+    'render': cmd_render,
+    'send': cmd_send,
+    'run-all': run_all,
+    'watch': cmd_watch,
+}
+
+def main(args=None):
+    command = 'watch' if getattr(args, 'watch', False) else getattr(args, 'command', None) or 'run-all'
+    print("="*60)
+    print(f"🚀 自选股监控系统启动 [{command}] - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("="*60)
-    
+
+    # MONITOR_PROFILE=cpu/memory/all 时额外采集 cProfile / tracemalloc，写入 docs/metrics.json
+    metrics.reset(profile=os.getenv('MONITOR_PROFILE'))
     try:
-        # 1. 加载配置
-        print("\n📋 步骤1: 加载自选股配置...")
-        config = load_config()
-        print(f"   港股: {len(config['hk_stocks'])} 只")
-        print(f"   A股: {len(config['a_stocks'])} 只")
-        
-        # 2. 采集数据
-        print("\n📊 步骤2: 采集市场数据...")
-        collector = DataCollector()
-        market_data = collector.collect_all(config)
-        
-        # 3. AI分析
-        print("\n🤖 步骤3: AI智能分析...")
-        gemini_key = os.getenv('GEMINI_API_KEY')
-        if not gemini_key:
-            print("   ⚠️ 未设置 GEMINI_API_KEY，使用默认分析")
-            analysis = {
-                "market_summary": "AI分析未启用，请查看原始数据",
-                "sector_analysis": [],
-                "top_picks": [],
-                "trading_strategy": "建议参考美股板块表现自行判断",
-                "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "fallback": True
-            }
-        else:
-            analyzer = PortfolioAnalyzer(gemini_key)
-            analysis = analyzer.analyze(market_data)
-        
-        # 4. 生成静态站点
-        print("\n🌐 步骤4: 生成监控面板...")
-        generator = SiteGenerator(output_dir='docs')
-        generator.generate_dashboard(market_data, analysis)
-        generator.generate_json_data(market_data, analysis)
-        
-        # 5. 发送邮件简报
-        print("\n📧 步骤5: 发送邮件简报...")
-        resend_key = os.getenv('RESEND_API_KEY')
-        to_email = os.getenv('TO_EMAIL')
-        
-        if resend_key and to_email:
-            sender = EmailSender(
-                api_key=resend_key,
-                from_email="Stock Monitor <onboarding@resend.dev>"
-            )
-            success, msg = sender.send_daily_report(to_email, market_data, analysis)
-            if success:
-                print(f"   ✅ 邮件已发送至 {to_email}")
-            else:
-                print(f"   ❌ 邮件发送失败: {msg}")
-        else:
-            print("   ⚠️ 未设置 RESEND_API_KEY 或 TO_EMAIL，跳过邮件发送")
-        
-        print("\n" + "="*60)
-        print("✅ 所有任务执行完成！")
-        print("="*60)
-        
-        # 输出摘要
-        print(f"\n📈 今日摘要:")
-        print(f"   标普500: {market_data['us_market']['sp500']['change_pct']:+.2f}%")
-        print(f"   纳斯达克: {market_data['us_market']['nasdaq']['change_pct']:+.2f}%")
-        print(f"   关注个股: {len(analysis.get('top_picks', []))} 只")
-        print(f"   面板地址: https://your-username.github.io/stock-monitor/")
-        
-        return 0
-        
+        with metrics.span('run', command=command):
+            if command == 'run-all':
+                # 全流程由 Pipeline 在各阶段的工作线程里分别 profile
+                return run_all(args)
+            # 分步子命令和盯盘都在主线程里执行，整条命令一起 profile
+            return metrics.run_profiled(COMMANDS[command], args)
     except Exception as e:
         print(f"\n❌ 执行出错: {e}")
         import traceback
         traceback.print_exc()
         return 1
+    finally:
+        print(f"   📏 运行指标: {metrics.write(METRICS_PATH)}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="自选股监控系统")
+    parser.add_argument('--watch', action='store_true', help="常驻盯盘模式（同 watch 子命令）")
+    parser.add_argument('--interval', type=int, default=60, help="盯盘轮询间隔(秒)")
+    parser.add_argument('--force', default='', help="强制重跑的阶段，逗号分隔 (collect,alerts,analyze,publish 或 all)")
+    # 子命令里的同名选项不设缺省值（SUPPRESS），写在子命令前面的值不会被子命令的缺省值覆盖
+    staged = argparse.ArgumentParser(add_help=False)
+    staged.add_argument('--force', default=argparse.SUPPRESS, help="强制重跑的阶段，同顶层的 --force")
+    sub = parser.add_subparsers(dest='command')
+    sub.add_parser('collect', parents=[staged], help="采集行情并评估提醒")
+    sub.add_parser('analyze', parents=[staged], help="对采集结果做 AI 分析")
+    for name, text in (('render', "生成面板和数据文件"), ('send', "生成并投递邮件简报")):
+        p = sub.add_parser(name, parents=[staged], help=text)
+        p.add_argument('--from-data-json', action='store_true', help="直接使用各组合已有的 data.json")
+    sub.add_parser('run-all', parents=[staged], help="全流程（缺省）")
+    p = sub.add_parser('watch', help="常驻盯盘")
+    p.add_argument('--interval', type=int, default=argparse.SUPPRESS, help="盯盘轮询间隔(秒)，同顶层的 --interval")
+    return parser
 
 if __name__ == "__main__":
-    exit(main())
+    exit(main(build_parser().parse_args()))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+休市表到期检查：trading_calendar.COVERED_UNTIL 离今天不足 --days 天时失败，
+提醒在休市表过期、日历退化成只按周末判断之前补上下一年的休市日
+
+用法: python scripts/check_calendar.py [--days 天数]
+"""
+
+import os
+import sys
+import argparse
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from trading_calendar import EXCHANGES, HOLIDAYS, COVERED_UNTIL  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查交易日历休市表是否即将过期")
+    parser.add_argument('--days', type=int, default=int(os.getenv('CALENDAR_MIN_DAYS', '45')),
+                        help="休市表至少还要覆盖的天数")
+    parser.add_argument('--today', default=None, help="按指定日期检查 (YYYY-MM-DD)，默认今天")
+    args = parser.parse_args()
+
+    today = date.fromisoformat(args.today) if args.today else date.today()
+    limit = today + timedelta(days=args.days)
+    ok = True
+    for market, spec in EXCHANGES.items():
+        until = COVERED_UNTIL.get(market)
+        if until is None:
+            print(f"❌ {spec['name']}没有设置 COVERED_UNTIL")
+            ok = False
+            continue
+        until = date.fromisoformat(until)
+        last = max(HOLIDAYS.get(market, []), default=None)
+        print(f"📅 {spec['name']}: 休市表覆盖到 {until}（最后一个休市日 {last}），剩余 {(until - today).days} 天")
+        if until < limit:
+            print(f"❌ {spec['name']}休市表将在 {args.days} 天内过期，请按交易所公告补充 trading_calendar.HOLIDAYS 并更新 COVERED_UNTIL")
+            ok = False
+    if ok:
+        print("✅ 休市表检查通过")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+启动开销检查：在干净的子进程里导入 main 和渲染/发信路径用到的模块，
+确认重依赖没有在导入时被加载，且导入耗时不超过预算
+
+用法: python scripts/check_import_time.py [--budget 秒]
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 这些模块只能在真正需要时才导入
+HEAVY = ('pandas', 'yfinance', 'google.generativeai')
+
+PROBE = """
+import sys, time, json
+t = time.perf_counter()
+import main
+import site_generator, email_sender, data_collector
+elapsed = time.perf_counter() - t
+print(json.dumps({'elapsed': elapsed, 'loaded': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY,)
+
+def probe():
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE], cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1]), out.stderr
+
+def slowest(importtime, n=10):
+    """从 -X importtime 的输出里取累计耗时最多的顶层导入"""
+    rows = []
+    for line in importtime.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            name = parts[2].rstrip()
+            if not name.startswith('  '):
+                rows.append((int(parts[1]), name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+def main():
+    parser = argparse.ArgumentParser(description="检查 main.py 的导入耗时与重依赖")
+    parser.add_argument('--budget', type=float, default=float(os.getenv('IMPORT_BUDGET', '1.0')),
+                        help="导入耗时预算(秒)")
+    args = parser.parse_args()
+
+    result, importtime = probe()
+    print(f"⏱️ 导入耗时: {result['elapsed'] * 1000:.0f}ms (预算 {args.budget * 1000:.0f}ms)")
+    for us, name in slowest(importtime):
+        print(f"   {us / 1000:8.1f}ms  {name}")
+
+    ok = True
+    if result['loaded']:
+        print(f"❌ 导入时加载了重依赖: {', '.join(result['loaded'])}")
+        ok = False
+    if result['elapsed'] > args.budget:
+        print("❌ 导入耗时超出预算")
+        ok = False
+    if ok:
+        print("✅ 启动开销检查通过")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    exit(main())
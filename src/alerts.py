@@ -0,0 +1,194 @@
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from renderer import atomic_write_json, load_json
+from metrics import metrics
+
+# 规则类型 → 比较的字段
+THRESHOLD_FIELDS = {'price': 'price', 'pct_change': 'change_pct'}
+THRESHOLD_OPS = ('above', 'below', 'abs_above')
+
+
+def normalize_code(code):
+    # 配置里沿用 portfolio.json 的写法 (.SH)，数据里是 Yahoo 的 .SS
+    return str(code).strip().replace('.SH', '.SS')
+
+
+class AlertEngine:
+    """确定性提醒规则：价格/涨跌幅阈值、板块与映射 ETF 背离、N 日突破
+
+    规则按标的建索引，阈值类规则按阈值排序后二分查找，
+    每次更新只评估被更新标的能触发的规则；冷却与去重状态落盘，跨运行生效
+    """
+
+    def __init__(self, rules_path='data/alerts.json', state_path='data/cache/alert_state.json',
+                 store=None, recent_limit=50):
+        self.rules_path = rules_path
+        self.state_path = state_path
+        self.store = store
+        self.recent_limit = recent_limit
+        self.rules = {}
+        self.threshold_index = {}   # {(代码, 字段): {op: ([阈值...], [规则id...])}}
+        self.ticker_rules = {}      # {代码: {规则id}}，背离与突破规则
+        self.latest = {}            # {代码: 最新行情 dict}
+        self.state = load_json(state_path, {'rules': {}, 'recent': []})
+        self.load_rules()
+
+    def load_rules(self):
+        config = load_json(self.rules_path, {'rules': []})
+        self.rules = {}
+        for i, rule in enumerate(config.get('rules', [])):
+            rule = dict(rule)
+            rule.setdefault('id', f"rule-{i}")
+            self.rules[rule['id']] = rule
+        self._build_index()
+        return self
+
+    def _build_index(self):
+        buckets = {}
+        self.ticker_rules = {}
+        for rid, rule in self.rules.items():
+            kind = rule.get('kind')
+            if kind in THRESHOLD_FIELDS:
+                op = rule.get('op', 'above')
+                if op not in THRESHOLD_OPS:
+                    raise ValueError(f"规则 {rid} 的 op 不支持: {op}")
+                key = (normalize_code(rule['ticker']), THRESHOLD_FIELDS[kind])
+                buckets.setdefault(key, {}).setdefault(op, []).append((float(rule['threshold']), rid))
+            elif kind == 'divergence':
+                for code in [rule['etf']] + list(rule['tickers']):
+                    self.ticker_rules.setdefault(normalize_code(code), set()).add(rid)
+            elif kind == 'breakout':
+                self.ticker_rules.setdefault(normalize_code(rule['ticker']), set()).add(rid)
+            else:
+                raise ValueError(f"规则 {rid} 的 kind 不支持: {kind}")
+        self.threshold_index = {}
+        for key, ops in buckets.items():
+            self.threshold_index[key] = {}
+            for op, pairs in ops.items():
+                pairs.sort()
+                self.threshold_index[key][op] = ([t for t, _ in pairs], [rid for _, rid in pairs])
+
+    def _threshold_hits(self, code, field, value):
+        """二分查找当前值越过的阈值，只返回能触发的规则"""
+        hits = []
+        ops = self.threshold_index.get((code, field))
+        if not ops:
+            return hits
+        if 'above' in ops:
+            thresholds, ids = ops['above']
+            hits += [(rid, value) for rid in ids[:bisect_left(thresholds, value)]]
+        if 'below' in ops:
+            thresholds, ids = ops['below']
+            hits += [(rid, value) for rid in ids[bisect_right(thresholds, value):]]
+        if 'abs_above' in ops:
+            thresholds, ids = ops['abs_above']
+            hits += [(rid, value) for rid in ids[:bisect_left(thresholds, abs(value))]]
+        return hits
+
+    def _divergence(self, rule):
+        etf = self.latest.get(normalize_code(rule['etf']))
+        members = [self.latest.get(normalize_code(c)) for c in rule['tickers']]
+        members = [m for m in members if m is not None]
+        if etf is None or not members:
+            return None
+        avg = sum(m.get('change_pct', 0) for m in members) / len(members)
+        diff = round(avg - etf.get('change_pct', 0), 2)
+        return diff if abs(diff) > float(rule.get('threshold', 3)) else None
+
+    def _breakout(self, rule, code):
+        if self.store is None or code not in self.latest:
+            return None
+        days = int(rule.get('days', 20))
+        closes = self.store.tail(code, days + 1)['close']
+        if len(closes) < days + 1:
+            return None
+        price = self.latest[code].get('price', 0)
+        window = closes[:-1]
+        if rule.get('direction', 'up') == 'up' and price > window.max():
+            return price
+        if rule.get('direction', 'up') == 'down' and price < window.min():
+            return price
+        return None
+
+    def _message(self, rule, code, value):
+        if rule.get('message'):
+            return rule['message']
+        name = self.latest.get(code, {}).get('name', code)
+        kind = rule['kind']
+        if kind == 'price':
+            return f"{name} 价格 {value:.2f} 触发 {rule.get('op', 'above')} {rule['threshold']}"
+        if kind == 'pct_change':
+            return f"{name} 涨跌幅 {value:+.2f}% 触发阈值 {rule['threshold']}%"
+        if kind == 'divergence':
+            return f"{'/'.join(rule['tickers'][:3])} 与 {rule['etf']} 背离 {value:+.2f}%"
+        return f"{name} 突破 {rule.get('days', 20)} 日{'新高' if rule.get('direction', 'up') == 'up' else '新低'} {value:.2f}"
+
+    def _should_fire(self, rid, value, now):
+        rule = self.rules[rid]
+        last = self.state['rules'].get(rid)
+        if last is None:
+            return True
+        # 去重：同一个值（比如休市期间重复评估同一根 bar）不重复提醒
+        if last.get('value') == value:
+            return False
+        # 冷却：冷却期内不重复提醒
+        return now - last.get('fired_at', 0) >= float(rule.get('cooldown_minutes', 240)) * 60
+
+    def evaluate(self, updates):
+        """updates 为本次更新的 [{code, name, price, change_pct}, ...]，返回新触发的提醒列表"""
+        now = time.time()
+        candidates = []
+        touched = set()
+        with metrics.span('alerts.evaluate', updates=len(updates)):
+            for item in updates:
+                code = normalize_code(item['code'])
+                self.latest[code] = item
+                for field in ('price', 'change_pct'):
+                    candidates += [(rid, code, v) for rid, v in self._threshold_hits(code, field, item.get(field, 0))]
+                touched |= {(rid, code) for rid in self.ticker_rules.get(code, ())}
+
+            seen = set()
+            for rid, code in touched:
+                rule = self.rules[rid]
+                if rule['kind'] == 'divergence' and rid not in seen:
+                    seen.add(rid)
+                    value = self._divergence(rule)
+                    if value is not None:
+                        candidates.append((rid, normalize_code(rule['etf']), value))
+                elif rule['kind'] == 'breakout':
+                    value = self._breakout(rule, code)
+                    if value is not None:
+                        candidates.append((rid, code, value))
+
+            fired = []
+            for rid, code, value in candidates:
+                if not self._should_fire(rid, value, now):
+                    continue
+                rule = self.rules[rid]
+                alert = {
+                    'rule_id': rid,
+                    'kind': rule['kind'],
+                    'ticker': code,
+                    'value': value,
+                    'message': self._message(rule, code, value),
+                    'fired_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                }
+                if rule['kind'] == 'divergence':
+                    # ticker 是 ETF，按组合分发时看的是成分股
+                    alert['members'] = [normalize_code(c) for c in rule['tickers']]
+                fired.append(alert)
+                self.state['rules'][rid] = {'fired_at': now, 'value': value}
+        metrics.incr('alerts_fired', len(fired))
+        if fired:
+            self.state['recent'] = (fired + self.state['recent'])[:self.recent_limit]
+            atomic_write_json(self.state_path, self.state)
+        return fired
+
+    def evaluate_market_data(self, market_data):
+        """对一次完整采集结果评估，返回 {'fired': 本次新触发, 'recent': 最近的提醒}"""
+        md = market_data
+        updates = md.get('us_sectors', []) + md['portfolio']['hk_stocks'] + md['portfolio']['a_stocks']
+        fired = self.evaluate(updates)
+        return {'fired': fired, 'recent': list(self.state['recent'])}
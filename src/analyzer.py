@@ -1,47 +1,357 @@
-import google.generativeai as genai
 import json
 from datetime import datetime, timedelta, timezone
 import traceback
 import re
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 
-class PortfolioAnalyzer:
-    def __init__(self, api_key):
+from metrics import metrics
+from llm_cache import ResponseCache, ModelChoiceCache
+from indicators import mover_score, signal_rows, signal_text
+
+# 优先使用 Flash Lite (速度快/不限流)
+PRIORITY_MODELS = [
+    'gemini-2.0-flash-lite-preview-02-05',
+    'gemini-2.0-flash-lite-001',
+    'gemini-2.0-flash'
+]
+DEFAULT_MODEL = 'gemini-2.0-flash'
+# prompt 模板变更时递增，让旧缓存失效
+PROMPT_VERSION = 3
+
+IMPACT_RANK = {'高': 3, '中': 2, '低': 1}
+
+
+def load_genai(api_key=None):
+    """google.generativeai 导入很慢，第一次真正需要模型时才导入"""
+    import google.generativeai as genai
+    if api_key:
         genai.configure(api_key=api_key)
-        
-        # 优先使用 Flash Lite (速度快/不限流)
-        priority_models = [
-            'gemini-2.0-flash-lite-preview-02-05',
-            'gemini-2.0-flash-lite-001',
-            'gemini-2.0-flash'
-        ]
-        
-        self.model = None
-        try:
-            available = [m.name.replace('models/', '') for m in genai.list_models()]
-            for target in priority_models:
-                if target in available:
-                    self.model = genai.GenerativeModel(target)
-                    break
-            if not self.model: self.model = genai.GenerativeModel('gemini-2.0-flash')
-        except:
-            self.model = genai.GenerativeModel('gemini-2.0-flash')
+    return genai
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符按 1 个计，其余按 4 个字符 1 个计"""
+    cjk = sum(1 for ch in text if '\u4e00' <= ch <= '\u9fff')
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def sector_label(s):
+    # 板块名后带上 ETF 代码，和个股行里的映射对得上
+    return f"{s['name']}({s['code']})" if s.get('code') else s['name']
+
+
+def mapping_rows(stocks):
+    """持仓的实测映射 {代码: [ETF, 相关系数, beta]}，没有足够历史的持仓不出现"""
+    return {s['code']: [s['map_etf'], s.get('map_corr'), s.get('map_beta')] for s in stocks if s.get('map_etf')}
+
+
+def mapping_text(m):
+    """prompt 里个股行后面的映射说明，m 为 mapping_rows 的一项"""
+    return f" ↔{m[0]} ρ={m[1]} β={m[2]}" if m else ""
+
+
+def build_shards(stocks, token_budget, base_tokens=250):
+    """按实测映射的 ETF(缺省用 us_sector / sector) 分组，再按 token 预算把每组装箱成若干分片
+
+    返回 [(分片标签, [[名称, 代码, 涨跌幅], ...]), ...]，组内按异动程度 (mover_score) 降序
+    """
+    groups = {}
+    for s in stocks:
+        label = s.get('map_etf') or s.get('us_sector') or s.get('sector') or '其他'
+        groups.setdefault(label, []).append(s)
+
+    shards = []
+    # 异动大的板块排在前面，超时被截断时先保住重要的分片
+    ordered = sorted(groups.items(), key=lambda kv: -max(mover_score(s) for s in kv[1]))
+    for label, members in ordered:
+        members = sorted(members, key=mover_score, reverse=True)
+        current, used = [], base_tokens
+        for s in members:
+            row = [s['name'], s['code'], s.get('change_pct', 0)]
+            extra = mapping_text(mapping_rows([s]).get(s['code'])) + signal_text(signal_rows([s]).get(s['code']))
+            cost = estimate_tokens(f"- {row[0]}({row[1]}): {row[2]}%{extra}\n")
+            if current and used + cost > token_budget:
+                shards.append((label, current))
+                current, used = [], base_tokens
+            current.append(row)
+            used += cost
+        if current:
+            shards.append((label, current))
+    return shards
+
+
+def merge_shard_results(results, shards, max_picks=12, scores=None):
+    """合并各分片 JSON：板块按名称去重合并，个股按代码去重，按异动程度取前 max_picks
+
+    scores 为 {代码: 异动分}，缺省按涨跌幅绝对值
+    """
+    move = scores or {code: abs(pct) for _, movers in shards for _, code, pct in movers}
+    sectors = {}
+    picks = {}
+    summaries = []
+    for r in results:
+        if r.get('market_summary'):
+            summaries.append(r['market_summary'])
+        for sa in r.get('sector_analysis', []):
+            name = sa.get('sector_name', '板块')
+            if name not in sectors:
+                sectors[name] = {**sa, 'affected_stocks': list(dict.fromkeys(sa.get('affected_stocks', [])))}
+                continue
+            merged = sectors[name]
+            if IMPACT_RANK.get(sa.get('impact_level'), 0) > IMPACT_RANK.get(merged.get('impact_level'), 0):
+                merged['impact_level'] = sa.get('impact_level')
+            if sa.get('reasoning') and sa['reasoning'] not in merged.get('reasoning', ''):
+                merged['reasoning'] = f"{merged.get('reasoning', '')}；{sa['reasoning']}".strip('；')
+            merged['affected_stocks'] = list(dict.fromkeys(merged['affected_stocks'] + sa.get('affected_stocks', [])))
+        for pick in r.get('top_picks', []):
+            code = pick.get('stock_code') or pick.get('stock_name')
+            if code and code not in picks:
+                picks[code] = pick
+
+    top_picks = sorted(picks.values(), key=lambda p: move.get(p.get('stock_code'), 0), reverse=True)[:max_picks]
+    sector_analysis = sorted(sectors.values(), key=lambda sa: IMPACT_RANK.get(sa.get('impact_level'), 0), reverse=True)
+    return {
+        'market_summary': '；'.join(list(dict.fromkeys(summaries))[:3]),
+        'sector_analysis': sector_analysis,
+        'top_picks': top_picks,
+    }
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """本地替身模型：不联网，根据 prompt 里的个股行生成确定性的 JSON，可注入延迟和失败"""
+    model_name = 'stub'
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and self.rng.random() < self.failure_rate:
+            raise RuntimeError("stub model injected failure")
+        rows = re.findall(r'- (.+?)\(([^()]+)\): (-?[\d.]+)%', prompt)
+        shard = re.search(r'【分片】(.+)', prompt)
+        sector = shard.group(1).strip() if shard else '持仓'
+        top = sorted(rows, key=lambda r: abs(float(r[2])), reverse=True)[:3]
+        return StubResponse(json.dumps({
+            'market_summary': f"{sector} {len(rows)} 只持仓",
+            'sector_analysis': [{'sector_name': sector, 'impact_level': '中', 'reasoning': 'stub',
+                                 'affected_stocks': [r[0] for r in top]}],
+            'top_picks': [{'stock_name': r[0], 'stock_code': r[1], 'action': '关注', 'reason': f"{r[2]}%"}
+                          for r in top],
+        }, ensure_ascii=False))
+
+
+class PortfolioAnalyzer:
+    def __init__(self, api_key, cache=None, model_cache=None, model=None,
+                 shard_threshold=200, shard_token_budget=1500, shard_workers=4, shard_deadline=120):
+        # model 可以直接传入 StubModel 之类的本地模型，用于离线测试
+        self.api_key = api_key
+        # 模型在第一次真正调用时才解析，解析结果落盘复用
+        self.model_name = getattr(model, 'model_name', None)
+        self._model = model
+        # 有效持仓超过 shard_threshold 只时启用分片分析
+        self.shard_threshold = shard_threshold
+        self.shard_token_budget = shard_token_budget
+        self.shard_workers = shard_workers
+        # 整轮分片分析的总时限（秒），不是每片各自的超时
+        self.shard_deadline = shard_deadline
+        self.model_cache = model_cache or ModelChoiceCache()
+        self.cache = cache if cache is not None else ResponseCache()
+
+    def _resolve_model_name(self):
+        if self.model_name:
+            return self.model_name
+        name = self.model_cache.get(PRIORITY_MODELS)
+        if not name:
+            name = DEFAULT_MODEL
+            try:
+                available = [m.name.replace('models/', '') for m in load_genai(self.api_key).list_models()]
+                for target in PRIORITY_MODELS:
+                    if target in available:
+                        name = target
+                        break
+                self.model_cache.put(PRIORITY_MODELS, name)
+            except:
+                pass
+        self.model_name = name
+        return name
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = load_genai(self.api_key).GenerativeModel(self._resolve_model_name())
+        return self._model
 
     def get_beijing_time(self):
         utc_now = datetime.now(timezone.utc)
         return (utc_now + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")
 
+    def _call_model(self, inputs):
+        """带缓存的单次模型调用，返回解析后的 JSON；失败时抛异常由调用方降级"""
+        # 输入没变（例如美股休市时段）就直接复用上一次的结果，不消耗额度
+        key = self.cache.make_key(self._resolve_model_name(), inputs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            metrics.incr('analysis_cache_hits')
+            return {**cached, 'cached': True}
+
+        with metrics.span('analyze.prompt_build'):
+            prompt = self._build_prompt(inputs)
+        with metrics.span('analyze.model_call'):
+            response = self.model.generate_content(prompt)
+        with metrics.span('analyze.parse'):
+            text = response.text.strip()
+            match = re.search(r'\{.*\}', text, re.DOTALL)
+            if match: text = match.group(0)
+            
+            analysis_result = json.loads(text)
+        # 🔥 修复：使用北京时间
+        analysis_result['generated_at'] = self.get_beijing_time()
+        self.cache.put(key, analysis_result)
+        return analysis_result
+
+    def _fallback(self, e):
+        metrics.incr('analysis_failures')
+        return {
+            "market_summary": f"AI 连接受限: {str(e)[:50]}...",
+            "sector_analysis": [], "top_picks": [],
+            "trading_strategy": "暂停操作",
+            "generated_at": self.get_beijing_time(),
+            "fallback": True
+        }
+
     def analyze(self, data):
+        try:
+            return self._analyze(data)
+        finally:
+            # 命中缓存只在内存里更新访问时间，一次分析结束时写回
+            self.cache.flush()
+
+    def _analyze(self, data):
         print(f"🧠 [AI大脑] 分析启动...")
         
-        us_text = ", ".join([f"{s['name']}:{s.get('change_pct', 0)}%" for s in data.get('us_sectors', [])])
-        
+        # 持仓太多时一条 prompt 装不下，改为按板块分片并发分析
+        valid_stocks = self._valid_stocks(data)
+        if len(valid_stocks) > self.shard_threshold:
+            return self.analyze_sharded(data)
+
+        with metrics.span('analyze.prompt_inputs'):
+            inputs = self._prompt_inputs(data)
+        try:
+            result = self._call_model(inputs)
+            if result.get('cached'):
+                print("   ♻️ 命中 AI 分析缓存")
+            return result
+        except Exception as e:
+            return self._fallback(e)
+
+    def analyze_sharded(self, data, token_budget=None, max_workers=None, shard_deadline=None):
+        """按 us_sector/sector 把全部持仓切成 token 受限的分片，并发调用后合并成同一套 JSON 结构
+
+        单个分片失败只影响它自己的股票，不会让整体退回默认分析。shard_deadline 是从提交起算的
+        整轮总时限：到点时还在排队的分片直接取消，正在调用的分片不再等待，都按失败降级
+        """
+        token_budget = token_budget or self.shard_token_budget
+        max_workers = max_workers or self.shard_workers
+        shard_deadline = shard_deadline or self.shard_deadline
+
+        us_sectors = sorted([[sector_label(s), s.get('change_pct', 0)] for s in data.get('us_sectors', [])])
+        with metrics.span('analyze.shard_plan'):
+            shards = build_shards(self._valid_stocks(data), token_budget)
+        print(f"   🧩 分片分析: {len(shards)} 片, 并发 {max_workers}")
+        metrics.incr('analysis_shards', len(shards))
+
+        results = [None] * len(shards)
+        errors = {}
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        parent = metrics.current()
+
+        valid_stocks = self._valid_stocks(data)
+        mappings = mapping_rows(valid_stocks)
+        signals = signal_rows(valid_stocks)
+
+        def run_shard(label, movers):
+            inputs = {'version': PROMPT_VERSION, 'us_sectors': us_sectors, 'shard': label, 'movers': movers,
+                      'mappings': {code: mappings[code] for _, code, _ in movers if code in mappings},
+                      'signals': {code: signals[code] for _, code, _ in movers if code in signals}}
+            with metrics.span('analyze.shard', parent=parent, shard=label, stocks=len(movers)):
+                return self._call_model(inputs)
+
+        def collect(fut):
+            i = futures[fut]
+            try:
+                results[i] = fut.result()
+            except Exception as e:
+                errors[i] = str(e)[:100]
+
+        futures = {pool.submit(run_shard, label, movers): i for i, (label, movers) in enumerate(shards)}
+        try:
+            for fut in as_completed(futures, timeout=shard_deadline):
+                collect(fut)
+        except FuturesTimeout:
+            for fut, i in futures.items():
+                if fut.cancel():
+                    errors[i] = f"超过总时限 {shard_deadline}s，未开始"
+                elif not fut.done():
+                    errors[i] = f"超过总时限 {shard_deadline}s"
+                elif results[i] is None and i not in errors:
+                    # 超时判定之后才完成的分片照常收下
+                    collect(fut)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        if errors:
+            metrics.incr('analysis_shard_failures', len(errors))
+            print(f"   ⚠️ {len(errors)} 个分片失败或超时，已单独降级")
+        ok = [r for r in results if r is not None]
+        if not ok:
+            return self._fallback(next(iter(errors.values()), '无可用分片'))
+
+        merged = merge_shard_results(ok, shards, scores={s['code']: mover_score(s) for s in valid_stocks})
+        merged['generated_at'] = self.get_beijing_time()
+        merged['shards'] = {'total': len(shards), 'failed': len(errors),
+                            'failed_sectors': sorted({shards[i][0] for i in errors})}
+        return merged
+
+    def _valid_stocks(self, data):
         all_stocks = data['portfolio']['hk_stocks'] + data['portfolio']['a_stocks']
-        valid_stocks = [s for s in all_stocks if s.get('price', 0) > 0]
-        top_movers = sorted(valid_stocks, key=lambda x: abs(x.get('change_pct', 0)), reverse=True)[:12]
-        stock_text = "\n".join([f"- {s['name']}({s['code']}): {s.get('change_pct', 0)}%" for s in top_movers])
+        return [s for s in all_stocks if s.get('price', 0) > 0]
+
+    def _prompt_inputs(self, data):
+        """抽取真正进入 prompt 的数据并归一化，同时作为缓存键的内容"""
+        us_sectors = [[sector_label(s), s.get('change_pct', 0)] for s in data.get('us_sectors', [])]
+        
+        valid_stocks = self._valid_stocks(data)
+        # 不只看当日涨跌幅：相对自身波动的异动、放量、跳空、超买超卖都会被选进来
+        top_movers = sorted(valid_stocks, key=mover_score, reverse=True)[:12]
+        movers = [[s['name'], s['code'], s.get('change_pct', 0)] for s in top_movers]
+        return {'version': PROMPT_VERSION, 'us_sectors': sorted(us_sectors), 'movers': movers,
+                'mappings': mapping_rows(top_movers), 'signals': signal_rows(top_movers)}
+
+    def _build_prompt(self, inputs):
+        us_text = ", ".join([f"{name}:{pct}%" for name, pct in inputs['us_sectors']])
+        # 每只异动股后面附上实测最相关的美股 ETF（滚动相关系数 ρ 与 beta，已做隔夜时差对齐）和技术指标
+        mappings = inputs.get('mappings', {})
+        signals = inputs.get('signals', {})
+        stock_text = "\n".join([f"- {name}({code}): {pct}%{mapping_text(mappings.get(code))}{signal_text(signals.get(code))}"
+                                 for name, code, pct in inputs['movers']])
+
+        shard_text = f"\n        【分片】{inputs['shard']}" if inputs.get('shard') else ""
 
         prompt = f"""
-        请以JSON格式输出股市分析。
+        请以JSON格式输出股市分析。{shard_text}
         【市场数据】美股板块：{us_text}。持仓异动：{stock_text}
         【JSON结构】
         {{
@@ -50,23 +360,4 @@ class PortfolioAnalyzer:
             "top_picks": [{{ "stock_name": "股票名", "stock_code": "代码", "action": "关注", "reason": "简述" }}]
         }}
         """
-
-        try:
-            response = self.model.generate_content(prompt)
-            text = response.text.strip()
-            match = re.search(r'\{.*\}', text, re.DOTALL)
-            if match: text = match.group(0)
-            
-            analysis_result = json.loads(text)
-            # 🔥 修复：使用北京时间
-            analysis_result['generated_at'] = self.get_beijing_time()
-            return analysis_result
-
-        except Exception as e:
-            return {
-                "market_summary": f"AI 连接受限: {str(e)[:50]}...",
-                "sector_analysis": [], "top_picks": [],
-                "trading_strategy": "暂停操作",
-                "generated_at": self.get_beijing_time(),
-                "fallback": True
-            }
+        return prompt
@@ -0,0 +1,157 @@
+import os
+import numpy as np
+
+# 每个字段一个定长二进制文件，按 市场/标的 分区：
+#   data/bars/<market>/<ticker>/ts.i8      (bar 日期, UTC 秒)
+#   data/bars/<market>/<ticker>/close.f8   (其余字段同理)
+# 只追加不改写（当日未收盘的最后一根 bar 允许原位刷新），读取全部走 np.memmap，零拷贝
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+TS_FILE = 'ts.i8'
+
+
+def market_of(ticker):
+    """根据 Yahoo 代码后缀判断所属市场分区"""
+    if ticker.endswith('.HK'):
+        return 'hk'
+    if ticker.endswith('.SS') or ticker.endswith('.SZ'):
+        return 'cn'
+    return 'us'
+
+
+def to_epoch_seconds(index):
+    """把 DatetimeIndex (可能带时区) 转为 int64 秒"""
+    if getattr(index, 'tz', None) is not None:
+        index = index.tz_localize(None)
+    return np.asarray(index, dtype='datetime64[s]').astype(np.int64)
+
+
+class BarStore:
+    def __init__(self, root='data/bars'):
+        self.root = root
+
+    def _dir(self, ticker):
+        safe = ticker.replace('^', '_').replace('/', '_')
+        return os.path.join(self.root, market_of(ticker), safe)
+
+    def _map(self, path, dtype, mode='r'):
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        itemsize = np.dtype(dtype).itemsize
+        if size < itemsize:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode=mode, shape=(size // itemsize,))
+
+    def __len__(self):
+        return len(self.tickers())
+
+    def tickers(self):
+        """列出已有历史的所有标的目录名"""
+        out = []
+        if not os.path.isdir(self.root):
+            return out
+        for market in sorted(os.listdir(self.root)):
+            mdir = os.path.join(self.root, market)
+            if os.path.isdir(mdir):
+                out.extend(sorted(os.listdir(mdir)))
+        return out
+
+    def length(self, ticker):
+        path = os.path.join(self._dir(ticker), TS_FILE)
+        return os.path.getsize(path) // 8 if os.path.exists(path) else 0
+
+    def last_timestamp(self, ticker):
+        """最后一根已存 bar 的时间戳 (秒)，无历史时返回 None"""
+        ts = self._map(os.path.join(self._dir(ticker), TS_FILE), np.int64)
+        return int(ts[-1]) if len(ts) else None
+
+    def read(self, ticker, start=None, end=None):
+        """按 [start, end] 区间读取，返回 {字段: memmap 切片}，不复制数据"""
+        d = self._dir(ticker)
+        ts = self._map(os.path.join(d, TS_FILE), np.int64)
+        n = len(ts)
+        lo = 0 if start is None else int(np.searchsorted(ts, start, side='left'))
+        hi = n if end is None else int(np.searchsorted(ts, end, side='right'))
+        out = {'ts': ts[lo:hi]}
+        for field in FIELDS:
+            col = self._map(os.path.join(d, f'{field}.f8'), np.float64)
+            # 列文件可能比 ts 更长（写到一半中断），以 ts 长度为准
+            out[field] = col[:n][lo:hi] if len(col) >= n else np.full(hi - lo, np.nan)
+        return out
+
+    def tail(self, ticker, n):
+        """读取最后 n 根 bar（零拷贝）"""
+        total = self.length(ticker)
+        if total == 0:
+            return self.read(ticker, start=0, end=-1)
+        ts = self._map(os.path.join(self._dir(ticker), TS_FILE), np.int64)
+        return self.read(ticker, start=int(ts[max(total - n, 0)]))
+
+    def close_panel(self, tickers, n=2, field='close'):
+        """把多只标的最后 n 根 bar 右对齐拼成 (n, 标的数) 矩阵，缺失处补 NaN"""
+        return self.panels(tickers, n, (field,))[field]
+
+    def panels(self, tickers, n=2, fields=('ts', 'close')):
+        """一次读取多个字段的右对齐面板 {字段: (n, 标的数) 矩阵}；ts 以 float 存放，缺失同样为 NaN"""
+        out = {f: np.full((n, len(tickers)), np.nan) for f in fields}
+        for j, ticker in enumerate(tickers):
+            bars = self.tail(ticker, n)
+            for f in fields:
+                col = bars[f]
+                if len(col):
+                    out[f][n - len(col):, j] = col
+        return out
+
+    def append(self, ticker, ts, columns):
+        """追加新 bar；与最后一根同一时间戳的 bar 视为盘中刷新，原位覆盖。返回新增行数"""
+        ts = np.asarray(ts, dtype=np.int64)
+        if len(ts) == 0:
+            return 0
+        d = self._dir(ticker)
+        os.makedirs(d, exist_ok=True)
+        ts_path = os.path.join(d, TS_FILE)
+        cols = {f: np.asarray(columns.get(f, np.full(len(ts), np.nan)), dtype=np.float64) for f in FIELDS}
+
+        last = self.last_timestamp(ticker)
+        if last is not None:
+            # 刷新最后一根 bar
+            same = np.nonzero(ts == last)[0]
+            if len(same):
+                i = same[-1]
+                n = self.length(ticker)
+                for field in FIELDS:
+                    col = self._map(os.path.join(d, f'{field}.f8'), np.float64, mode='r+')
+                    if len(col) >= n:
+                        col[n - 1] = cols[field][i]
+                        col.flush()
+                        del col
+            keep = ts > last
+            ts = ts[keep]
+            cols = {f: v[keep] for f, v in cols.items()}
+            if len(ts) == 0:
+                return 0
+
+        order = np.argsort(ts, kind='stable')
+        ts = ts[order]
+        # 上次写到一半中断时，截掉数据列多出的尾巴，保持与 ts 对齐
+        n = self.length(ticker)
+        for field in FIELDS:
+            path = os.path.join(d, f'{field}.f8')
+            if os.path.exists(path) and os.path.getsize(path) > n * 8:
+                os.truncate(path, n * 8)
+        # 先写数据列，最后写 ts，保证中途崩溃时 ts 长度不会超过数据列
+        for field in FIELDS:
+            with open(os.path.join(d, f'{field}.f8'), 'ab') as f:
+                f.write(cols[field][order].tobytes())
+        with open(ts_path, 'ab') as f:
+            f.write(ts.tobytes())
+        return len(ts)
+
+    def append_frame(self, ticker, frame):
+        """把 yfinance 风格的 OHLCV DataFrame 写入存储（自动丢弃收盘价为空的行）"""
+        if frame is None or frame.empty or 'Close' not in frame:
+            return 0
+        frame = frame[frame['Close'].notna()]
+        if frame.empty:
+            return 0
+        columns = {f: frame[f.capitalize()].to_numpy(dtype=np.float64, na_value=np.nan)
+                   for f in FIELDS if f.capitalize() in frame}
+        return self.append(ticker, to_epoch_seconds(frame.index), columns)
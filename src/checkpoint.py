@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+from datetime import datetime
+
+from metrics import metrics
+from renderer import hash_inputs, strip_volatile, atomic_write_json, load_json
+
+
+class Checkpoints:
+    """按阶段落盘的运行检查点：每个阶段的输出连同输入指纹一起写到 root/<阶段>.json
+
+    再次运行时，指纹一致、没有过期、也没有被强制重跑的阶段直接读回上次的输出，
+    失败或超时后重跑只执行缺失或输入已变化的部分。
+    下游阶段的指纹由上游输出的内容摘要 (digest) 组成，上游内容没变时下游整条链都能复用
+    """
+
+    def __init__(self, root='data/cache/stages', force=(), max_age=None):
+        self.root = root
+        # 强制重跑的阶段名；'all' 表示全部，'publish' 同时匹配 'publish.<组合>'
+        self.force = {s.strip() for s in force if s and s.strip()}
+        # {阶段: 秒}，输入来自外部、会随时间变化的阶段（例如行情采集）超过这个时间就不再复用
+        self.max_age = max_age or {}
+        self.digests = {}   # 本次运行各阶段实际输出的摘要
+        self.stamps = {}    # 本次运行各阶段所用输出的生成时间，区分内容相同的两次执行
+        self.lock = threading.Lock()
+
+    def _path(self, stage):
+        return os.path.join(self.root, f'{stage}.json')
+
+    def forced(self, stage):
+        return 'all' in self.force or stage in self.force or stage.split('.', 1)[0] in self.force
+
+    def record(self, stage):
+        return load_json(self._path(stage), None)
+
+    def load(self, stage, fingerprint=None):
+        """返回可复用的阶段输出；指纹不一致、过期或被强制重跑时返回 None"""
+        if self.forced(stage):
+            return None
+        rec = self.record(stage)
+        if rec is None or (fingerprint is not None and rec.get('fingerprint') != fingerprint):
+            return None
+        max_age = self.max_age.get(stage) or self.max_age.get(stage.split('.', 1)[0])
+        if max_age and time.time() - rec.get('saved_at', 0) > max_age:
+            return None
+        return rec
+
+    def save(self, stage, output, fingerprint=None):
+        rec = {
+            'stage': stage,
+            'fingerprint': fingerprint,
+            # 输出内容摘要，去掉时间戳等易变字段，作为下游阶段指纹的一部分
+            'digest': hash_inputs(strip_volatile(output)),
+            'saved_at': time.time(),
+            'saved_at_text': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'output': output,
+        }
+        with self.lock:
+            atomic_write_json(self._path(stage), rec)
+            self.digests[stage] = rec['digest']
+            self.stamps[stage] = rec['saved_at']
+        return rec
+
+    def digest(self, stage):
+        """阶段输出的内容摘要：优先取本次运行的结果，其次取上次的检查点"""
+        if stage in self.digests:
+            return self.digests[stage]
+        rec = self.record(stage)
+        return rec['digest'] if rec else None
+
+    def stamp(self, stage):
+        """阶段输出的生成时间：沿用检查点时是当初执行的时间，重新执行后是这次的时间"""
+        if stage in self.stamps:
+            return self.stamps[stage]
+        rec = self.record(stage)
+        return rec.get('saved_at') if rec else None
+
+    def output(self, stage):
+        """读出阶段的最近一次输出，不校验指纹（供分步子命令衔接）"""
+        rec = self.record(stage)
+        return rec['output'] if rec else None
+
+    def run(self, stage, fingerprint, func, keep=None, valid=None):
+        """有可复用的检查点就直接返回，否则执行 func 并落盘
+
+        keep(输出) 为假时不落盘（例如降级结果）；valid(输出) 为假时不复用（例如产物文件已经不在了）
+        """
+        rec = self.load(stage, fingerprint)
+        if rec is not None and (valid is None or valid(rec['output'])):
+            metrics.incr('checkpoint_hits')
+            print(f"   ♻️ 阶段 {stage} 沿用检查点 ({rec.get('saved_at_text')})")
+            with self.lock:
+                self.digests[stage] = rec['digest']
+                self.stamps[stage] = rec.get('saved_at')
+            return rec['output']
+        out = func()
+        if keep is None or keep(out):
+            self.save(stage, out, fingerprint)
+        else:
+            with self.lock:
+                self.digests[stage] = hash_inputs(strip_volatile(out))
+        return out
@@ -0,0 +1,51 @@
+import gzip
+import json
+
+try:
+    import brotli
+except ImportError:  # brotli 是可选依赖，缺失时只生成 .gz
+    brotli = None
+
+# 数据格式有不兼容变化时递增，前端据此判断能否解析
+SCHEMA_VERSION = 1
+# 这些字段取值重复度高，编码成 字典表 + 下标数组
+DICT_FIELDS = ('sector', 'us_sector', 'map_etf')
+
+
+def to_columnar(rows):
+    """把 [{字段: 值}, ...] 转成 {'count', 'columns': {字段: [值...]}, 'dictionaries': {字段: [取值...]}}
+
+    字段集合取所有行的并集（按首次出现顺序），某行缺失的字段填 None；
+    DICT_FIELDS 中的字段存下标，真实取值在 dictionaries 里
+    """
+    fields = list(dict.fromkeys(k for row in rows for k in row))
+    columns = {f: [row.get(f) for row in rows] for f in fields}
+    dictionaries = {}
+    for f in DICT_FIELDS:
+        if f not in columns:
+            continue
+        table = {}
+        columns[f] = [table.setdefault(v, len(table)) for v in columns[f]]
+        dictionaries[f] = list(table)
+    return {'count': len(rows), 'columns': columns, 'dictionaries': dictionaries}
+
+
+def from_columnar(shard):
+    """to_columnar 的逆过程，供调试和校验使用"""
+    columns = dict(shard['columns'])
+    for f, table in shard.get('dictionaries', {}).items():
+        columns[f] = [table[i] for i in columns[f]]
+    return [{f: columns[f][i] for f in columns} for i in range(shard['count'])]
+
+
+def dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def compress_variants(text):
+    """返回 {后缀: 压缩后的字节}；gzip 固定 mtime=0，保证相同内容输出字节一致"""
+    raw = text.encode('utf-8')
+    out = {'.gz': gzip.compress(raw, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        out['.br'] = brotli.compress(raw, quality=11)
+    return out
@@ -0,0 +1,180 @@
+import os
+import numpy as np
+
+from bar_store import market_of
+from metrics import metrics
+
+SUM_KEYS = ('n', 'sx', 'sy', 'sxx', 'syy', 'sxy')
+DAY = 86400
+
+
+def pair_sums(y, x):
+    """(T, 持仓数) 与 (T, ETF数) 的收益矩阵 → 每对 (持仓, ETF) 的成对有效样本统计量
+
+    NaN 视为缺失，只统计两边都有值的行；全部用矩阵乘法完成，不展开 (T, N, K) 的三维数组
+    """
+    my = (~np.isnan(y)).astype(np.float64)
+    mx = (~np.isnan(x)).astype(np.float64)
+    y0 = np.nan_to_num(y)
+    x0 = np.nan_to_num(x)
+    return {
+        'n': my.T @ mx,
+        'sx': my.T @ x0,
+        'sy': y0.T @ mx,
+        'sxx': my.T @ (x0 * x0),
+        'syy': (y0 * y0).T @ mx,
+        'sxy': y0.T @ x0,
+    }
+
+
+def corr_beta(sums, min_periods):
+    """由统计量算相关系数与 beta（持仓对 ETF 回归的斜率），样本不足的置 NaN"""
+    n = sums['n']
+    cov = n * sums['sxy'] - sums['sx'] * sums['sy']
+    var_x = n * sums['sxx'] - sums['sx'] ** 2
+    var_y = n * sums['syy'] - sums['sy'] ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cov / np.sqrt(var_x * var_y)
+        beta = cov / var_x
+    bad = (n < min_periods) | ~np.isfinite(corr) | ~np.isfinite(beta)
+    return np.where(bad, np.nan, corr), np.where(bad, np.nan, beta)
+
+
+class CorrelationEngine:
+    """港股/A股持仓与美股板块 ETF 的滚动日收益相关系数和 beta
+
+    隔夜对齐：持仓在交易日 D 的收益，对应严格早于 D 的最后一个美股交易日的 ETF 收益
+    （美股收盘在北京时间次日凌晨，当天的港股/A股才能反应）。
+    按市场分别维护窗口内的收益行和成对统计量，新 bar 到来时只加上新行、减掉移出窗口的行，
+    状态落盘到 data/cache，跨运行增量更新
+    """
+
+    def __init__(self, store, window=60, min_periods=20, state_path='data/cache/correlation.npz'):
+        self.store = store
+        self.window = window
+        self.min_periods = min_periods
+        self.state_path = state_path
+        self.states = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with np.load(self.state_path, allow_pickle=False) as z:
+                markets = {k.split('.', 1)[0] for k in z.files}
+                return {m: {k.split('.', 1)[1]: z[k] for k in z.files if k.startswith(m + '.')} for m in markets}
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def _save(self):
+        arrays = {f'{m}.{k}': v for m, state in self.states.items() for k, v in state.items()}
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, self.state_path)
+
+    def log_prices(self, bars, etfs, dates):
+        """在给定日期上取持仓对数收盘价 (日期数, N) 和隔夜对齐的 ETF 对数收盘价 (日期数, K)
+
+        bars 为各持仓的 {ts, close}，当天没有 bar 的位置为 NaN；ETF 取严格早于该日期的最后一根 bar
+        """
+        logp = np.full((len(dates), len(bars)), np.nan)
+        for j, t in enumerate(bars):
+            ts = np.asarray(t['ts'])
+            idx = np.searchsorted(dates, ts)
+            ok = idx < len(dates)
+            ok[ok] = dates[idx[ok]] == ts[ok]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                logp[idx[ok], j] = np.log(np.asarray(t['close'])[ok])
+
+        etf_logp = np.full((len(dates), len(etfs)), np.nan)
+        if len(dates):
+            start = int(dates[0]) - 10 * DAY
+            for k, etf in enumerate(etfs):
+                etf_bars = self.store.read(etf, start=start)
+                pos = np.searchsorted(etf_bars['ts'], dates, side='left') - 1
+                ok = pos >= 0
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    etf_logp[ok, k] = np.log(np.asarray(etf_bars['close'])[pos[ok]])
+        # 非正价格取对数得到 -inf/NaN，一律当缺失
+        logp[~np.isfinite(logp)] = np.nan
+        etf_logp[~np.isfinite(etf_logp)] = np.nan
+        return logp, etf_logp
+
+    def aligned_returns(self, holdings, etfs):
+        """读取最近 window+1 个交易日，返回 (日期, 持仓对数收益 (T, N), 对齐后的 ETF 对数收益 (T, K),
+        最后一行之前那天的持仓对数价格, 同一天的 ETF 对数价格)
+        """
+        tails = [self.store.tail(h, self.window + 1) for h in holdings]
+        dates = np.unique(np.concatenate([t['ts'] for t in tails] + [np.empty(0, np.int64)]))[-(self.window + 1):]
+        logp, etf_logp = self.log_prices(tails, etfs, dates)
+        # 增量更新时从最后一行之前那天的价格接着算
+        base = logp[-2] if len(dates) >= 2 else np.full(len(holdings), np.nan)
+        etf_base = etf_logp[-2] if len(dates) >= 2 else np.full(len(etfs), np.nan)
+        return dates[1:], np.diff(logp, axis=0), np.diff(etf_logp, axis=0), base, etf_base
+
+    def _rebuild(self, holdings, etfs):
+        dates, y, x, base, etf_base = self.aligned_returns(holdings, etfs)
+        return {'holdings': np.array(holdings, dtype=str), 'etfs': np.array(etfs, dtype=str),
+                'dates': dates, 'y': y, 'x': x, 'base': base, 'etf_base': etf_base,
+                'updates': np.array(0), **pair_sums(y, x)}
+
+    def _roll(self, state, holdings, etfs):
+        """增量更新：只读最后一根已存 bar 及之后的数据（盘中 bar 可能被刷新），重算这几行，再把窗口外的行减掉"""
+        if not len(state['dates']):
+            return self._rebuild(holdings, etfs)
+        cutoff = int(state['dates'][-1])
+        bars = [self.store.read(h, start=cutoff) for h in holdings]
+        dates = np.unique(np.concatenate([np.asarray(b['ts']) for b in bars] + [np.empty(0, np.int64)]))
+        if not len(dates):
+            return state
+        logp, etf_logp = self.log_prices(bars, etfs, dates)
+        full = np.vstack([state['base'][None, :], logp])
+        etf_full = np.vstack([state['etf_base'][None, :], etf_logp])
+        keep = state['dates'] < cutoff
+        stale = pair_sums(state['y'][~keep], state['x'][~keep])
+        y_new, x_new = np.diff(full, axis=0), np.diff(etf_full, axis=0)
+        added = pair_sums(y_new, x_new)
+        dates = np.concatenate([state['dates'][keep], dates])
+        y = np.concatenate([state['y'][keep], y_new])
+        x = np.concatenate([state['x'][keep], x_new])
+        drop = max(len(dates) - self.window, 0)
+        dropped = pair_sums(y[:drop], x[:drop])
+        sums = {k: state[k] - stale[k] + added[k] - dropped[k] for k in SUM_KEYS}
+        return {**state, 'dates': dates[drop:], 'y': y[drop:], 'x': x[drop:],
+                'base': full[-2], 'etf_base': etf_full[-2],
+                'updates': np.array(int(state['updates']) + 1), **sums}
+
+    def update(self, holdings, etfs):
+        """更新统计量并返回每只持仓最相关的 ETF: {代码: {'etf', 'corr', 'beta', 'n'}}"""
+        mappings = {}
+        by_market = {}
+        for h in holdings:
+            by_market.setdefault(market_of(h), []).append(h)
+        for market, members in by_market.items():
+            state = self.states.get(market)
+            same = (state is not None and 'base' in state and state['holdings'].tolist() == members
+                    and state['etfs'].tolist() == list(etfs))
+            # 标的集合变化时全量重建；增量滚过一整个窗口后也重建一次，消除浮点累积误差
+            if not same or int(state['updates']) >= self.window:
+                metrics.incr('correlation_rebuilds')
+                state = self._rebuild(members, etfs)
+            else:
+                state = self._roll(state, members, etfs)
+            self.states[market] = state
+            mappings.update(self.best(state))
+        self._save()
+        return mappings
+
+    def best(self, state):
+        corr, beta = corr_beta(state, self.min_periods)
+        etfs = state['etfs'].tolist()
+        out = {}
+        for i, h in enumerate(state['holdings'].tolist()):
+            if not np.isfinite(corr[i]).any():
+                continue
+            k = int(np.nanargmax(corr[i]))
+            out[h] = {'etf': etfs[k], 'corr': round(float(corr[i, k]), 2),
+                      'beta': round(float(beta[i, k]), 2), 'n': int(state['n'][i, k])}
+        return out
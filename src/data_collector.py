@@ -1,44 +1,185 @@
-import yfinance as yf
-import pandas as pd
-from datetime import datetime
+from datetime import datetime, timezone
 import time
+import numpy as np
+
+from bar_store import BarStore, market_of
+from market_data import YahooProvider
+from download_scheduler import DownloadScheduler
+from correlation import CorrelationEngine
+from indicators import IndicatorEngine
+from risk import RiskEngine
+from trading_calendar import TradingCalendar
+from renderer import atomic_write_json, load_json
+from metrics import metrics
+from portfolios import yahoo_code, portfolio_book
+
+SECONDS_PER_DAY = 86400
+
+def session_changes(closes, days, ref, prev):
+    """按交易日历对齐的 (价格, 涨跌幅%, 是否有数据)
+
+    closes/days 为 (bar 数, 标的数) 的收盘价与 bar 日期（距 1970-01-01 的天数）面板，
+    ref/prev 为每列所属市场的参考交易日和前一交易日。价格取参考交易日及之前的最后一个收盘；
+    参考交易日当天有 bar 时，涨跌幅相对前一交易日及之前的最后一个收盘，否则（停牌、当天数据未到）为 0，
+    不把上一个交易日的涨跌当成今天的。休市日上多出来的 bar 不会被当成前收
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    rows = np.arange(closes.shape[0])[:, None]
+    cols = np.arange(closes.shape[1])
+    valid = ~np.isnan(closes) & ~np.isnan(days)
+
+    def last_row(mask):
+        return np.where(mask, rows, -1).max(axis=0, initial=-1)
+
+    any_i = last_row(valid)
+    cur_i = last_row(valid & (days <= ref))
+    prev_i = last_row(valid & (days <= prev))
+    # 存储里的数据比参考交易日还新（时钟落后于数据）时退回最后一根 bar
+    cur_i = np.where(cur_i >= 0, cur_i, any_i)
+
+    has_data = cur_i >= 0
+    last = np.where(has_data, closes[np.maximum(cur_i, 0), cols], 0.0)
+    on_ref = has_data & (days[np.maximum(cur_i, 0), cols] == ref)
+    prev_close = np.where(on_ref & (prev_i >= 0), closes[np.maximum(prev_i, 0), cols], np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = (last - prev_close) / prev_close * 100
+    pct = np.where(np.isfinite(pct), pct, 0.0)
+    return last, pct, has_data
+
 
 class DataCollector:
-    def __init__(self):
-        # 你的美股板块映射
+    def __init__(self, provider=None, store=None, scheduler=None, correlation=None, indicators=None,
+                 calendar=None, state_path='data/cache/fetch_state.json', clock=None, risk=None):
+        # 行情源：默认 Yahoo，离线测试/压测时可换成 ReplayProvider
+        self.provider = provider or YahooProvider()
+        # 分块并发下载 + 重试退避 + 全局限流
+        self.scheduler = scheduler or DownloadScheduler(self.provider)
+        # 本地行情存储：先读存量历史，只向 Yahoo 请求增量 bar
+        self.store = store or BarStore()
+        # 本地没有历史的新标的，首次补齐的历史长度（要够滚动相关性的窗口）
+        self.seed_period = '6mo'
+        # 持仓与美股板块 ETF 的滚动相关性/beta，决定每只持仓实际映射到哪只 ETF
+        self.correlation = correlation or CorrelationEngine(self.store)
+        # 持仓的技术指标（均线/RSI/波动率/量比/跳空），滚动状态增量更新
+        self.indicators = indicators or IndicatorEngine(self.store)
+        # 持仓收益窗口与协方差（低秩形式），给各组合算加权盈亏、暴露、波动率、VaR/ES 和风险贡献
+        self.risk = risk or RiskEngine(self.store)
+        # 交易日历：判断各市场自上次抓取后有没有新的交易时段，以及涨跌幅该对比哪一天的收盘
+        self.calendar = calendar or TradingCalendar()
+        # 各市场上次成功抓取的时间和待重试的标的，跨运行保留
+        self.state_path = state_path
+        # 当前时间来源，离线回放/压测时固定到数据的日期
+        self.clock = clock or time.time
+
+        # 板块 ETF 以配置里的 us_sector_etfs 为准，这里补充几只主题 ETF
         self.us_etfs = {
-            "XLK": "科技(映射小米/芯片)",
-            "XLY": "可选消费(映射汽车/家电)",
-            "XLV": "医疗(映射医药)",
-            "XLC": "通讯(映射互联网)",
-            "KWEB": "中概股互联(港股风向)",
-            "SOXX": "半导体(映射A股芯片)"
+            "KWEB": "中概股互联",
+            "SOXX": "半导体"
         }
 
     def _format_code(self, code, market):
         """将代码转换为 Yahoo Finance 格式"""
-        code = str(code).strip()
-        if market == 'HK':
-            # 港股：去掉前缀，补足4位，加 .HK (例: 0700 -> 0700.HK)
-            clean_code = code.replace('.HK', '')
-            return f"{clean_code.zfill(4)}.HK"
-        elif market == 'A':
-            # A股：保持原后缀 (例: 600519.SS, 000858.SZ)
-            # 如果配置里没有后缀，需要自己判断 (6开头.SS, 其他.SZ)
-            if '.' in code:
-                return code.replace('.SH', '.SS') # YF用SS代表上海
+        return yahoo_code(code, market)
+
+    def _plan_downloads(self, symbols):
+        """拆分出无历史的新标的，已有历史的标的按增量起始日分组：{起始日: [代码]}
+
+        每组单独请求，个别停更很久的标的不会把整批的起始日拖回去
+        """
+        seed = []
+        groups = {}
+        for sym in symbols:
+            ts = self.store.last_timestamp(sym)
+            if ts is None:
+                seed.append(sym)
             else:
-                return f"{code}.SS" if code.startswith('6') else f"{code}.SZ"
-        return code
+                start = datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d')
+                groups.setdefault(start, []).append(sym)
+        return seed, dict(sorted(groups.items()))
 
-    def collect_all(self, config):
-        print(f"\n🚀 [数据引擎] 启动全网扫描 - {datetime.now().strftime('%H:%M:%S')}")
-        
-        # 1. 准备股票列表
+    def _plan_markets(self, symbols, state, now):
+        """按交易日历筛掉自上次抓取以来没有交易时段的市场，返回 (要抓的标的, 休市跳过的市场)
+
+        没有历史的新标的和上次下载失败的标的总是要抓
+        """
+        fetched = state.get('markets', {})
+        idle = {m for m, cal in self.calendar.markets.items() if not cal.traded_between(fetched.get(m), now)}
+        retry = set(state.get('retry', []))
+        todo = [s for s in symbols if market_of(s) not in idle or s in retry
+                or self.store.last_timestamp(s) is None]
+        return todo, idle
+
+    def _save_state(self, state, symbols, failures, now):
+        """记录本次抓到的市场；失败的标的下次无论是否休市都重试"""
+        markets = state.setdefault('markets', {})
+        for m in {market_of(s) for s in symbols}:
+            markets[m] = now
+        retry = set(state.get('retry', [])) - set(symbols)
+        state['retry'] = sorted(retry | set(failures))
+        atomic_write_json(self.state_path, state)
+
+    def _session_days(self, symbols, now):
+        """每只标的所属市场的 (参考交易日, 前一交易日)，以距 1970-01-01 的天数表示"""
+        days = {}
+        for m, cal in self.calendar.markets.items():
+            ref = cal.reference_session(now)
+            days[m] = (ref.astype(np.int64), cal.previous_session(ref).astype(np.int64))
+        pairs = np.array([days[market_of(s)] for s in symbols], dtype=np.float64).reshape(-1, 2)
+        return pairs[:, 0], pairs[:, 1]
+
+    def quotes(self, symbols, now=None, n=8):
+        """从存储读出按交易日历对齐的 (价格, 涨跌幅%, 是否有数据)"""
+        now = self.clock() if now is None else now
+        panels = self.store.panels(symbols, n=n, fields=('ts', 'close'))
+        ref, prev = self._session_days(symbols, now)
+        return session_changes(panels['close'], panels['ts'] // SECONDS_PER_DAY, ref, prev)
+
+    def _store_frames(self, frames):
+        with metrics.span('collect.store', tickers=len(frames)):
+            for sym, hist in frames.items():
+                t0 = time.perf_counter()
+                self.store.append_frame(sym, hist)
+                metrics.observe('store_append', sym, time.perf_counter() - t0)
+
+    def _route(self, result, tickers, infos, price, change_pct, ok, mappings=None, signals=None):
+        """按预先算好的类型掩码把各标的分发到 us_sectors / hk_stocks / a_stocks
+
+        mappings 为相关性引擎给出的 {代码: 最相关 ETF}，写入 map_etf/map_corr/map_beta；
+        signals 为指标引擎给出的 {代码: {指标: 值}}，原样并入持仓行
+        """
+        mappings = mappings or {}
+        signals = signals or {}
+        types = np.array([info['type'] for info in infos])
+        price_list = price.tolist()
+        pct_list = change_pct.tolist()
+        for stock_type, target in [('us_sector', result['us_sectors']),
+                                   ('hk_stock', result['portfolio']['hk_stocks']),
+                                   ('a_stock', result['portfolio']['a_stocks'])]:
+            for i in np.flatnonzero((types == stock_type) & ok).tolist():
+                info = infos[i]
+                item = {
+                    'code': tickers[i],
+                    'name': info.get('name', tickers[i]),
+                    'price': price_list[i],
+                    'change_pct': pct_list[i],
+                    'sector': info.get('sector', ''),
+                    'us_sector': info.get('us_sector', '')
+                }
+                if stock_type != 'us_sector':
+                    m = mappings.get(tickers[i], {})
+                    item.update(map_etf=m.get('etf', ''), map_corr=m.get('corr'), map_beta=m.get('beta'))
+                    item.update(signals.get(tickers[i], {}))
+                target.append(item)
+
+    def build_universe(self, config):
+        """把配置展开成 {yf_code: info}，包含美股板块 ETF、港股和 A股"""
         tickers_map = {} # {yf_code: {info}}
         
         # 处理美股板块
+        etfs = {v['symbol']: v['name'] for v in config.get('us_sector_etfs', {}).values()}
         for symbol, name in self.us_etfs.items():
+            etfs.setdefault(symbol, name)
+        for symbol, name in etfs.items():
             tickers_map[symbol] = {'name': name, 'type': 'us_sector'}
 
         # 处理港股
@@ -50,90 +191,121 @@ class DataCollector:
         for s in config['a_stocks']:
             yf_code = self._format_code(s['code'], 'A')
             tickers_map[yf_code] = {**s, 'type': 'a_stock'}
+        return tickers_map
+
+    def refresh(self, symbols, now=None):
+        """盘中轮询：只抓给定标的的当日 bar 写入存储，返回 ({代码: (价格, 涨跌幅)}, 下载报告)"""
+        symbols = list(symbols)
+        with metrics.span('collect.refresh', tickers=len(symbols)):
+            frames, report = self.scheduler.run(symbols, period='1d')
+            self._store_frames(frames)
+            price, change_pct, has_data = self.quotes(symbols, now)
+        quotes = {}
+        for sym, p, c, ok in zip(symbols, np.round(price, 2).tolist(), np.round(change_pct, 2).tolist(), has_data.tolist()):
+            if ok:
+                quotes[sym] = (p, c)
+        return quotes, report
 
-        # 2. 批量抓取 (一次性抓取几十只，速度极快)
+    def collect_all(self, config):
+        print(f"\n🚀 [数据引擎] 启动全网扫描 - {datetime.now().strftime('%H:%M:%S')}")
+        
+        # 1. 准备股票列表
+        tickers_map = self.build_universe(config)
+
+        # 2. 增量抓取：先查本地存储，只请求最后一根 bar 之后的数据
         all_symbols = list(tickers_map.keys())
         # 添加大盘指数
         all_symbols += ["^GSPC", "^IXIC"] 
         
-        print(f"📡 正在连接 Yahoo Finance 批量下载 {len(all_symbols)} 只标的...")
-        try:
-            # group_by='ticker' 确保返回结构清晰
-            data = yf.download(all_symbols, period="2d", group_by='ticker', progress=False, threads=True)
-        except Exception as e:
-            print(f"❌ 下载严重失败: {e}")
-            return None
+        metrics.incr('tickers_total', len(all_symbols))
+        now = self.clock()
+        state = load_json(self.state_path, {})
+        with metrics.span('collect.plan'):
+            symbols, idle = self._plan_markets(all_symbols, state, now)
+            seed, groups = self._plan_downloads(symbols)
+        metrics.incr('tickers_idle', len(all_symbols) - len(symbols))
+        if idle:
+            names = '/'.join(self.calendar[m].name for m in sorted(idle))
+            print(f"💤 {names} 自上次抓取后没有新的交易时段，沿用本地收盘价")
+        print(f"📡 正在通过 {self.provider.name} 增量下载 {len(symbols)} 只标的 (新标的 {len(seed)} 只)...")
+        failures = {}
+        if seed:
+            with metrics.span('collect.download', mode='seed', tickers=len(seed)):
+                frames, report = self.scheduler.run(seed, period=self.seed_period)
+            self._store_frames(frames)
+            metrics.incr('tickers_fetched', len(frames))
+            failures.update(report.failures)
+        for start, incremental in groups.items():
+            # 起始日包含最后一根已存 bar，用于刷新盘中未收盘的数据
+            with metrics.span('collect.download', mode='incremental', tickers=len(incremental), since=start):
+                frames, report = self.scheduler.run(incremental, start=start)
+            self._store_frames(frames)
+            metrics.incr('tickers_fetched', len(frames))
+            failures.update(report.failures)
+        metrics.incr('tickers_failed', len(failures))
+        if failures:
+            # 部分失败不影响整体：已存历史的标的继续使用本地最新数据
+            print(f"⚠️ 下载失败 {len(failures)} 只: {', '.join(list(failures)[:20])}")
+        if symbols:
+            self._save_state(state, symbols, failures, now)
 
         # 3. 数据清洗与组装
         result = {
             'us_market': {},
             'us_sectors': [],
             'portfolio': {'hk_stocks': [], 'a_stocks': []},
-            'collected_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            'collected_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'fetch_failures': failures,
+            # 各市场涨跌幅所对应的交易日
+            'sessions': {m: str(cal.reference_session(now)) for m, cal in self.calendar.markets.items()}
         }
 
+        # 整个 Close 面板一次性计算：参考交易日收盘 vs 前一交易日收盘 → 涨跌幅
+        indices = [("^GSPC", "sp500"), ("^IXIC", "nasdaq")]
+        tickers = list(tickers_map.keys())
+        with metrics.span('collect.read_panel', tickers=len(tickers) + len(indices)):
+            panels = self.store.panels(tickers + [idx for idx, _ in indices], n=8, fields=('ts', 'close'))
+        with metrics.span('collect.compute'):
+            ref, prev = self._session_days(tickers + [idx for idx, _ in indices], now)
+            price, change_pct, has_data = session_changes(panels['close'], panels['ts'] // SECONDS_PER_DAY,
+                                                          ref, prev)
+            price = np.round(price, 2)
+            change_pct = np.round(change_pct, 2)
+
         # 处理大盘
-        for idx, name in [("^GSPC", "sp500"), ("^IXIC", "nasdaq")]:
-            try:
-                hist = data[idx]
-                if not hist.empty and len(hist) >= 2:
-                    close = hist['Close'].iloc[-1]
-                    prev = hist['Close'].iloc[-2]
-                    pct = ((close - prev) / prev) * 100
-                    result['us_market'][name] = {'price': round(close, 2), 'change_pct': round(pct, 2)}
-                else:
-                    result['us_market'][name] = {'price': 0, 'change_pct': 0}
-            except:
-                result['us_market'][name] = {'price': 0, 'change_pct': 0}
-
-        # 处理个股
-        for ticker, info in tickers_map.items():
-            try:
-                # 获取该股票的历史数据
-                hist = data[ticker]
-                
-                # 如果数据为空（可能停牌或代码错），跳过
-                if hist.empty:
-                    print(f"⚠️ 无数据: {ticker}")
-                    continue
-
-                # 获取最新收盘价（针对时区差异，取最后一行有效数据）
-                # 注意：iloc[-1] 在盘中是实时价，盘后是收盘价
-                latest = hist.iloc[-1]
-                
-                # 计算涨跌幅 (如果只有1天数据，设为0)
-                change_pct = 0.0
-                price = 0.0
-                
-                if len(hist) >= 2:
-                    prev_close = hist['Close'].iloc[-2]
-                    curr_close = hist['Close'].iloc[-1]
-                    price = curr_close
-                    change_pct = ((curr_close - prev_close) / prev_close) * 100
-                elif len(hist) == 1:
-                    price = hist['Close'].iloc[-1]
-
-                # ⚠️ 修正 A股可能出现的价格异常 (Yahoo有时候数据会有拆股问题，但通常 .SS/.SZ 是准的)
-                # 这里假设 Yahoo 返回的是正常的元单位
-
-                item_data = {
-                    'code': ticker,
-                    'name': info.get('name', ticker),
-                    'price': round(float(price), 2),
-                    'change_pct': round(float(change_pct), 2),
-                    'sector': info.get('sector', ''),
-                    'us_sector': info.get('us_sector', '')
-                }
+        n = len(tickers)
+        for j, (idx, name) in enumerate(indices):
+            result['us_market'][name] = {'price': float(price[n + j]), 'change_pct': float(change_pct[n + j])}
+
+        # 如果数据为空（可能停牌或代码错），跳过
+        missing = [t for t, ok in zip(tickers, has_data[:n]) if not ok]
+        metrics.incr('tickers_skipped', len(missing))
+        if missing:
+            print(f"⚠️ 无数据 {len(missing)} 只: {', '.join(missing[:20])}")
+
+        # ⚠️ 修正 A股可能出现的价格异常 (Yahoo有时候数据会有拆股问题，但通常 .SS/.SZ 是准的)
+        # 这里假设 Yahoo 返回的是正常的元单位
+
+        # 持仓 × 板块 ETF 的滚动相关性，按实测最强的 ETF 给持仓打映射标签
+        etfs = [t for t, info in tickers_map.items() if info['type'] == 'us_sector']
+        holdings = [t for t, info in tickers_map.items() if info['type'] != 'us_sector']
+        with metrics.span('collect.correlation', holdings=len(holdings), etfs=len(etfs)):
+            mappings = self.correlation.update(holdings, etfs)
+        with metrics.span('collect.indicators', holdings=len(holdings)):
+            signals = self.indicators.update(holdings, config.get('indicators'))
 
-                if info['type'] == 'us_sector':
-                    result['us_sectors'].append(item_data)
-                elif info['type'] == 'hk_stock':
-                    result['portfolio']['hk_stocks'].append(item_data)
-                elif info['type'] == 'a_stock':
-                    result['portfolio']['a_stocks'].append(item_data)
+        with metrics.span('collect.assemble'):
+            self._route(result, tickers, list(tickers_map.values()), price[:n], change_pct[:n], has_data[:n],
+                        mappings, signals)
 
-            except Exception as e:
-                print(f"⚠️ 处理 {ticker} 出错: {e}")
+        # 合并后的多组合配置带各组合的仓位簿，单一配置直接按自身算一本
+        books = config.get('books') or {'default': portfolio_book(config)}
+        rows = {s['code']: s for s in result['portfolio']['hk_stocks'] + result['portfolio']['a_stocks']}
+        with metrics.span('collect.risk', holdings=len(holdings), books=len(books)):
+            self.risk.update(holdings, config.get('risk'))
+            result['risk_books'] = self.risk.report(books, rows)
+        if 'books' not in config:
+            result['risk'] = result['risk_books']['default']
 
         print(f"✅ 数据清洗完成: 港股 {len(result['portfolio']['hk_stocks'])} | A股 {len(result['portfolio']['a_stocks'])}")
         return result
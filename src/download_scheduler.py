@@ -0,0 +1,151 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+
+def has_bars(frame):
+    """至少有一个有效收盘价才算下载成功；整列 NaN 的结果按失败处理"""
+    if frame is None or frame.empty:
+        return False
+    if 'Close' not in frame.columns:
+        return bool(frame.notna().any().any())
+    return bool(frame['Close'].notna().any())
+
+
+class RateLimiter:
+    """线程安全的令牌桶：全局限制每秒请求数，允许 burst 个突发"""
+
+    def __init__(self, rate=2.0, burst=4):
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1.0):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class DownloadReport:
+    """一次调度的结果汇总：成功标的、逐只失败原因、请求次数"""
+
+    def __init__(self):
+        self.succeeded = []
+        self.failures = {}    # {代码: 失败原因}
+        self.requests = 0
+        self.retries = 0
+        self.elapsed = 0.0
+
+    def summary(self):
+        return {
+            'succeeded': len(self.succeeded),
+            'failed': len(self.failures),
+            'requests': self.requests,
+            'retries': self.retries,
+            'elapsed': round(self.elapsed, 2),
+        }
+
+
+class DownloadScheduler:
+    """把标的切成定长分块并发下载；分块失败带抖动退避重试，最后对缺失标的逐只补抓
+
+    整个过程受全局令牌桶和总时限约束，始终返回已经拿到的部分结果
+    """
+
+    def __init__(self, provider, chunk_size=100, max_workers=4, max_retries=3,
+                 ticker_retries=1, backoff=1.0, max_backoff=20.0, rate=2.0, burst=4, deadline=360):
+        self.provider = provider
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries        # 分块级重试次数
+        self.ticker_retries = ticker_retries  # 逐只补抓的尝试次数
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = RateLimiter(rate, burst)
+        self.deadline = deadline              # 总时限(秒)，留出余量给 workflow 的 10 分钟超时
+
+    def _sleep_backoff(self, attempt, stop_at):
+        # 指数退避 + 全抖动，且不越过总时限
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+        time.sleep(max(0.0, min(delay, stop_at - time.monotonic())))
+
+    def _fetch_with_retry(self, symbols, retries, stop_at, report, lock, parent=None, **kwargs):
+        """返回 (frames, 错误信息)；错误信息为 None 表示请求成功"""
+        error = None
+        for attempt in range(retries + 1):
+            if time.monotonic() >= stop_at:
+                return {}, error or 'deadline exceeded'
+            self.limiter.acquire()
+            with lock:
+                report.requests += 1
+                if attempt:
+                    report.retries += 1
+            metrics.incr('download_requests')
+            if attempt:
+                metrics.incr('download_retries')
+            try:
+                with metrics.span('download.request', parent=parent, tickers=len(symbols), attempt=attempt):
+                    return self.provider.fetch(symbols, **kwargs), None
+            except Exception as e:
+                error = str(e)[:200] or e.__class__.__name__
+                if attempt < retries:
+                    self._sleep_backoff(attempt, stop_at)
+        return {}, error
+
+    def run(self, symbols, period=None, start=None):
+        """下载全部标的，返回 ({代码: DataFrame}, DownloadReport)"""
+        began = time.monotonic()
+        stop_at = began + self.deadline if self.deadline else float('inf')
+        report = DownloadReport()
+        lock = threading.Lock()
+        symbols = list(dict.fromkeys(symbols))
+        frames = {}
+        errors = {}
+        if not symbols:
+            return frames, report
+
+        parent = metrics.current()
+        chunks = [symbols[i:i + self.chunk_size] for i in range(0, len(symbols), self.chunk_size)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            # 第一轮：分块下载
+            futures = [(chunk, pool.submit(self._fetch_with_retry, chunk, self.max_retries, stop_at,
+                                           report, lock, parent, period=period, start=start))
+                       for chunk in chunks]
+            for chunk, fut in futures:
+                got, error = fut.result()
+                frames.update({s: f for s, f in got.items() if has_bars(f)})
+                for sym in chunk:
+                    if sym not in frames:
+                        errors[sym] = error or 'no data'
+
+            # 第二轮：缺失标的逐只补抓
+            missing = [s for s in symbols if s not in frames]
+            if missing and self.ticker_retries > 0:
+                futures = [(sym, pool.submit(self._fetch_with_retry, [sym], self.ticker_retries - 1, stop_at,
+                                             report, lock, parent, period=period, start=start))
+                           for sym in missing]
+                for sym, fut in futures:
+                    got, error = fut.result()
+                    hist = got.get(sym)
+                    if has_bars(hist):
+                        frames[sym] = hist
+                        errors.pop(sym, None)
+                    elif error:
+                        errors[sym] = error
+
+        report.succeeded = [s for s in symbols if s in frames]
+        report.failures = {s: errors.get(s, 'no data') for s in symbols if s not in frames}
+        report.elapsed = time.monotonic() - began
+        return frames, report
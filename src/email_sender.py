@@ -1,70 +1,84 @@
-import resend
+import io
 import os
+import time
 from datetime import datetime
 
-class EmailSender:
-    def __init__(self, api_key, from_email):
-        resend.api_key = api_key
-        self.from_email = from_email
-        
-    def create_email_html(self, data, analysis):
-        # 辅助函数
-        def change_color(val): return '#d32f2f' if val > 0 else '#388e3c' if val < 0 else '#666'
-        def change_bg(val): return '#ffebee' if val > 2 else '#e8f5e9' if val < -2 else '#f9f9f9'
-
-        # 生成美股板块卡片
-        sector_cards = ""
-        if data.get('us_sectors'):
-            sorted_sectors = sorted(data['us_sectors'], key=lambda x: x.get('change_pct', 0), reverse=True)
-            for s in sorted_sectors:
-                pct = s.get('change_pct', 0)
-                # 🔥 修复点：这里改成 code
-                sector_cards += f"""
-                <div style="background:{change_bg(pct)}; border-left:4px solid {change_color(pct)}; padding:10px; margin-bottom:8px; border-radius:4px;">
+from metrics import metrics
+from renderer import change_color, change_bg, compile_template, StreamWriter, hash_inputs, strip_volatile
+from outbox import Outbox, ResendTransport
+from indicators import mover_score, signal_rows, signal_text
+
+# 🔥 修复点：这里改成 code
+SECTOR_CARD = compile_template("""
+                <div style="background:{bg}; border-left:4px solid {color}; padding:10px; margin-bottom:8px; border-radius:4px;">
                     <div style="display:flex; justify-content:space-between; font-size:12px; color:#666;">
-                        <span>{s['name']}</span>
-                        <span>{s['code']}</span> 
+                        <span>{name}</span>
+                        <span>{code}</span> 
                     </div>
-                    <div style="font-weight:bold; font-size:16px; color:{change_color(pct)};">
+                    <div style="font-weight:bold; font-size:16px; color:{color};">
                         {pct:+.2f}%
                     </div>
                 </div>
-                """
+                """)
 
-        # 生成重点关注
-        picks_html = ""
-        if analysis.get('top_picks'):
-            for pick in analysis['top_picks']:
-                picks_html += f"""
+PICK_CARD = compile_template("""
                 <div style="background:#e3f2fd; padding:10px; margin-bottom:8px; border-left:4px solid #2196f3; border-radius:4px;">
-                    <div style="font-weight:bold;">{pick.get('stock_name','')} <span style="font-weight:normal; font-size:12px; color:#666;">{pick.get('stock_code','')}</span></div>
-                    <div style="font-size:13px; color:#333; margin-top:4px;">{pick.get('reason','')}</div>
+                    <div style="font-weight:bold;">{stock_name} <span style="font-weight:normal; font-size:12px; color:#666;">{stock_code}</span></div>
+                    <div style="font-size:13px; color:#333; margin-top:4px;">{reason}</div>
                 </div>
+                """)
+
+ALERTS_TITLE = """
+
+                <h3 style="border-bottom:2px solid #eee; padding-bottom:5px; margin-top:25px;">🔔 触发提醒</h3>
                 """
-        else:
-            picks_html = "<div style='color:#999; font-size:12px;'>暂无重点关注</div>"
 
-        # 组装 HTML
-        html = f"""
+ALERT_ROW = compile_template("""
+                <div style="background:#fce4ec; padding:8px 10px; margin-bottom:6px; border-left:4px solid #e91e63; border-radius:4px; font-size:13px;">{message}</div>
+                """)
+
+SIGNALS_TITLE = """
+
+                <h3 style="border-bottom:2px solid #eee; padding-bottom:5px; margin-top:25px;">📐 技术面异动</h3>
+                """
+
+SIGNAL_ROW = compile_template("""
+                <div style="padding:6px 0; border-bottom:1px solid #f5f5f5; font-size:13px;">
+                    <b>{name}</b> <span style="color:#999; font-size:12px;">{code}</span>
+                    <span style="color:{color}; font-weight:bold;">{pct:+.2f}%</span>
+                    <span style="color:#666; font-size:12px;">{signals}</span>
+                </div>
+                """)
+
+# 技术面异动一节最多列几只
+MAX_SIGNAL_ROWS = 8
+
+NO_PICKS = "<div style='color:#999; font-size:12px;'>暂无重点关注</div>"
+
+EMAIL_HEAD = compile_template("""
         <!DOCTYPE html>
         <html>
         <body style="font-family:sans-serif; color:#333; max-width:600px; margin:0 auto;">
             <div style="background:#2c3e50; color:white; padding:20px; text-align:center; border-radius:8px 8px 0 0;">
                 <h2 style="margin:0;">🚀 基金经理日报</h2>
-                <p style="margin:5px 0 0 0; opacity:0.8; font-size:12px;">{data['collected_at']}</p>
+                <p style="margin:5px 0 0 0; opacity:0.8; font-size:12px;">{collected_at}</p>
             </div>
             
             <div style="padding:20px; border:1px solid #eee; border-top:none;">
                 <div style="background:#fff3e0; padding:15px; border-radius:8px; margin-bottom:20px; border-left:4px solid #ff9800;">
                     <h3 style="margin:0 0 5px 0; font-size:16px;">🤖 AI 核心观点</h3>
-                    <p style="margin:0; font-size:14px; line-height:1.5;">{analysis.get('market_summary', '数据不足')}</p>
+                    <p style="margin:0; font-size:14px; line-height:1.5;">{market_summary}</p>
                 </div>
 
                 <h3 style="border-bottom:2px solid #eee; padding-bottom:5px;">🌎 美股映射</h3>
-                {sector_cards}
+                """)
+
+PICKS_TITLE = """
 
                 <h3 style="border-bottom:2px solid #eee; padding-bottom:5px; margin-top:25px;">🎯 重点机会</h3>
-                {picks_html}
+                """
+
+EMAIL_TAIL = """
                 
                 <div style="text-align:center; margin-top:30px; font-size:12px; color:#999;">
                     <a href="https://github.com/JohnWish1590/stock-monitor" style="color:#2196f3;">查看完整看板</a>
@@ -73,20 +87,114 @@ class EmailSender:
         </body>
         </html>
         """
-        return html
 
-    def send_daily_report(self, to_email, data, analysis):
+class EmailSender:
+    """渲染日报邮件，经落盘的发件箱批量投递；transport 可换成 StubTransport 离线测试"""
+
+    def __init__(self, api_key, from_email, transport=None, outbox=None):
+        self.from_email = from_email
+        self.transport = transport or ResendTransport(api_key)
+        self.outbox = outbox or Outbox()
+        
+    def render_market_sections(self, data):
+        """渲染不依赖 AI 结果的美股板块卡片，可以和 AI 分析并发执行"""
+        buf = io.StringIO()
+        with StreamWriter(buf) as w:
+            # 生成美股板块卡片
+            sorted_sectors = sorted(data.get('us_sectors') or [], key=lambda x: x.get('change_pct', 0), reverse=True)
+            for s in sorted_sectors:
+                pct = s.get('change_pct', 0)
+                SECTOR_CARD.write(w, bg=change_bg(pct, neutral='#f9f9f9'), color=change_color(pct),
+                                  name=s['name'], code=s['code'], pct=pct)
+        return {'sector_cards': buf.getvalue(), 'signals': self.render_signals(data)}
+
+    def render_signals(self, data):
+        """按异动程度列出持仓及其技术指标，没有指标数据时这一节为空"""
+        stocks = data['portfolio']['hk_stocks'] + data['portfolio']['a_stocks']
+        signals = signal_rows(stocks)
+        movers = sorted([s for s in stocks if s['code'] in signals], key=mover_score, reverse=True)[:MAX_SIGNAL_ROWS]
+        if not movers:
+            return ''
+        buf = io.StringIO()
+        with StreamWriter(buf) as w:
+            w.write(SIGNALS_TITLE)
+            for s in movers:
+                pct = s.get('change_pct', 0)
+                SIGNAL_ROW.write(w, name=s['name'], code=s['code'], color=change_color(pct), pct=pct,
+                                 signals=signal_text(signals[s['code']]).strip(' []'))
+        return buf.getvalue()
+
+    def create_email_html(self, data, analysis, sections=None):
+        if sections is None:
+            sections = self.render_market_sections(data)
+
+        # 组装 HTML
+        buf = io.StringIO()
+        with StreamWriter(buf) as w:
+            EMAIL_HEAD.write(w, collected_at=data['collected_at'],
+                             market_summary=analysis.get('market_summary', '数据不足'))
+            w.write(sections['sector_cards'])
+            # 本次新触发的提醒，没有就不显示这一节
+            fired = (data.get('alerts') or {}).get('fired', [])
+            if fired:
+                w.write(ALERTS_TITLE)
+                for a in fired:
+                    ALERT_ROW.write(w, message=a.get('message', ''))
+            w.write(sections.get('signals', ''))
+            w.write(PICKS_TITLE)
+            # 生成重点关注
+            if analysis.get('top_picks'):
+                for pick in analysis['top_picks']:
+                    PICK_CARD.write(w, stock_name=pick.get('stock_name', ''), stock_code=pick.get('stock_code', ''),
+                                    reason=pick.get('reason', ''))
+            else:
+                w.write(NO_PICKS)
+            w.write(EMAIL_TAIL)
+        return buf.getvalue()
+
+    def build_message(self, to_email, data, analysis, sections=None):
+        with metrics.span('email.render'):
+            html = self.create_email_html(data, analysis, sections)
+        return {
+            "from": self.from_email,
+            "to": to_email if isinstance(to_email, list) else [to_email],
+            "subject": f"🚀 [日报] 基金经理投研内参 ({datetime.now().strftime('%m/%d')})",
+            "html": html
+        }
+
+    def queue_daily_report(self, to_email, data, analysis, sections=None, force=False):
+        """渲染并放入发件箱，返回幂等键；同样的收件人和内容已经发过时返回 None
+
+        日报的幂等键由 收件人 + 日期 + 去掉时间戳和本次触发列表后的行情与分析 决定，内容不变的下一次定时运行
+        （包括重新采集后 alerts.fired 变空）不会重复发送；本次新触发的提醒各有一个键，作为别名随日报入队，
+        没发过的提醒照样会触发一封。force=True 时键里加上当前时间，强制再发一封
+        """
+        to = to_email if isinstance(to_email, list) else [to_email]
+        nonce = time.time() if force else None
+        key = hash_inputs(sorted(to), datetime.now().strftime('%Y-%m-%d'),
+                          strip_volatile(data), strip_volatile(analysis), nonce)[:32]
+        fired = (data.get('alerts') or {}).get('fired') or []
+        aliases = [hash_inputs(sorted(to), a.get('rule_id'), a.get('fired_at'), a.get('value'))[:32] for a in fired]
+        message = self.build_message(to, data, analysis, sections)
+        return key if self.outbox.enqueue(message, key, aliases) else None
+
+    def deliver(self):
+        """批量投递发件箱里的全部待发邮件（包括之前运行遗留的），返回 DeliveryReport"""
+        with metrics.span('email.send'):
+            report = self.outbox.flush(self.transport)
+        print(f"   📮 邮件投递: {report.summary()}")
+        return report
+
+    def send_daily_report(self, to_email, data, analysis, sections=None):
         try:
-            html = self.create_email_html(data, analysis)
-            params = {
-                "from": self.from_email,
-                "to": [to_email],
-                "subject": f"🚀 [日报] 基金经理投研内参 ({datetime.now().strftime('%m/%d')})",
-                "html": html
-            }
-            email = resend.Emails.send(params)
-            print(f"✅ 邮件已发送: {email}")
-            return True, email
+            key = self.queue_daily_report(to_email, data, analysis, sections)
+            if key is None:
+                return True, 'duplicate'
+            report = self.deliver()
+            if key in report.sent:
+                print(f"✅ 邮件已发送: {key}")
+                return True, key
+            return False, report.failed.get(key, 'queued for retry')
         except Exception as e:
             print(f"❌ 邮件发送失败: {e}")
             return False, str(e)
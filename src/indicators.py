@@ -0,0 +1,313 @@
+import os
+import json
+import math
+import numpy as np
+
+from metrics import metrics
+
+# 缺省指标集，可以在 portfolio.json 的 indicators 里覆盖
+DEFAULT_INDICATORS = {'sma': [5, 20], 'ema': [12], 'rsi': 14, 'volatility': 20, 'volume': 20}
+TRADING_DAYS = 252
+
+
+def normalize_spec(spec=None):
+    spec = {**DEFAULT_INDICATORS, **(spec or {})}
+    return {'sma': sorted({int(w) for w in spec['sma']}), 'ema': sorted({int(w) for w in spec['ema']}),
+            'rsi': int(spec['rsi']), 'volatility': int(spec['volatility']), 'volume': int(spec['volume'])}
+
+
+def mover_score(s):
+    """异动程度：涨跌幅相对自身日波动的倍数，叠加放量、跳空和 RSI 超买超卖；没有指标时退回涨跌幅绝对值"""
+    pct = abs(s.get('change_pct', 0) or 0)
+    vol = s.get('volatility')
+    score = pct / max(vol / math.sqrt(TRADING_DAYS), 0.5) if vol else pct
+    if (s.get('volume_ratio') or 0) >= 2:
+        score += math.log2(s['volume_ratio'])
+    if abs(s.get('gap_pct') or 0) >= 2:
+        score += 1
+    rsi = s.get('rsi')
+    if rsi is not None and (rsi >= 70 or rsi <= 30):
+        score += 1
+    return score
+
+
+def trend_key(s):
+    """最长的一条均线，用来算价格偏离"""
+    windows = [int(k[4:]) for k in s if k.startswith('sma_') and s[k]]
+    return f'sma_{max(windows)}' if windows else None
+
+
+def ma_gap(s):
+    key = trend_key(s)
+    if not key or not s.get('price'):
+        return None
+    return round((s['price'] / s[key] - 1) * 100, 2)
+
+
+def signal_rows(stocks):
+    """持仓的技术指标摘要 {代码: [RSI, 年化波动%, 量比, 跳空%, 偏离最长均线%]}，全部缺失的持仓不出现"""
+    rows = {}
+    for s in stocks:
+        row = [s.get('rsi'), s.get('volatility'), s.get('volume_ratio'), s.get('gap_pct'), ma_gap(s)]
+        if any(v is not None for v in row):
+            rows[s['code']] = row
+    return rows
+
+
+def signal_text(row):
+    """prompt / 邮件里个股行后面的指标说明，row 为 signal_rows 的一项"""
+    if not row:
+        return ""
+    rsi, vol, ratio, gap, trend = row
+    parts = []
+    if rsi is not None:
+        parts.append(f"RSI{rsi:.0f}")
+    if vol is not None:
+        parts.append(f"波动{vol:.0f}%")
+    if ratio is not None:
+        parts.append(f"量比{ratio:.1f}")
+    if gap:
+        parts.append(f"跳空{gap:+.1f}%")
+    if trend is not None:
+        parts.append(f"偏离均线{trend:+.1f}%")
+    return " [" + " ".join(parts) + "]" if parts else ""
+
+
+class IndicatorEngine:
+    """全部持仓的技术指标：SMA / EMA / RSI / 年化波动率 / 量比 / 跳空，按标的列向量化计算
+
+    每只标的维护滚动状态（收盘价、收益、成交量的环形缓冲区和窗口累加和、EMA、Wilder 平均涨跌），
+    新 bar 到来时每个指标只做 O(1) 的加减，不重算整个窗口。
+    最后一根 bar 可能是盘中未收盘的数据，只在状态的副本上临时推进一步用来出结果，不写回状态；
+    它在下一次运行时变成倒数第二根才正式计入。状态落盘到 data/cache，跨运行增量更新
+    """
+
+    def __init__(self, store, spec=None, state_path='data/cache/indicators.npz', resync_every=250):
+        self.store = store
+        self.spec = normalize_spec(spec)
+        self.state_path = state_path
+        # 滚动累加和每推进这么多步按环形缓冲区重算一次，消除浮点累积误差
+        self.resync_every = resync_every
+        self.state = self._load()
+
+    @property
+    def fields(self):
+        return ([f'sma_{w}' for w in self.spec['sma']] + [f'ema_{w}' for w in self.spec['ema']]
+                + ['rsi', 'volatility', 'volume_ratio', 'gap_pct'])
+
+    def _spec_key(self):
+        return json.dumps(self.spec, sort_keys=True)
+
+    def _load(self):
+        if not os.path.exists(self.state_path):
+            return None
+        try:
+            with np.load(self.state_path, allow_pickle=False) as z:
+                state = {k: z[k] for k in z.files}
+        except (OSError, ValueError, KeyError):
+            return None
+        # 指标配置变了，旧状态作废
+        return state if str(state.get('spec')) == self._spec_key() else None
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, **self.state)
+        os.replace(tmp, self.state_path)
+
+    def _empty(self, n):
+        spec = self.spec
+        wc = max(spec['sma'] + [1])
+        return {
+            'spec': np.array(self._spec_key()),
+            'tickers': np.array([], dtype=str),
+            'last_ts': np.full(n, np.iinfo(np.int64).min, dtype=np.int64),
+            'count': np.zeros(n, np.int64),          # 已计入的 bar 数
+            'prev_close': np.full(n, np.nan),
+            'closes': np.zeros((wc, n)),            # 收盘价环形缓冲区，位置 = count % wc
+            'close_sums': np.zeros((len(spec['sma']), n)),
+            'ema': np.zeros((len(spec['ema']), n)),
+            'avg_gain': np.zeros(n),
+            'avg_loss': np.zeros(n),
+            'rets': np.zeros((spec['volatility'], n)),  # 对数收益环形缓冲区，位置 = (count-1) % 窗口
+            'ret_sum': np.zeros(n),
+            'ret_sumsq': np.zeros(n),
+            'volumes': np.zeros((spec['volume'], n)),   # 成交量环形缓冲区，位置 = count % 窗口
+            'volume_sum': np.zeros(n),
+            'steps': np.array(0),
+        }
+
+    def _align(self, tickers):
+        """把状态的列对齐到本次的标的列表：已有标的沿用原来的列，新标的从空状态开始"""
+        fresh = self._empty(len(tickers))
+        fresh['tickers'] = np.array(tickers, dtype=str)
+        old = self.state
+        if old is None:
+            return fresh
+        old_index = {t: i for i, t in enumerate(old['tickers'].tolist())}
+        pairs = [(j, old_index[t]) for j, t in enumerate(tickers) if t in old_index]
+        if pairs:
+            new_cols, old_cols = (np.array(c) for c in zip(*pairs))
+            for k, v in fresh.items():
+                if k not in ('spec', 'tickers', 'steps'):
+                    v[..., new_cols] = old[k][..., old_cols]
+            fresh['steps'] = old['steps']
+        return fresh
+
+    def _step(self, st, cols, close, volume):
+        """对 cols 这些列各推进一根 bar（向量化，逐指标 O(1)）"""
+        spec = self.spec
+        count = st['count'][cols]
+        prev = st['prev_close'][cols]
+        has_prev = count > 0
+
+        # 收盘价窗口：放入新值，各 SMA 加上新值、减去移出窗口的值
+        wc = st['closes'].shape[0]
+        for i, w in enumerate(spec['sma']):
+            out_pos = (count - w) % wc
+            leaving = np.where(count >= w, st['closes'][out_pos, cols], 0.0)
+            st['close_sums'][i, cols] += close - leaving
+        st['closes'][count % wc, cols] = close
+
+        # EMA：第一根 bar 直接取收盘价
+        for i, w in enumerate(spec['ema']):
+            alpha = 2.0 / (w + 1)
+            st['ema'][i, cols] = np.where(has_prev, st['ema'][i, cols] + alpha * (close - st['ema'][i, cols]), close)
+
+        # RSI（Wilder）：前 period 个变化取简单平均，之后指数平滑
+        change = np.where(has_prev, close - prev, 0.0)
+        alpha = 1.0 / np.minimum(np.maximum(count, 1), spec['rsi'])
+        upd = np.where(has_prev, alpha, 0.0)
+        st['avg_gain'][cols] += upd * (np.maximum(change, 0) - st['avg_gain'][cols])
+        st['avg_loss'][cols] += upd * (np.maximum(-change, 0) - st['avg_loss'][cols])
+
+        # 对数收益窗口
+        wv = spec['volatility']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ret = np.log(close / prev)
+        ret = np.where(has_prev & np.isfinite(ret), ret, 0.0)
+        nret = np.maximum(count - 1, 0)
+        leaving = np.where(nret >= wv, st['rets'][nret % wv, cols], 0.0)
+        st['ret_sum'][cols] += np.where(has_prev, ret - leaving, 0.0)
+        st['ret_sumsq'][cols] += np.where(has_prev, ret * ret - leaving * leaving, 0.0)
+        sel = np.flatnonzero(has_prev)
+        st['rets'][nret[sel] % wv, cols[sel]] = ret[sel]
+
+        # 成交量窗口
+        wvol = spec['volume']
+        volume = np.nan_to_num(volume)
+        leaving = np.where(count >= wvol, st['volumes'][count % wvol, cols], 0.0)
+        st['volume_sum'][cols] += volume - leaving
+        st['volumes'][count % wvol, cols] = volume
+
+        st['prev_close'][cols] = close
+        st['count'][cols] = count + 1
+
+    def _resync(self, st):
+        """按环形缓冲区重算各窗口累加和"""
+        count = st['count']
+        n = count.shape[0]
+        cols = np.arange(n)
+        wc = st['closes'].shape[0]
+        for i, w in enumerate(self.spec['sma']):
+            idx = (count[None, :] - 1 - np.arange(w)[:, None]) % wc
+            valid = np.arange(w)[:, None] < count[None, :]
+            st['close_sums'][i] = np.where(valid, st['closes'][idx, cols], 0.0).sum(axis=0)
+        wv = self.spec['volatility']
+        nret = np.maximum(count - 1, 0)
+        valid = np.arange(wv)[:, None] < np.minimum(nret, wv)[None, :]
+        rets = np.where(valid, st['rets'], 0.0)
+        st['ret_sum'] = rets.sum(axis=0)
+        st['ret_sumsq'] = (rets * rets).sum(axis=0)
+        wvol = self.spec['volume']
+        valid = np.arange(wvol)[:, None] < np.minimum(count, wvol)[None, :]
+        st['volume_sum'] = np.where(valid, st['volumes'], 0.0).sum(axis=0)
+        st['steps'] = np.array(0)
+
+    def _pending(self, tickers, last_ts):
+        """读出每只标的在已计入状态之后的 bar，左对齐成 (bar 数, 标的数) 矩阵，缺失处为 NaN"""
+        reads = [self.store.read(t, start=int(ts) + 1 if ts > np.iinfo(np.int64).min else None)
+                 for t, ts in zip(tickers, last_ts.tolist())]
+        depth = max([len(r['ts']) for r in reads] + [0])
+        mats = {f: np.full((depth, len(tickers)), np.nan) for f in ('open', 'close', 'volume')}
+        ts = np.full((depth, len(tickers)), np.iinfo(np.int64).min, dtype=np.int64)
+        for j, r in enumerate(reads):
+            k = len(r['ts'])
+            if k:
+                ts[:k, j] = r['ts']
+                for f in mats:
+                    mats[f][:k, j] = r[f]
+        # 收盘价无效的 bar 当作不存在
+        mats['close'][~(mats['close'] > 0)] = np.nan
+        return ts, mats
+
+    def update(self, tickers, spec=None):
+        """推进状态并返回 {代码: {指标: 值}}；spec 为 portfolio.json 里的 indicators 配置"""
+        tickers = list(tickers)
+        if spec is not None and normalize_spec(spec) != self.spec:
+            self.spec = normalize_spec(spec)
+            self.state = None
+        st = self.state
+        if st is None or st['tickers'].tolist() != tickers:
+            metrics.incr('indicator_realigns')
+            st = self._align(tickers)
+
+        ts, mats = self._pending(tickers, st['last_ts'])
+        valid = ~np.isnan(mats['close'])
+        rows = np.arange(len(ts))[:, None]
+        last_i = np.where(valid, rows, -1).max(axis=0, initial=-1)
+        # 每只标的最后一根有效 bar 暂不计入，只对之前的 bar 正式推进
+        commit = valid & (rows < last_i[None, :])
+        for row in range(len(ts)):
+            cols = np.flatnonzero(commit[row])
+            if len(cols):
+                self._step(st, cols, mats['close'][row, cols], mats['volume'][row, cols])
+                st['last_ts'][cols] = ts[row, cols]
+                st['steps'] = np.array(int(st['steps']) + 1)
+        if int(st['steps']) >= self.resync_every:
+            self._resync(st)
+        metrics.incr('indicator_steps', int(commit.sum()))
+        self.state = st
+        self._save()
+
+        # 在副本上临时推进最后一根 bar
+        live = np.flatnonzero(last_i >= 0)
+        last = {f: np.full(len(tickers), np.nan) for f in mats}
+        for f, m in mats.items():
+            last[f][live] = m[last_i[live], live]
+        view = {k: v.copy() for k, v in st.items()}
+        if len(live):
+            self._step(view, live, last['close'][live], last['volume'][live])
+        return self._values(tickers, st, view, last)
+
+    def _values(self, tickers, committed, view, last):
+        spec = self.spec
+        count = view['count']
+        out = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = {}
+            for i, w in enumerate(spec['sma']):
+                values[f'sma_{w}'] = np.where(count >= w, view['close_sums'][i] / w, np.nan)
+            for i, w in enumerate(spec['ema']):
+                values[f'ema_{w}'] = np.where(count >= w, view['ema'][i], np.nan)
+            rs = view['avg_gain'] / view['avg_loss']
+            rsi = np.where(view['avg_loss'] > 0, 100 - 100 / (1 + rs), 100.0)
+            values['rsi'] = np.where(count > spec['rsi'], rsi, np.nan)
+            wv = spec['volatility']
+            var = (view['ret_sumsq'] - view['ret_sum'] ** 2 / wv) / (wv - 1)
+            values['volatility'] = np.where(count > wv, np.sqrt(np.maximum(var, 0) * TRADING_DAYS) * 100, np.nan)
+            # 量比：最新一根的成交量 / 之前 N 根的平均成交量
+            wvol = spec['volume']
+            mean_volume = committed['volume_sum'] / wvol
+            # 盘中轮询写入的 bar 只有收盘价，没有成交量/开盘价时不给量比和跳空
+            values['volume_ratio'] = np.where((committed['count'] >= wvol) & (mean_volume > 0) & (last['volume'] > 0),
+                                              last['volume'] / mean_volume, np.nan)
+            values['gap_pct'] = np.where(committed['count'] > 0, (last['open'] / committed['prev_close'] - 1) * 100, np.nan)
+        digits = {'rsi': 1, 'volatility': 1}
+        rounded = {k: np.round(v, digits.get(k, 2)).tolist() for k, v in values.items()}
+        for j, t in enumerate(tickers):
+            row = {k: v[j] for k, v in rounded.items() if math.isfinite(v[j])}
+            if row:
+                out[t] = row
+        return out
@@ -0,0 +1,99 @@
+import json
+import time
+import atexit
+import hashlib
+import weakref
+import threading
+
+from renderer import atomic_write_json, load_json
+
+# 进程退出前把还没落盘的访问时间写回；弱引用，不会让用完的缓存对象一直存活到退出
+_open_caches = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_open_caches():
+    for cache in list(_open_caches):
+        cache.flush()
+
+
+class ResponseCache:
+    """模型返回的持久化缓存：按 (模型名, 归一化的 prompt 输入) 的哈希寻址，带 TTL 和条目数上限的 LRU 淘汰
+
+    命中只在内存里更新访问时间，put、flush（每次分析结束时调用）或进程退出时才落盘，命中不必每次重写整个文件
+    """
+
+    def __init__(self, path='data/cache/llm_responses.json', ttl=24 * 3600, max_entries=200):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = None
+        self.dirty = False
+        _open_caches.add(self)
+
+    @staticmethod
+    def make_key(model_name, inputs):
+        payload = json.dumps({'model': model_name, 'inputs': inputs}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = load_json(self.path, {})
+        return self.entries
+
+    def get(self, key):
+        with self.lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            now = time.time()
+            if now - entry['created'] > self.ttl:
+                del entries[key]
+                self.dirty = True
+                return None
+            entry['accessed'] = now
+            self.dirty = True
+            return entry['value']
+
+    def put(self, key, value):
+        with self.lock:
+            entries = self._load()
+            now = time.time()
+            entries[key] = {'created': now, 'accessed': now, 'value': value}
+            # 先清过期条目，再按最近访问时间淘汰到上限以内
+            for k in [k for k, e in entries.items() if now - e['created'] > self.ttl]:
+                del entries[k]
+            if len(entries) > self.max_entries:
+                for k in sorted(entries, key=lambda k: entries[k]['accessed'])[:len(entries) - self.max_entries]:
+                    del entries[k]
+            atomic_write_json(self.path, entries)
+            self.dirty = False
+
+    def flush(self):
+        """把内存里更新过的访问时间写回磁盘"""
+        with self.lock:
+            if self.dirty:
+                atomic_write_json(self.path, self.entries)
+                self.dirty = False
+
+
+class ModelChoiceCache:
+    """记住上一次解析出的可用模型，避免每次启动都调用 list_models"""
+
+    def __init__(self, path='data/cache/model_choice.json', ttl=7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+
+    def get(self, candidates):
+        entry = load_json(self.path, {})
+        if entry.get('candidates') != list(candidates):
+            return None
+        if time.time() - entry.get('resolved_at', 0) > self.ttl:
+            return None
+        return entry.get('model')
+
+    def put(self, candidates, model_name):
+        atomic_write_json(self.path, {'candidates': list(candidates), 'model': model_name,
+                                      'resolved_at': time.time()})
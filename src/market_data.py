@@ -0,0 +1,168 @@
+import os
+import re
+import time
+import random
+import numpy as np
+
+# pandas 只在真正处理行情时才导入，渲染/发信等不碰行情的命令不用付这份启动开销
+
+
+class ProviderError(Exception):
+    """行情源请求失败（网络错误、限流或注入的故障）"""
+
+
+def split_download(data, symbols):
+    """把 yf.download 的 MultiIndex 结果拆成 {代码: 单标的 OHLCV DataFrame}
+
+    下载失败的标的在结果里是整列 NaN，去掉全 NaN 的行后为空的不放进结果
+    """
+    import pandas as pd
+    frames = {}
+    if data is None or data.empty:
+        return frames
+    if isinstance(data.columns, pd.MultiIndex):
+        level0 = set(data.columns.get_level_values(0))
+        picked = {sym: data[sym] for sym in symbols if sym in level0}
+    elif len(symbols) == 1:
+        picked = {symbols[0]: data}
+    else:
+        picked = {}
+    for sym, frame in picked.items():
+        frame = frame.dropna(how='all')
+        if not frame.empty:
+            frames[sym] = frame
+    return frames
+
+
+def period_to_bars(period):
+    """把 yfinance 的 period 字符串 ('2d'/'1mo'/'1y') 换算成交易日 bar 数"""
+    m = re.fullmatch(r'(\d+)(d|wk|mo|y)', period or '')
+    if not m:
+        return None
+    n, unit = int(m.group(1)), m.group(2)
+    return n * {'d': 1, 'wk': 5, 'mo': 21, 'y': 252}[unit]
+
+
+class MarketDataProvider:
+    """行情源接口：fetch 返回 {代码: OHLCV DataFrame}，拿不到数据的标的不出现在结果里"""
+    name = 'base'
+
+    def fetch(self, symbols, period=None, start=None):
+        raise NotImplementedError
+
+
+class YahooProvider(MarketDataProvider):
+    name = 'yahoo'
+
+    def __init__(self, threads=True):
+        self.threads = threads
+
+    def fetch(self, symbols, period=None, start=None):
+        import yfinance as yf
+        symbols = list(symbols)
+        try:
+            # group_by='ticker' 确保返回结构清晰
+            data = yf.download(symbols, period=period if start is None else None, start=start,
+                               group_by='ticker', progress=False, threads=self.threads)
+        except Exception as e:
+            raise ProviderError(str(e)) from e
+        return split_download(data, symbols)
+
+
+class ReplayProvider(MarketDataProvider):
+    """离线回放：从 root/<代码>.csv 读取录制或合成的 OHLCV，可注入延迟与故障"""
+    name = 'replay'
+
+    def __init__(self, root='data/replay', latency=0.0, per_symbol_latency=0.0,
+                 failure_rate=0.0, symbol_failure_rate=0.0, seed=None):
+        self.root = root
+        self.latency = latency                          # 每次请求的固定延迟(秒)
+        self.per_symbol_latency = per_symbol_latency    # 每只标的追加的延迟(秒)
+        self.failure_rate = failure_rate                # 整次请求失败的概率
+        self.symbol_failure_rate = symbol_failure_rate  # 单只标的缺失的概率
+        self.rng = random.Random(seed)
+        self._cache = {}
+
+    def _path(self, sym):
+        return os.path.join(self.root, sym.replace('^', '_') + '.csv')
+
+    def _load(self, sym):
+        if sym not in self._cache:
+            path = self._path(sym)
+            if not os.path.exists(path):
+                self._cache[sym] = None
+            else:
+                import pandas as pd
+                self._cache[sym] = pd.read_csv(path, index_col=0, parse_dates=True)
+        return self._cache[sym]
+
+    def fetch(self, symbols, period=None, start=None):
+        symbols = list(symbols)
+        delay = self.latency + self.per_symbol_latency * len(symbols)
+        if delay > 0:
+            time.sleep(delay)
+        if self.failure_rate and self.rng.random() < self.failure_rate:
+            raise ProviderError(f"injected failure for {len(symbols)} symbols")
+
+        bars = period_to_bars(period)
+        frames = {}
+        for sym in symbols:
+            if self.symbol_failure_rate and self.rng.random() < self.symbol_failure_rate:
+                continue
+            hist = self._load(sym)
+            if hist is None or hist.empty:
+                continue
+            if start is not None:
+                import pandas as pd
+                hist = hist[hist.index >= pd.Timestamp(start)]
+            elif bars is not None:
+                hist = hist.iloc[-bars:]
+            frames[sym] = hist
+        return frames
+
+
+class RecordingProvider(MarketDataProvider):
+    """包装真实行情源，把每次拿到的数据落盘，供 ReplayProvider 回放"""
+    name = 'recording'
+
+    def __init__(self, inner, root='data/replay'):
+        self.inner = inner
+        self.root = root
+
+    def fetch(self, symbols, period=None, start=None):
+        frames = self.inner.fetch(symbols, period=period, start=start)
+        write_frames(frames, self.root)
+        return frames
+
+
+def write_frames(frames, root):
+    """按 ReplayProvider 的目录格式写出 {代码: DataFrame}，同日数据以新的为准"""
+    import pandas as pd
+    os.makedirs(root, exist_ok=True)
+    for sym, hist in frames.items():
+        path = os.path.join(root, sym.replace('^', '_') + '.csv')
+        if os.path.exists(path):
+            old = pd.read_csv(path, index_col=0, parse_dates=True)
+            hist = pd.concat([old, hist])
+            hist = hist[~hist.index.duplicated(keep='last')].sort_index()
+        hist.to_csv(path)
+
+
+def generate_synthetic(symbols, root='data/replay', days=60, end=None, seed=0):
+    """为给定标的生成几何随机游走的日线 OHLCV，写成回放目录"""
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=end or pd.Timestamp.today().normalize(), periods=days, name='Date')
+    frames = {}
+    for sym in symbols:
+        start_price = rng.uniform(5, 500)
+        rets = rng.normal(0, 0.02, size=days)
+        close = start_price * np.exp(np.cumsum(rets))
+        open_ = close * np.exp(rng.normal(0, 0.005, size=days))
+        high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.01, size=days))
+        low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.01, size=days))
+        volume = rng.integers(1e5, 1e7, size=days).astype(float)
+        frames[sym] = pd.DataFrame({'Open': open_, 'High': high, 'Low': low,
+                                    'Close': close, 'Volume': volume}, index=index)
+    write_frames(frames, root)
+    return frames
@@ -0,0 +1,162 @@
+import io
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class Metrics:
+    """运行指标采集：嵌套耗时 span、计数器、逐标的耗时分布，可选 cProfile / tracemalloc
+
+    span 的父子关系按线程维护；在新线程里打开的第一个 span 自动挂到最外层 span 下面
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self, profile=None):
+        self.started = time.perf_counter()
+        self.started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.spans = []
+        self.counters = {}
+        self.timings = {}      # {名称: {key: 秒}}
+        self.root = None
+        self.local = threading.local()
+        # profile: None / 'cpu' / 'memory' / 'all'
+        self.profile = profile
+        self.profiles = []
+        if profile in ('memory', 'all') and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def current(self):
+        """当前线程最内层 span 的 id，用于把线程池里的子 span 挂到正确的父节点"""
+        stack = self._stack()
+        return stack[-1] if stack else self.root
+
+    @contextmanager
+    def span(self, name, parent=None, **attrs):
+        stack = self._stack()
+        if parent is None:
+            parent = stack[-1] if stack else self.root
+        record = {
+            'id': None,
+            'name': name,
+            'parent': parent,
+            'thread': threading.current_thread().name,
+            'start': round(time.perf_counter() - self.started, 6),
+        }
+        if attrs:
+            record['attrs'] = attrs
+        with self.lock:
+            record['id'] = len(self.spans)
+            self.spans.append(record)
+            if self.root is None:
+                self.root = record['id']
+        stack.append(record['id'])
+        t0 = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = str(e)[:200]
+            raise
+        finally:
+            record['duration'] = round(time.perf_counter() - t0, 6)
+            stack.pop()
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, key, seconds):
+        """记录逐项耗时（例如逐只标的的写盘时间）"""
+        with self.lock:
+            self.timings.setdefault(name, {})[key] = seconds
+
+    def run_profiled(self, func, *args, **kwargs):
+        """cpu 模式下用独立的 cProfile 跑 func（cProfile 只跟踪当前线程），结果在 write 时合并"""
+        if self.profile not in ('cpu', 'all'):
+            return func(*args, **kwargs)
+        prof = cProfile.Profile()
+        try:
+            return prof.runcall(func, *args, **kwargs)
+        finally:
+            with self.lock:
+                self.profiles.append(prof)
+
+    def _timing_summary(self, values, top=10):
+        items = sorted(values.items(), key=lambda kv: kv[1], reverse=True)
+        secs = sorted(v for _, v in items)
+        n = len(secs)
+        return {
+            'count': n,
+            'total': round(sum(secs), 6),
+            'p50': round(secs[n // 2], 6) if n else 0,
+            'p95': round(secs[min(n - 1, int(n * 0.95))], 6) if n else 0,
+            'max': round(secs[-1], 6) if n else 0,
+            'slowest': [{'key': k, 'seconds': round(v, 6)} for k, v in items[:top]],
+        }
+
+    def _cpu_profile(self, top=30):
+        if not self.profiles:
+            return None
+        stats = pstats.Stats(self.profiles[0], stream=io.StringIO())
+        for prof in self.profiles[1:]:
+            stats.add(prof)
+        rows = []
+        for (filename, line, func), (cc, nc, tt, ct, _) in stats.stats.items():
+            rows.append({'function': f"{os.path.basename(filename)}:{line}({func})",
+                         'calls': nc, 'tottime': round(tt, 6), 'cumtime': round(ct, 6)})
+        rows.sort(key=lambda r: r['cumtime'], reverse=True)
+        return rows[:top]
+
+    def _memory_profile(self, top=20):
+        if not tracemalloc.is_tracing():
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        return {
+            'current_bytes': current,
+            'peak_bytes': peak,
+            'top': [{'location': str(stat.traceback[0]), 'size_bytes': stat.size, 'count': stat.count}
+                    for stat in snapshot.statistics('lineno')[:top]],
+        }
+
+    def to_dict(self):
+        with self.lock:
+            spans = [dict(s) for s in self.spans]
+            counters = dict(self.counters)
+            timings = {k: dict(v) for k, v in self.timings.items()}
+        out = {
+            'started_at': self.started_at,
+            'elapsed': round(time.perf_counter() - self.started, 6),
+            'spans': spans,
+            'counters': counters,
+            'timings': {name: self._timing_summary(v) for name, v in timings.items()},
+        }
+        if self.profile in ('cpu', 'all'):
+            out['cpu_profile'] = self._cpu_profile()
+        if self.profile in ('memory', 'all'):
+            out['memory_profile'] = self._memory_profile()
+        return out
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=1)
+        return path
+
+
+# 进程级默认实例，各模块直接 from metrics import metrics 使用
+metrics = Metrics()
@@ -0,0 +1,220 @@
+import os
+import glob
+import time
+import random
+import hashlib
+import threading
+
+from download_scheduler import RateLimiter
+from renderer import atomic_write_json, load_json
+from metrics import metrics
+
+RESEND_BATCH_URL = 'https://api.resend.com/emails/batch'
+# Resend 批量接口单次最多 100 封
+MAX_BATCH = 100
+
+
+class TransportError(Exception):
+    """发送失败；retryable 表示限流/服务端错误等可以重试的情况"""
+
+    def __init__(self, message, status=None, retryable=True):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class ResendTransport:
+    """Resend 批量发送接口，复用同一个 HTTP 会话（连接池 + keep-alive）"""
+    name = 'resend'
+
+    def __init__(self, api_key, session=None, url=RESEND_BATCH_URL, timeout=30):
+        import requests
+        self.url = url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.session.headers.update({'Authorization': f'Bearer {api_key}'})
+
+    def send_batch(self, messages, idempotency_key):
+        """发送一批邮件，返回各封的 id；同一个 idempotency_key 重复提交时 Resend 不会重复投递"""
+        try:
+            resp = self.session.post(self.url, json=messages, timeout=self.timeout,
+                                     headers={'Idempotency-Key': idempotency_key})
+        except Exception as e:
+            raise TransportError(str(e)[:200] or e.__class__.__name__)
+        if resp.status_code >= 400:
+            retryable = resp.status_code == 429 or resp.status_code >= 500
+            raise TransportError(f"HTTP {resp.status_code}: {resp.text[:200]}", resp.status_code, retryable)
+        return [item.get('id') for item in resp.json().get('data', [])]
+
+
+class StubTransport:
+    """本地替身：不联网，记录每批发送内容，可注入延迟和失败；同一个幂等键只投递一次"""
+    name = 'stub'
+
+    def __init__(self, latency=0.0, failure_rate=0.0, fail_status=503, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fail_status = fail_status
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.batches = {}     # {幂等键: [邮件, ...]}
+
+    @property
+    def sent(self):
+        return [m for batch in self.batches.values() for m in batch]
+
+    def send_batch(self, messages, idempotency_key):
+        with self.lock:
+            self.calls += 1
+            fail = self.failure_rate and self.rng.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise TransportError(f"stub injected HTTP {self.fail_status}", self.fail_status,
+                                 self.fail_status == 429 or self.fail_status >= 500)
+        with self.lock:
+            batch = self.batches.setdefault(idempotency_key, list(messages))
+        return [f"stub-{idempotency_key[:8]}-{i}" for i in range(len(batch))]
+
+
+class DeliveryReport:
+    def __init__(self):
+        self.sent = []        # 已投递的幂等键
+        self.failed = {}      # {幂等键: 原因}，不可重试或已过期
+        self.pending = []     # 留待下次运行重试的幂等键
+        self.requests = 0
+        self.retries = 0
+
+    def summary(self):
+        return {'sent': len(self.sent), 'failed': len(self.failed), 'pending': len(self.pending),
+                'requests': self.requests, 'retries': self.retries}
+
+
+class Outbox:
+    """落盘的发件箱：渲染好的邮件先写入 pending/，投递成功后记入 sent/，彻底失败的移到 failed/
+
+    每封邮件以幂等键命名，已在 sent/ 里的键不会再次入队，所以下一次定时运行
+    或者运行中途超时重跑都不会重复发送；没发出去的邮件留在 pending/，下次运行接着发
+    """
+
+    def __init__(self, root='data/cache/outbox', max_age=12 * 3600, keep_sent=7 * 86400):
+        self.root = root
+        self.max_age = max_age          # 超过这个时间还没发出去的日报不再补发
+        self.keep_sent = keep_sent      # sent/ 里的记录保留多久
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    def _path(self, state, key):
+        return os.path.join(self.root, state, f'{key}.json')
+
+    def _known(self, keys):
+        """keys 中已发送或已在队列里（包括作为别名）的键"""
+        known = {k for k in keys
+                 if os.path.exists(self._path('sent', k)) or os.path.exists(self._path('pending', k))}
+        if len(known) < len(keys):
+            for entry in self.pending():
+                known.update(k for k in entry.get('aliases', ()) if k in keys)
+        return known
+
+    def enqueue(self, message, key, aliases=()):
+        """入队一封邮件，返回是否新入队
+
+        aliases 是这封邮件同时代表的其他幂等键（例如本次新触发的提醒）：全部键都已发送或已在队列里时跳过，
+        投递成功后所有键都记为已发送
+        """
+        keys = [key, *aliases]
+        with self.lock:
+            if len(self._known(keys)) == len(keys):
+                return False
+            atomic_write_json(self._path('pending', key),
+                              {'key': key, 'aliases': list(aliases), 'message': message,
+                               'created_at': time.time(), 'attempts': 0})
+        metrics.incr('outbox_enqueued')
+        return True
+
+    def pending(self):
+        entries = [load_json(p, None) for p in glob.glob(os.path.join(self.root, 'pending', '*.json'))]
+        return sorted([e for e in entries if e], key=lambda e: e['created_at'])
+
+    def _finish(self, entry, state, **fields):
+        record = {'key': entry['key'], 'to': entry['message'].get('to'),
+                  'subject': entry['message'].get('subject'), 'created_at': entry['created_at'],
+                  'attempts': entry['attempts'], **fields}
+        atomic_write_json(self._path(state, entry['key']), record)
+        if state == 'sent':
+            for alias in entry.get('aliases', ()):
+                atomic_write_json(self._path('sent', alias), {**record, 'key': alias, 'alias_of': entry['key']})
+        os.remove(self._path('pending', entry['key']))
+
+    def _prune_sent(self, now):
+        for path in glob.glob(os.path.join(self.root, 'sent', '*.json')):
+            if now - os.path.getmtime(path) > self.keep_sent:
+                os.remove(path)
+
+    def flush(self, transport, batch_size=MAX_BATCH, limiter=None, max_retries=4, backoff=1.0,
+              max_backoff=30.0, deadline=120):
+        """把 pending/ 里的邮件按批发送：令牌桶限流，可重试的失败做指数退避（带抖动）
+
+        超过重试次数或总时限仍未发出的留在 pending/，下次运行继续；返回 DeliveryReport
+        """
+        # 同一进程里不允许两个 flush 同时取同一批 pending
+        with self.flush_lock:
+            return self._flush(transport, batch_size, limiter or RateLimiter(rate=2.0, burst=2),
+                               max_retries, backoff, max_backoff, deadline)
+
+    def _flush(self, transport, batch_size, limiter, max_retries, backoff, max_backoff, deadline):
+        report = DeliveryReport()
+        stop_at = time.monotonic() + deadline if deadline else float('inf')
+        now = time.time()
+        live = []
+        for entry in self.pending():
+            if now - entry['created_at'] > self.max_age:
+                self._finish(entry, 'failed', error='expired')
+                report.failed[entry['key']] = 'expired'
+            else:
+                live.append(entry)
+
+        batches = [live[i:i + batch_size] for i in range(0, len(live), batch_size)]
+        for batch in batches:
+            keys = ['+'.join([e['key'], *e.get('aliases', ())]) for e in batch]
+            # 批次的幂等键由成员（连同别名）决定，超时重试同一批时服务端会去重
+            batch_key = hashlib.sha256('|'.join(keys).encode('utf-8')).hexdigest()[:32]
+            error = None
+            for attempt in range(max_retries + 1):
+                if time.monotonic() >= stop_at:
+                    error = error or TransportError('deadline exceeded')
+                    break
+                limiter.acquire()
+                report.requests += 1
+                if attempt:
+                    report.retries += 1
+                    metrics.incr('email_retries')
+                try:
+                    with metrics.span('email.batch', messages=len(batch), attempt=attempt):
+                        ids = transport.send_batch([e['message'] for e in batch], batch_key)
+                    error = None
+                    break
+                except TransportError as e:
+                    error = e
+                    if not e.retryable:
+                        break
+                    if attempt < max_retries:
+                        delay = random.uniform(0, min(max_backoff, backoff * (2 ** attempt)))
+                        time.sleep(max(0.0, min(delay, stop_at - time.monotonic())))
+
+            for i, entry in enumerate(batch):
+                entry['attempts'] += 1
+                if error is None:
+                    self._finish(entry, 'sent', id=ids[i] if i < len(ids) else None, sent_at=time.time())
+                    report.sent.append(entry['key'])
+                elif not error.retryable:
+                    self._finish(entry, 'failed', error=str(error))
+                    report.failed[entry['key']] = str(error)
+                else:
+                    entry['last_error'] = str(error)
+                    atomic_write_json(self._path('pending', entry['key']), entry)
+                    report.pending.append(entry['key'])
+        metrics.incr('emails_sent', len(report.sent))
+        self._prune_sent(now)
+        return report
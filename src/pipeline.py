@@ -0,0 +1,100 @@
+import time
+import queue
+import threading
+
+from metrics import metrics
+
+
+class StageTimeout(Exception):
+    """阶段在规定时间内没有完成"""
+
+
+class Stage:
+    def __init__(self, name, func, deps=(), timeout=None, fallback=None):
+        self.name = name
+        self.func = func            # func(results) -> 本阶段输出，results 为已完成阶段的输出
+        self.deps = tuple(deps)
+        self.timeout = timeout      # 秒；None 表示不限时
+        self.fallback = fallback    # fallback(results, error) -> 降级输出；None 表示失败即失败
+
+
+class Pipeline:
+    """按依赖关系并发执行各阶段：依赖就绪即启动，互不依赖的阶段同时运行
+
+    每个阶段跑在独立的守护线程里，超时的阶段直接走降级结果，不会拖住整个流程
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.results = {}
+        self.errors = {}
+        self.durations = {}
+
+    def add(self, name, func, deps=(), timeout=None, fallback=None):
+        self.stages[name] = Stage(name, func, deps, timeout, fallback)
+        return self
+
+    def _worker(self, stage, done):
+        start = time.monotonic()
+        try:
+            with metrics.span(f'stage.{stage.name}'):
+                out = metrics.run_profiled(stage.func, self.results)
+            done.put((stage.name, out, None, time.monotonic() - start))
+        except Exception as e:
+            done.put((stage.name, None, e, time.monotonic() - start))
+
+    def _finish(self, stage, out, error):
+        if error is not None and stage.fallback is not None:
+            print(f"   ⚠️ 阶段 {stage.name} 降级: {error}")
+            out, error = stage.fallback(self.results, error), None
+        if error is not None:
+            self.errors[stage.name] = error
+        else:
+            self.results[stage.name] = out
+
+    def run(self):
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"阶段 {stage.name} 依赖未定义的阶段 {dep}")
+
+        done = queue.Queue()
+        pending = dict(self.stages)
+        running = {}   # {name: 启动时间}
+        while pending or running:
+            # 启动依赖已就绪的阶段；依赖失败的阶段直接跳过
+            for name, stage in list(pending.items()):
+                if any(d in self.errors for d in stage.deps):
+                    self.errors[name] = RuntimeError(f"依赖阶段失败: {', '.join(d for d in stage.deps if d in self.errors)}")
+                    del pending[name]
+                elif all(d in self.results for d in stage.deps):
+                    del pending[name]
+                    running[name] = time.monotonic()
+                    threading.Thread(target=self._worker, args=(stage, done), daemon=True,
+                                     name=f"stage-{name}").start()
+            if not running:
+                break
+
+            # 等到最近的超时点或任意阶段完成
+            now = time.monotonic()
+            deadlines = [running[n] + self.stages[n].timeout for n in running if self.stages[n].timeout]
+            wait = max(0.0, min(deadlines) - now) if deadlines else None
+            try:
+                name, out, error, elapsed = done.get(timeout=wait)
+                if name in running:
+                    del running[name]
+                    self.durations[name] = elapsed
+                    self._finish(self.stages[name], out, error)
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            for name in [n for n in running if self.stages[n].timeout and now - running[n] >= self.stages[n].timeout]:
+                stage = self.stages[name]
+                self.durations[name] = now - running.pop(name)
+                self._finish(stage, None, StageTimeout(f"{name} 超过 {stage.timeout}s"))
+
+        if self.errors:
+            name, error = next(iter(self.errors.items()))
+            raise RuntimeError(f"阶段 {name} 失败: {error}") from error
+        return self.results
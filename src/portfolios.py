@@ -0,0 +1,178 @@
+import os
+import glob
+import json
+
+from bar_store import market_of
+
+DEFAULT_CONFIG = 'data/portfolio.json'
+PORTFOLIO_DIR = 'data/portfolios'
+
+
+def load_portfolios(directory=PORTFOLIO_DIR, default_path=DEFAULT_CONFIG, default_recipients=None):
+    """读取组合配置，返回 [{'name', 'config', 'output_dir', 'recipients'}, ...]
+
+    data/portfolios/ 下每个 json 是一个组合，格式同 portfolio.json，另外可写
+    name（缺省取文件名）、output_dir（缺省 docs/<name>）、recipients（收件人列表）。
+    目录不存在或为空时退回单一的 data/portfolio.json：输出到 docs，收件人用 default_recipients
+    """
+    paths = sorted(glob.glob(os.path.join(directory, '*.json')))
+    if not paths:
+        with open(default_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return [{'name': 'default', 'config': config, 'output_dir': 'docs',
+                 'recipients': list(default_recipients or [])}]
+    portfolios = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        name = config.get('name') or os.path.splitext(os.path.basename(path))[0]
+        portfolios.append({
+            'name': name,
+            'config': config,
+            'output_dir': config.get('output_dir') or os.path.join('docs', name),
+            'recipients': list(config.get('recipients') or []),
+        })
+    names = [p['name'] for p in portfolios]
+    if len(set(names)) != len(names):
+        raise ValueError(f"组合名称重复: {names}")
+    return portfolios
+
+
+def yahoo_code(code, market):
+    """将代码转换为 Yahoo Finance 格式"""
+    code = str(code).strip()
+    if market == 'HK':
+        # 港股：去掉前缀，补足4位，加 .HK (例: 0700 -> 0700.HK)
+        clean_code = code.replace('.HK', '')
+        return f"{clean_code.zfill(4)}.HK"
+    elif market == 'A':
+        # A股：保持原后缀 (例: 600519.SS, 000858.SZ)
+        # 如果配置里没有后缀，需要自己判断 (6开头.SS, 其他.SZ)
+        if '.' in code:
+            return code.replace('.SH', '.SS') # YF用SS代表上海
+        else:
+            return f"{code}.SS" if code.startswith('6') else f"{code}.SZ"
+    return code
+
+
+def merge_configs(portfolios):
+    """把所有组合合并成一份去重后的配置，交给 DataCollector 一次性采集
+
+    同一标的按 Yahoo 代码去重（0700 与 0700.HK 视为同一只），名称/行业取第一次出现的写法
+    """
+    merged = {'hk_stocks': [], 'a_stocks': [], 'us_sector_etfs': {}}
+    seen = set()
+    for p in portfolios:
+        config = p['config']
+        for key, market in (('hk_stocks', 'HK'), ('a_stocks', 'A')):
+            for s in config.get(key, []):
+                code = yahoo_code(s['code'], market)
+                if code not in seen:
+                    seen.add(code)
+                    merged[key].append(s)
+        for sector, etf in config.get('us_sector_etfs', {}).items():
+            merged['us_sector_etfs'].setdefault(sector, etf)
+        # 指标是对全部持仓统一计算的，取第一个写了 indicators 的组合
+        if config.get('indicators') and 'indicators' not in merged:
+            merged['indicators'] = config['indicators']
+        # 风险窗口同理；仓位簿则每个组合各一本，按各自的权重算风险
+        if config.get('risk') and 'risk' not in merged:
+            merged['risk'] = config['risk']
+        merged.setdefault('books', {})[p['name']] = portfolio_book(config)
+    return merged
+
+
+def portfolio_book(config):
+    """组合的仓位簿 {'positions': [{'code', 'weight', 'name', 'sector', 'us_sector'}], 'capital'}
+
+    weight 为持仓的相对仓位（通常写成占组合的百分比），没写时整本按等权；
+    risk.capital 为组合市值，写了才给出金额口径的盈亏和 VaR
+    """
+    positions = []
+    for key, market in (('hk_stocks', 'HK'), ('a_stocks', 'A')):
+        for s in config.get(key, []):
+            positions.append({'code': yahoo_code(s['code'], market), 'weight': s.get('weight'),
+                              'name': s.get('name', ''), 'sector': s.get('sector', ''),
+                              'us_sector': s.get('us_sector', '')})
+    return {'positions': positions, 'capital': (config.get('risk') or {}).get('capital')}
+
+
+def holdings_of(portfolio):
+    """组合的持仓 {yf_code: 配置项}，不含美股板块 ETF"""
+    config = portfolio['config']
+    holdings = {}
+    for key, market, stock_type in (('hk_stocks', 'HK', 'hk_stock'), ('a_stocks', 'A', 'a_stock')):
+        for s in config.get(key, []):
+            holdings[yahoo_code(s['code'], market)] = {**s, 'type': stock_type}
+    return holdings
+
+
+def slice_view(market_data, holdings, book=None):
+    """从全量采集结果里切出单个组合的视图：美股大盘和板块共享，持仓只保留本组合的
+
+    名称、行业、映射标签按本组合自己的配置覆盖，同一只股票在不同组合里可以有不同写法；
+    风险报告按组合名 book 取本组合仓位簿算出的那一份
+    """
+    def pick(items):
+        out = []
+        for item in items:
+            info = holdings.get(item['code'])
+            if info is not None:
+                out.append({**item, 'name': info.get('name', item['name']), 'sector': info.get('sector', ''),
+                            'us_sector': info.get('us_sector', '')})
+        return out
+
+    failures = market_data.get('fetch_failures') or {}
+    return {
+        'us_market': market_data['us_market'],
+        'us_sectors': market_data['us_sectors'],
+        'portfolio': {
+            'hk_stocks': pick(market_data['portfolio']['hk_stocks']),
+            'a_stocks': pick(market_data['portfolio']['a_stocks']),
+        },
+        'collected_at': market_data['collected_at'],
+        # 美股板块和指数的失败所有组合都要看到
+        'fetch_failures': {k: v for k, v in failures.items() if k in holdings or market_of(k) == 'us'},
+        'sessions': market_data.get('sessions', {}),
+        'risk': (market_data.get('risk_books') or {}).get(book),
+    }
+
+
+def slice_alerts(alerts, view):
+    """只保留与本组合持仓或美股板块相关的提醒
+
+    背离提醒的 ticker 是美股 ETF，每个组合都有，改为按成分股 members 判断：持有其中任一只才保留
+    """
+    if not alerts:
+        return alerts
+    held = {s['code'] for s in view['portfolio']['hk_stocks'] + view['portfolio']['a_stocks']}
+    codes = held | {s['code'] for s in view['us_sectors']}
+
+    def mine(a):
+        if 'members' in a:
+            return not held.isdisjoint(a['members'])
+        return a.get('ticker') in codes
+    return {k: [a for a in v if mine(a)] for k, v in alerts.items()}
+
+
+def slice_analysis(analysis, view):
+    """全量分析只调用一次模型，再按组合过滤重点关注和板块分析里涉及的个股"""
+    stocks = view['portfolio']['hk_stocks'] + view['portfolio']['a_stocks']
+    codes = {s['code'] for s in stocks}
+    names = {s['name'] for s in stocks}
+
+    def mine(code, name):
+        code = str(code or '').strip().replace('.SH', '.SS')
+        return code in codes or name in names
+
+    picks = [p for p in analysis.get('top_picks', []) if mine(p.get('stock_code'), p.get('stock_name'))]
+    sectors = []
+    for sa in analysis.get('sector_analysis') or []:
+        affected = sa.get('affected_stocks')
+        if not affected:
+            sectors.append(sa)
+            continue
+        affected = [x for x in affected if mine(x, x)]
+        if affected:
+            sectors.append({**sa, 'affected_stocks': affected})
+    return {**analysis, 'top_picks': picks, 'sector_analysis': sectors}
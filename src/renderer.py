@@ -0,0 +1,170 @@
+import os
+import json
+import hashlib
+import threading
+from functools import lru_cache
+from string import Formatter
+
+
+def change_color(val): return '#d32f2f' if val > 0 else '#388e3c' if val < 0 else '#666'
+
+
+def change_bg(val, neutral='#fff'): return '#ffebee' if val > 2 else '#e8f5e9' if val < -2 else neutral
+
+
+class Template:
+    """str.format 风格的模板，构造时一次性拆成 字面量/字段 片段，渲染时不再重复解析
+
+    只支持简单字段名和格式说明，例如 {name}、{pct:+.2f}；CSS 里的花括号照常写成 {{ }}
+    """
+
+    def __init__(self, text):
+        self.text = text
+        # 模板文本的摘要，参与片段缓存的哈希，模板一改旧片段自动失效
+        self.digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+        self.parts = []
+        for literal, field, spec, _ in Formatter().parse(text):
+            if literal:
+                self.parts.append((literal, None, None))
+            if field is not None:
+                self.parts.append((None, field, spec or ''))
+
+    def _pieces(self, ctx):
+        for literal, field, spec in self.parts:
+            yield literal if field is None else format(ctx[field], spec)
+
+    def render(self, **ctx):
+        return ''.join(self._pieces(ctx))
+
+    def write(self, writer, **ctx):
+        for piece in self._pieces(ctx):
+            writer.write(piece)
+
+
+@lru_cache(maxsize=None)
+def compile_template(text):
+    """同一段模板文本只编译一次"""
+    return Template(text)
+
+
+class StreamWriter:
+    """分块缓冲写出：攒够 chunk_size 个字符就落到底层文件，内存占用与总输出量无关"""
+
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = []
+        self.size = 0
+
+    def write(self, text):
+        self.buf.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def copy_file(self, path):
+        """把另一个文件的内容按块接到输出后面"""
+        self.flush()
+        with open(path, 'r', encoding='utf-8') as src:
+            while True:
+                chunk = src.read(self.chunk_size)
+                if not chunk:
+                    break
+                self.f.write(chunk)
+
+    def flush(self):
+        if self.buf:
+            self.f.write(''.join(self.buf))
+            self.buf = []
+            self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+# 每次运行都会变、但不代表内容变化的字段，不参与变更判断。
+# alerts.fired 只是"这一次评估新触发的"：同样的行情重新采集时会因冷却变成空列表，
+# 触发过的提醒已经进了 alerts.recent，内容变化以 recent 为准
+VOLATILE_KEYS = {'collected_at', 'generated_at', 'cached', 'fired'}
+
+
+def strip_volatile(obj):
+    if isinstance(obj, dict):
+        return {k: strip_volatile(v) for k, v in obj.items() if k not in VOLATILE_KEYS}
+    if isinstance(obj, list):
+        return [strip_volatile(v) for v in obj]
+    return obj
+
+
+def hash_inputs(*inputs):
+    """对渲染输入做稳定的内容哈希（字典键排序）"""
+    payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AtomicOutput:
+    """写到同目录的临时文件并同时计算 sha256；提交时与旧摘要相同则丢弃，否则 rename 覆盖目标
+
+    是否变化只看摘要：与上次发布的摘要相同、但本地文件不在（例如 CI 里 docs/ 没有取回）时照样写出文件，
+    changed 仍为 False，不触发部署和发信。在 with 块里出异常时临时文件被删除，目标文件保持原样
+    """
+
+    def __init__(self, path, previous_digest=None):
+        self.path = path
+        self.previous_digest = previous_digest
+        self.tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        self.hash = hashlib.sha256()
+        self.f = None
+        self.changed = None
+        self.digest = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.f = open(self.tmp, 'w', encoding='utf-8')
+        return self
+
+    def write(self, text):
+        self.f.write(text)
+        self.hash.update(text.encode('utf-8'))
+
+    def __exit__(self, exc_type, *exc):
+        self.f.close()
+        if exc_type is not None:
+            os.remove(self.tmp)
+            return False
+        self.digest = self.hash.hexdigest()
+        self.changed = self.digest != self.previous_digest
+        if self.changed or not os.path.exists(self.path):
+            os.replace(self.tmp, self.path)
+        else:
+            os.remove(self.tmp)
+        return False
+
+
+def atomic_write_bytes(path, data):
+    """二进制内容的原子写入（临时文件 + rename）"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def atomic_write_json(path, obj):
+    """先写临时文件再 rename，避免写到一半被中断留下损坏的 JSON"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
@@ -0,0 +1,224 @@
+import os
+import numpy as np
+
+from bar_store import market_of
+from metrics import metrics
+
+TRADING_DAYS = 252
+DEFAULT_RISK = {'window': 120, 'confidence': 0.95, 'min_periods': 20}
+TOP_CONTRIBUTORS = 10
+MARKET_LABELS = {'hk': '港股', 'cn': 'A股', 'us': '美股'}
+
+
+def ffill_rows(a):
+    """沿时间轴向前填充 NaN：每列用之前最后一个有效值，开头还没有值的仍为 NaN"""
+    rows = np.arange(a.shape[0])[:, None]
+    idx = np.maximum.accumulate(np.where(np.isnan(a), 0, rows), axis=0)
+    return a[idx, np.arange(a.shape[1])]
+
+
+def log_price_panel(bars):
+    """[{ts, close}] → (日期并集, 对数收盘价 (日期数, 标的数))，当天没有 bar 的位置为 NaN"""
+    dates = np.unique(np.concatenate([np.asarray(b['ts']) for b in bars] + [np.empty(0, np.int64)]))
+    logp = np.full((len(dates), len(bars)), np.nan)
+    for j, b in enumerate(bars):
+        ts = np.asarray(b['ts'])
+        if not len(ts):
+            continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logp[np.searchsorted(dates, ts), j] = np.log(np.asarray(b['close']))
+    # 非正价格取对数得到 -inf/NaN，一律当缺失
+    logp[~np.isfinite(logp)] = np.nan
+    return dates, logp
+
+
+def book_weights(positions):
+    """仓位簿 → (代码, 权重数组, 是否等权)
+
+    权重按总仓位（绝对值之和）归一，负数表示做空；整本都没写 weight 时按等权处理，
+    只写了一部分时没写的记 0
+    """
+    codes = [p['code'] for p in positions]
+    raw = [p.get('weight') for p in positions]
+    equal = all(w is None for w in raw)
+    w = np.ones(len(raw)) if equal else np.array([float(x or 0) for x in raw])
+    gross = np.abs(w).sum()
+    return codes, (w / gross if gross > 0 else w), equal
+
+
+def ranked(labels, values, scale=100.0):
+    """按标签汇总并按绝对值降序：[[标签, 值], ...]"""
+    keys, inv = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+    sums = np.bincount(inv, weights=values, minlength=len(keys)) * scale
+    order = np.argsort(-np.abs(sums), kind='stable')
+    return [[str(keys[i]) or '未分类', round(float(sums[i]), 2)] for i in order]
+
+
+class RiskEngine:
+    """组合风险：持仓日收益的滚动窗口 + 列和，协方差以去均值收益矩阵的低秩形式表示
+
+    窗口 T 天、N 只持仓时 Σ = XᵀX/(T-1)，X 为收益减去列均值。组合方差 wᵀΣw = |Xw|²/(T-1)、
+    边际风险 Σw = Xᵀ(Xw)/(T-1) 都只用 (T, N) 的矩阵乘法，不生成 N×N 的矩阵，几千只持仓也很快；
+    多个组合的权重拼成 (N, 组合数) 的矩阵一次算完。
+    各市场休市日的收益记 0（价格不变），新 bar 到来时只重算最后一行及之后的收益、减掉移出窗口的行，
+    状态落盘到 data/cache，跨运行增量更新
+    """
+
+    def __init__(self, store, state_path='data/cache/risk.npz'):
+        self.store = store
+        self.state_path = state_path
+        self.params = dict(DEFAULT_RISK)
+        self.state = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.state_path):
+            return None
+        try:
+            with np.load(self.state_path, allow_pickle=False) as z:
+                return {k: z[k] for k in z.files}
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, **self.state)
+        os.replace(tmp, self.state_path)
+
+    def _rebuild(self, holdings, window):
+        # 多读一些 bar：两个市场的休市日不同，日期并集比单只标的的 bar 数多
+        dates, logp = log_price_panel([self.store.tail(h, window + 20) for h in holdings])
+        full = ffill_rows(logp)
+        r = np.nan_to_num(np.diff(full, axis=0))[-window:]
+        return {
+            'holdings': np.array(holdings, dtype=str), 'window': np.array(window),
+            'dates': dates[1:][-window:], 'r': r, 'sum': r.sum(axis=0),
+            # 最后一行之前那天的对数价格，增量更新时从这里接着算
+            'base': full[-2] if len(full) >= 2 else np.full(len(holdings), np.nan),
+            'updates': np.array(0),
+        }
+
+    def _roll(self, state, holdings, window):
+        """重算最后一根已存 bar 及之后的收益（盘中 bar 可能被刷新），再把窗口外的行减掉"""
+        if not len(state['dates']):
+            return self._rebuild(holdings, window)
+        cutoff = int(state['dates'][-1])
+        dates, logp = log_price_panel([self.store.read(h, start=cutoff) for h in holdings])
+        if not len(dates):
+            return state
+        full = ffill_rows(np.vstack([state['base'][None, :], logp]))
+        added = np.nan_to_num(np.diff(full, axis=0))
+        keep = state['dates'] < cutoff
+        total = state['sum'] - state['r'][~keep].sum(axis=0) + added.sum(axis=0)
+        r = np.concatenate([state['r'][keep], added])
+        dates = np.concatenate([state['dates'][keep], dates])
+        drop = max(len(dates) - window, 0)
+        total = total - r[:drop].sum(axis=0)
+        return {**state, 'dates': dates[drop:], 'r': r[drop:], 'sum': total, 'base': full[-2],
+                'updates': np.array(int(state['updates']) + 1)}
+
+    def update(self, holdings, params=None):
+        """把收益窗口滚动到存储里的最新 bar"""
+        self.params = {**DEFAULT_RISK, **{k: v for k, v in (params or {}).items() if k in DEFAULT_RISK}}
+        window = int(self.params['window'])
+        state = self.state
+        same = (state is not None and state['holdings'].tolist() == list(holdings)
+                and int(state['window']) == window)
+        # 持仓集合或窗口变化时全量重建；增量滚过一整个窗口后也重建一次，消除浮点累积误差
+        if not same or int(state['updates']) >= window:
+            metrics.incr('risk_rebuilds')
+            self.state = self._rebuild(list(holdings), window)
+        else:
+            self.state = self._roll(state, list(holdings), window)
+        self._save()
+        return self.state
+
+    def report(self, books, rows):
+        """各组合的风险报告 {组合名: 报告}
+
+        books 为 {组合名: {'positions': [{'code', 'weight', 'name', 'sector', 'us_sector'}], 'capital'}}，
+        rows 为采集结果里的 {代码: 持仓行}，当日盈亏用其中按交易日历对齐的 change_pct
+        """
+        state = self.state
+        index = {h: i for i, h in enumerate(state['holdings'].tolist())}
+        names = list(books)
+        parsed = [book_weights(books[n]['positions']) for n in names]
+        # (N, 组合数) 的权重矩阵，没有历史的持仓不参与波动率计算
+        W = np.zeros((len(index), len(names)))
+        for j, (codes, w, _) in enumerate(parsed):
+            pos = np.array([index.get(c, -1) for c in codes], dtype=np.int64)
+            ok = pos >= 0
+            np.add.at(W[:, j], pos[ok], w[ok])
+
+        r = state['r']
+        T = len(r)
+        stats = None
+        if T >= self.params['min_periods']:
+            mean = state['sum'] / T
+            H = r @ W                                   # (T, 组合数) 组合的历史日收益
+            P = H - mean @ W                            # 去均值
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sigma = np.sqrt((P * P).sum(axis=0) / (T - 1))
+                # 各持仓对组合波动的贡献 w∘Σw/σ，每列之和等于 σ；P 已去均值，rᵀP = XᵀP
+                contrib = W * (r.T @ P) / (T - 1) / sigma
+            q = np.quantile(H, 1 - self.params['confidence'], axis=0)
+            tail = H <= q
+            es = (H * tail).sum(axis=0) / np.maximum(tail.sum(axis=0), 1)
+            stats = {'sigma': sigma, 'contrib': contrib, 'var': -q, 'es': -es}
+
+        out = {}
+        for j, name in enumerate(names):
+            out[name] = self._book_report(books[name], parsed[j], rows, index, stats, j, T)
+        return out
+
+    def _book_report(self, book, parsed, rows, index, stats, j, T):
+        codes, w, equal = parsed
+        positions = book['positions']
+        capital = book.get('capital')
+        pct = np.array([rows[c]['change_pct'] if c in rows else 0.0 for c in codes], dtype=np.float64)
+        pnl = float(w @ pct) if len(w) else 0.0
+        report = {
+            'positions': len(codes),
+            'equal_weight': equal,
+            'net': round(float(w.sum()) * 100, 2),
+            'pnl_pct': round(pnl, 2),
+            'exposure': {
+                'sector': ranked([p.get('sector', '') for p in positions], w),
+                'us_sector': ranked([p.get('us_sector', '') for p in positions], w),
+                'market': ranked([MARKET_LABELS[market_of(c)] for c in codes], w),
+            },
+            'observations': T,
+            'confidence': self.params['confidence'],
+        }
+        if capital:
+            report['capital'] = capital
+            report['pnl_amount'] = round(capital * pnl / 100, 2)
+        if stats is None or not np.isfinite(stats['sigma'][j]) or stats['sigma'][j] <= 0:
+            return report
+
+        sigma = float(stats['sigma'][j])
+        report.update(
+            volatility=round(sigma * 100, 2),
+            volatility_annual=round(sigma * np.sqrt(TRADING_DAYS) * 100, 2),
+            var=round(float(stats['var'][j]) * 100, 2),
+            es=round(float(stats['es'][j]) * 100, 2),
+        )
+        if capital:
+            report['var_amount'] = round(capital * float(stats['var'][j]), 2)
+            report['es_amount'] = round(capital * float(stats['es'][j]), 2)
+
+        # 风险贡献按仓位簿里的持仓展开（同一只出现多次时按权重比例分摊），再按板块汇总
+        col = stats['contrib'][:, j]
+        pos = np.array([index.get(c, -1) for c in codes], dtype=np.int64)
+        held = np.zeros(len(col))
+        np.add.at(held, pos[pos >= 0], w[pos >= 0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            per_unit = np.where(held != 0, col / held, 0.0)
+        share = np.where(pos >= 0, per_unit[np.maximum(pos, 0)] * w, 0.0) / sigma
+        report['sector_risk'] = ranked([p.get('sector', '') for p in positions], share)
+        top = np.argsort(-np.abs(share), kind='stable')[:TOP_CONTRIBUTORS]
+        report['contributors'] = [{'code': codes[i], 'name': positions[i].get('name', codes[i]),
+                                   'weight': round(float(w[i]) * 100, 2),
+                                   'risk_share': round(float(share[i]) * 100, 2)} for i in top.tolist()]
+        return report
@@ -1,80 +1,97 @@
 import json
 import os
+import threading
 
-class SiteGenerator:
-    def __init__(self, output_dir='docs'):
-        self.output_dir = output_dir
-        os.makedirs(output_dir, exist_ok=True)
-        
-    def generate_dashboard(self, data, analysis):
-        
-        def change_color(val): return '#d32f2f' if val > 0 else '#388e3c' if val < 0 else '#666'
-        def change_bg(val): return '#ffebee' if val > 2 else '#e8f5e9' if val < -2 else '#fff'
+from metrics import metrics
+from renderer import (change_color, change_bg, compile_template, StreamWriter, AtomicOutput, hash_inputs,
+                      atomic_write_bytes, atomic_write_json, load_json, strip_volatile)
+from columnar_export import SCHEMA_VERSION, to_columnar, dumps, compress_variants
+from indicators import ma_gap
 
-        # 生成美股板块卡片
-        sector_cards = ""
-        if data.get('us_sectors'):
-            sorted_sectors = sorted(data['us_sectors'], key=lambda x: x.get('change_pct', 0), reverse=True)
-            for s in sorted_sectors:
-                pct = s.get('change_pct', 0)
-                sector_cards += f"""
-                <div class="sector-card" style="background:{change_bg(pct)}; border-left:4px solid {change_color(pct)}">
+SECTOR_CARD = compile_template("""
+                <div class="sector-card" style="background:{bg}; border-left:4px solid {color}">
                     <div class="sector-header">
-                        <span class="sector-name">{s['name']}</span>
+                        <span class="sector-name">{name}</span>
                     </div>
-                    <div class="sector-change" style="color:{change_color(pct)}">
+                    <div class="sector-change" style="color:{color}">
                         {pct:+.2f}%
                     </div>
                 </div>
-                """
+                """)
 
-        # 🔥 核心修改：生成股票行 (美股映射写在名字下面)
-        def generate_stock_rows(stocks):
-            rows = ""
-            if not stocks: return "<tr><td colspan='4'>暂无数据</td></tr>"
-            
-            for s in sorted(stocks, key=lambda x: x.get('change_pct', 0), reverse=True):
-                pct = s.get('change_pct', 0)
-                # 获取美股映射，如果没有则不显示
-                mapping_tag = ""
-                if s.get('us_sector'):
-                    mapping_tag = f'<div style="font-size:10px; color:#999; margin-top:2px; background:#f5f5f5; display:inline-block; padding:1px 4px; border-radius:3px;">🇺🇸 {s["us_sector"]}</div>'
-
-                rows += f"""
+# 美股映射写在名字下面：有实测相关性时显示最相关的 ETF，否则显示配置里的板块
+MAPPING_TAG = compile_template('<div style="font-size:10px; color:#999; margin-top:2px; background:#f5f5f5; display:inline-block; padding:1px 4px; border-radius:3px;">🇺🇸 {label}</div>')
+
+STOCK_ROW = compile_template("""
                 <tr>
                     <td>
-                        <div style="font-weight:bold;">{s['name']}</div>
-                        <div style="font-size:11px; color:#666;">{s['code']}</div>
+                        <div style="font-weight:bold;">{name}</div>
+                        <div style="font-size:11px; color:#666;">{code}</div>
                         {mapping_tag}
                     </td>
-                    <td style="font-size:13px;">{s['sector']}</td>
-                    <td style="font-weight:bold; color:{change_color(pct)};">
+                    <td style="font-size:13px;">{sector}</td>
+                    <td style="font-weight:bold; color:{color};">
                         {pct:+.2f}%
+                        {gap_tag}
                     </td>
-                    <td>{s.get('price', 0):.2f}</td>
+                    <td>{price:.2f}{trend_tag}</td>
+                    <td style="font-size:13px; color:{rsi_color};">{rsi}</td>
+                    <td style="font-size:13px;">{volatility}</td>
+                    <td style="font-size:13px; {ratio_style}">{volume_ratio}</td>
                 </tr>
-                """
-            return rows
+                """)
 
-        hk_rows = generate_stock_rows(data['portfolio']['hk_stocks'])
-        a_rows = generate_stock_rows(data['portfolio']['a_stocks'])
-        
-        # AI 分析 HTML
-        analysis_html = ""
-        if analysis.get('sector_analysis'):
-            for sa in analysis['sector_analysis']:
-                analysis_html += f"""
+# 涨跌下面标跳空，价格下面标相对最长均线的偏离
+SUB_TAG = compile_template('<div style="font-size:10px; color:#999; font-weight:normal;">{text}</div>')
+
+EMPTY_ROWS = "<tr><td colspan='7'>暂无数据</td></tr>"
+
+ANALYSIS_CARD = compile_template("""
                 <div class="analysis-card">
                     <div style="display:flex; justify-content:space-between; margin-bottom:5px;">
-                        <strong>{sa.get('sector_name','板块')}</strong>
-                        <span style="background:#e74c3c; color:white; padding:1px 5px; border-radius:3px; font-size:11px;">{sa.get('impact_level','中')}</span>
+                        <strong>{sector_name}</strong>
+                        <span style="background:#e74c3c; color:white; padding:1px 5px; border-radius:3px; font-size:11px;">{impact_level}</span>
                     </div>
-                    <p style="margin:0; font-size:13px; color:#555;">{sa.get('reasoning','')}</p>
+                    <p style="margin:0; font-size:13px; color:#555;">{reasoning}</p>
                 </div>
-                """
+                """)
+
+PICK_CARD = compile_template('<div style="background:#fff3e0; padding:8px; border-radius:4px; margin-bottom:5px; border-left:3px solid #ff9800;"><div style="font-weight:bold; font-size:14px;">{stock_name}</div><div style="font-size:12px; color:#666;">{reason}</div></div>')
+
+# 提醒卡片接在重点关注下面，没有提醒时整段不输出
+ALERTS_OPEN = """
+                </div>
+
+                <div class="card">
+                    <div class="card-title">🔔 触发提醒</div>
+                    """
+
+ALERT_ROW = compile_template('<div style="padding:6px 0; border-bottom:1px solid #f5f5f5; font-size:13px;"><span style="color:#999; font-size:11px;">{fired_at}</span> {message}</div>')
+
+# 组合风险卡片接在提醒下面：盈亏/波动/VaR/ES 一行，下面是板块暴露和风险贡献
+RISK_OPEN = """
+                </div>
+
+                <div class="card">
+                    <div class="card-title">📐 组合风险</div>
+                    """
 
-        # 组装 HTML
-        html = f"""<!DOCTYPE html>
+RISK_SUMMARY = compile_template("""<div style="display:grid; grid-template-columns:repeat(4, 1fr); gap:6px; text-align:center; margin-bottom:8px;">
+                        <div><div style="font-size:11px; color:#999;">当日盈亏</div><div style="font-weight:bold; color:{pnl_color};">{pnl}</div></div>
+                        <div><div style="font-size:11px; color:#999;">年化波动</div><div style="font-weight:bold;">{volatility}</div></div>
+                        <div><div style="font-size:11px; color:#999;">VaR {level}</div><div style="font-weight:bold;">{var}</div></div>
+                        <div><div style="font-size:11px; color:#999;">ES {level}</div><div style="font-weight:bold;">{es}</div></div>
+                    </div>""")
+
+RISK_HEADING = compile_template('<div style="font-size:12px; color:#999; margin:8px 0 2px;">{text}</div>')
+
+RISK_ROW = compile_template('<div style="display:flex; justify-content:space-between; font-size:13px; padding:3px 0; border-bottom:1px solid #f5f5f5;"><span>{label}</span><span style="color:#666;">{value}</span></div>')
+
+RISK_NOTE = compile_template('<div style="font-size:11px; color:#999; margin-top:6px;">{text}</div>')
+
+RISK_TOP = 5
+
+HEADER = compile_template("""<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
@@ -86,13 +103,13 @@ class SiteGenerator:
         .header {{ background: #2c3e50; color: white; padding: 15px; border-radius: 8px; margin-bottom: 15px; }}
         .grid {{ display: grid; grid-template-columns: 1fr 1fr; gap: 15px; }}
         @media(max-width: 768px) {{ .grid {{ grid-template-columns: 1fr; }} }}
-        
+
         .card {{ background: white; padding: 15px; border-radius: 8px; box-shadow: 0 1px 3px rgba(0,0,0,0.1); margin-bottom: 15px; }}
         .card-title {{ font-size: 16px; font-weight: bold; margin-bottom: 10px; border-bottom: 1px solid #eee; padding-bottom: 8px; }}
-        
+
         .sector-card {{ padding: 8px; margin-bottom: 8px; border-radius: 4px; display:flex; justify-content:space-between; align-items:center; }}
         .analysis-card {{ background: #f8f9fa; padding: 10px; border-radius: 6px; margin-bottom: 8px; border-left: 3px solid #3498db; }}
-        
+
         table {{ width: 100%; border-collapse: collapse; }}
         th {{ text-align: left; color: #999; font-size: 12px; padding: 8px; border-bottom:1px solid #eee; }}
         td {{ padding: 8px; border-bottom: 1px solid #f9f9f9; vertical-align: middle; }}
@@ -102,57 +119,350 @@ class SiteGenerator:
     <div class="container">
         <div class="header">
             <h2 style="margin:0;">🚀 基金经理驾驶舱</h2>
-            <div style="font-size:12px; opacity:0.8; margin-top:5px;">更新时间: {data['collected_at']} (北京时间)</div>
+            <div style="font-size:12px; opacity:0.8; margin-top:5px;">更新时间: {collected_at} (北京时间)</div>
         </div>
+""")
 
+AI_PANEL_HEAD = compile_template("""
         <div class="card">
             <div class="card-title">🤖 AI 投研内参</div>
             <div style="background:#e3f2fd; padding:10px; border-radius:4px; margin-bottom:10px; font-size:14px; color:#0d47a1;">
-                {analysis.get('market_summary', 'AI 分析暂不可用')}
+                {market_summary}
             </div>
-            {analysis_html}
+""")
+
+SECTORS_OPEN = """
         </div>
 
         <div class="grid">
             <div>
                 <div class="card">
                     <div class="card-title">🌎 美股板块映射</div>
-                    {sector_cards}
+"""
+
+PICKS_OPEN = """
                 </div>
-                
+
                 <div class="card">
                     <div class="card-title">🎯 重点关注</div>
-                    {''.join([f'<div style="background:#fff3e0; padding:8px; border-radius:4px; margin-bottom:5px; border-left:3px solid #ff9800;"><div style="font-weight:bold; font-size:14px;">{p["stock_name"]}</div><div style="font-size:12px; color:#666;">{p["reason"]}</div></div>' for p in analysis.get('top_picks', [])])}
+                    """
+
+TABLE_OPEN = compile_template("""
                 </div>
             </div>
-            
+
             <div>
                 <div class="card">
-                    <div class="card-title">🇭🇰 港股持仓</div>
+                    <div class="card-title">{title}</div>
                     <table>
-                        <thead><tr><th>代码/映射</th><th>行业</th><th>涨跌</th><th>价格</th></tr></thead>
-                        <tbody>{hk_rows}</tbody>
+                        <thead><tr><th>代码/映射</th><th>行业</th><th>涨跌</th><th>价格</th><th>RSI</th><th>波动</th><th>量比</th></tr></thead>
+                        <tbody>""")
+
+TABLE_CLOSE = """</tbody>
                     </table>
-                </div>
-                
+"""
+
+NEXT_TABLE_OPEN = compile_template("""                </div>
+
                 <div class="card">
-                    <div class="card-title">🇨🇳 A股持仓</div>
+                    <div class="card-title">{title}</div>
                     <table>
-                        <thead><tr><th>代码/映射</th><th>行业</th><th>涨跌</th><th>价格</th></tr></thead>
-                        <tbody>{a_rows}</tbody>
-                    </table>
-                </div>
+                        <thead><tr><th>代码/映射</th><th>行业</th><th>涨跌</th><th>价格</th><th>RSI</th><th>波动</th><th>量比</th></tr></thead>
+                        <tbody>""")
+
+PAGE_TAIL = """                </div>
             </div>
         </div>
     </div>
 </body>
 </html>
 """
-        with open(os.path.join(self.output_dir, 'index.html'), 'w', encoding='utf-8') as f:
-            f.write(html)
-        return os.path.join(self.output_dir, 'index.html')
+
+def mapping_label(s):
+    if s.get('map_etf'):
+        return f"{s['map_etf']} ρ{s['map_corr']:.2f} β{s['map_beta']:.2f}"
+    return s['us_sector']
+
+
+def risk_summary(risk):
+    """风险卡片顶部四项；历史不足时波动/VaR/ES 显示为 -"""
+    pnl = risk.get('pnl_pct', 0)
+    amount = f" ({risk['pnl_amount']:+,.0f})" if risk.get('pnl_amount') is not None else ''
+    fmt = lambda key: f"{risk[key]:.2f}%" if risk.get(key) is not None else '-'
+    return {
+        'pnl': f"{pnl:+.2f}%{amount}", 'pnl_color': change_color(pnl),
+        'volatility': fmt('volatility_annual'), 'var': fmt('var'), 'es': fmt('es'),
+        'level': f"{risk.get('confidence', 0.95) * 100:.0f}%",
+    }
+
+
+def indicator_cells(s):
+    """技术指标列；没有足够历史的指标显示为 -"""
+    rsi, vol, ratio = s.get('rsi'), s.get('volatility'), s.get('volume_ratio')
+    gap, trend = s.get('gap_pct'), ma_gap(s)
+    return {
+        'rsi': f"{rsi:.0f}" if rsi is not None else '-',
+        'rsi_color': '#d32f2f' if rsi is not None and rsi >= 70 else '#388e3c' if rsi is not None and rsi <= 30 else '#333',
+        'volatility': f"{vol:.0f}%" if vol is not None else '-',
+        'volume_ratio': f"{ratio:.1f}" if ratio is not None else '-',
+        'ratio_style': 'font-weight:bold; color:#ff9800;' if ratio is not None and ratio >= 2 else '',
+        'gap_tag': SUB_TAG.render(text=f"跳空 {gap:+.1f}%") if gap else '',
+        'trend_tag': SUB_TAG.render(text=f"均线 {trend:+.1f}%") if trend is not None else '',
+    }
+
+
+class SiteGenerator:
+    """面板按 header / AI 面板 / 美股板块 / 提醒 / 组合风险 / 港股表 / A股表 分段渲染
+
+    每段以输入内容的哈希为键缓存成片段文件，只有输入变了的段才重新渲染；
+    最终文件原子写入，摘要与上次相同则不落盘。self.changes 记录各输出文件本次是否变化
+    """
+
+    def __init__(self, output_dir='docs', fragment_dir=None):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        # 预渲染好的片段放在站点目录之外，不会被发布到 gh-pages
+        self.fragment_dir = fragment_dir or os.path.join('data', 'cache', 'fragments', output_dir.strip('/').replace('/', '_'))
+        os.makedirs(self.fragment_dir, exist_ok=True)
+        self.manifest_path = os.path.join(self.fragment_dir, 'manifest.json')
+        self.manifest = load_json(self.manifest_path, {})
+        self.manifest.setdefault('sections', {})
+        self.manifest.setdefault('outputs', {})
+        self.lock = threading.Lock()
+        self.changes = {}
+
+    def _save_manifest(self):
+        with self.lock:
+            atomic_write_json(self.manifest_path, self.manifest)
+
+    def _section(self, name, inputs, render):
+        """输入哈希没变且片段还在就直接复用，否则重新渲染。返回 (片段路径, 哈希)"""
+        digest = hash_inputs(inputs)
+        path = os.path.join(self.fragment_dir, f'{name}.html')
+        with self.lock:
+            unchanged = self.manifest['sections'].get(name) == digest and os.path.exists(path)
+        if unchanged:
+            metrics.incr('sections_reused')
+            return path, digest
+        with metrics.span('render.section', section=name):
+            with AtomicOutput(path) as out, StreamWriter(out) as w:
+                render(w)
+        metrics.incr('sections_rendered')
+        with self.lock:
+            self.manifest['sections'][name] = digest
+        self._save_manifest()
+        return path, digest
+
+    def changed(self):
+        """本次运行是否有任何输出文件发生变化"""
+        return any(self.changes.values())
+
+    def render_market_sections(self, data):
+        """渲染不依赖 AI 结果的行情部分，可以和 AI 分析并发执行；片段直接流式写到文件"""
+        with metrics.span('render.market_sections'):
+            hk = data['portfolio']['hk_stocks']
+            a = data['portfolio']['a_stocks']
+            row_templates = [MAPPING_TAG.digest, STOCK_ROW.digest, SUB_TAG.digest]
+            sectors = data.get('us_sectors') or []
+            risk = data.get('risk')
+            risk_templates = [RISK_OPEN, RISK_SUMMARY.digest, RISK_HEADING.digest, RISK_ROW.digest, RISK_NOTE.digest]
+            return {
+                'sector_cards': self._section('us_sectors', [SECTOR_CARD.digest, sectors],
+                                              lambda w: self._write_sector_cards(w, sectors)),
+                'risk': self._section('risk', [risk_templates, risk], lambda w: self._write_risk(w, risk)),
+                'hk_rows': self._section('hk_table', [row_templates, hk], lambda w: self._write_stock_rows(w, hk)),
+                'a_rows': self._section('a_table', [row_templates, a], lambda w: self._write_stock_rows(w, a)),
+            }
+
+    def _write_sector_cards(self, w, sectors):
+        # 生成美股板块卡片
+        for s in sorted(sectors, key=lambda x: x.get('change_pct', 0), reverse=True):
+            pct = s.get('change_pct', 0)
+            SECTOR_CARD.write(w, bg=change_bg(pct), color=change_color(pct), name=s['name'], pct=pct)
+
+    def _write_stock_rows(self, w, stocks):
+        # 🔥 核心修改：生成股票行 (美股映射写在名字下面)
+        if not stocks:
+            w.write(EMPTY_ROWS)
+            return
+        for s in sorted(stocks, key=lambda x: x.get('change_pct', 0), reverse=True):
+            pct = s.get('change_pct', 0)
+            # 获取美股映射，如果没有则不显示
+            mapping_tag = MAPPING_TAG.render(label=mapping_label(s)) if s.get('map_etf') or s.get('us_sector') else ""
+            STOCK_ROW.write(w, name=s['name'], code=s['code'], mapping_tag=mapping_tag, sector=s['sector'],
+                            color=change_color(pct), pct=pct, price=s.get('price', 0), **indicator_cells(s))
+
+    def _write_ai_panel(self, w, analysis):
+        AI_PANEL_HEAD.write(w, market_summary=analysis.get('market_summary', 'AI 分析暂不可用'))
+        # AI 分析 HTML
+        for sa in analysis.get('sector_analysis') or []:
+            ANALYSIS_CARD.write(w, sector_name=sa.get('sector_name', '板块'),
+                                impact_level=sa.get('impact_level', '中'), reasoning=sa.get('reasoning', ''))
+
+    def _write_picks(self, w, analysis):
+        for p in analysis.get('top_picks', []):
+            PICK_CARD.write(w, stock_name=p["stock_name"], reason=p["reason"])
+
+    def _write_alerts(self, w, alerts):
+        if not alerts:
+            return
+        w.write(ALERTS_OPEN)
+        for a in alerts:
+            ALERT_ROW.write(w, fired_at=a.get('fired_at', ''), message=a.get('message', ''))
+
+    def _write_risk(self, w, risk):
+        if not risk:
+            return
+        w.write(RISK_OPEN)
+        RISK_SUMMARY.write(w, **risk_summary(risk))
+        exposure = risk.get('exposure', {})
+        blocks = [
+            ('市场暴露', exposure.get('market', []), '{:.1f}%'),
+            ('行业暴露', exposure.get('sector', [])[:RISK_TOP], '{:.1f}%'),
+            ('美股板块暴露', exposure.get('us_sector', [])[:RISK_TOP], '{:.1f}%'),
+            ('行业风险贡献', risk.get('sector_risk', [])[:RISK_TOP], '{:.1f}%'),
+        ]
+        for heading, items, fmt in blocks:
+            if not items:
+                continue
+            RISK_HEADING.write(w, text=heading)
+            for label, value in items:
+                RISK_ROW.write(w, label=label, value=fmt.format(value))
+        contributors = risk.get('contributors', [])[:RISK_TOP]
+        if contributors:
+            RISK_HEADING.write(w, text='个股风险贡献')
+            for c in contributors:
+                RISK_ROW.write(w, label=c['name'], value=f"仓位 {c['weight']:.1f}% · 风险 {c['risk_share']:.1f}%")
+        note = f"{risk.get('positions', 0)} 只持仓 · {risk.get('observations', 0)} 个交易日样本"
+        if risk.get('equal_weight'):
+            note += ' · 未配置仓位，按等权计算'
+        RISK_NOTE.write(w, text=note)
+
+    def generate_dashboard(self, data, analysis, sections=None):
+        # 行情部分可以提前渲染好传进来，这里只补 AI 相关部分
+        if sections is None:
+            sections = self.render_market_sections(data)
+
+        stable = strip_volatile(analysis)
+        ai_panel, ai_hash = self._section('ai_panel', [AI_PANEL_HEAD.digest, ANALYSIS_CARD.digest, stable],
+                                          lambda w: self._write_ai_panel(w, analysis))
+        picks, picks_hash = self._section('ai_picks', [PICK_CARD.digest, stable.get('top_picks', [])],
+                                          lambda w: self._write_picks(w, analysis))
+        recent = (data.get('alerts') or {}).get('recent', [])[:10]
+        alerts, alerts_hash = self._section('alerts', [ALERTS_OPEN, ALERT_ROW.digest, recent],
+                                            lambda w: self._write_alerts(w, recent))
+        # header 里的更新时间只在其他任一段有变化时才刷新，内容没变时整页保持字节一致
+        with self.lock:
+            body_hashes = [self.manifest['sections'].get(n) for n in ('us_sectors', 'risk', 'hk_table', 'a_table')]
+        header, _ = self._section('header', [HEADER.digest, ai_hash, picks_hash, alerts_hash, body_hashes],
+                                  lambda w: HEADER.write(w, collected_at=data['collected_at']))
+
+        path = os.path.join(self.output_dir, 'index.html')
+        with metrics.span('write.index_html'):
+            with self.lock:
+                previous = self.manifest['outputs'].get('index.html')
+            with AtomicOutput(path, previous) as out, StreamWriter(out) as w:
+                w.copy_file(header)
+                w.copy_file(ai_panel)
+                w.write(SECTORS_OPEN)
+                w.copy_file(sections['sector_cards'][0])
+                w.write(PICKS_OPEN)
+                w.copy_file(picks)
+                w.copy_file(alerts)
+                w.copy_file(sections['risk'][0])
+                TABLE_OPEN.write(w, title='🇭🇰 港股持仓')
+                w.copy_file(sections['hk_rows'][0])
+                w.write(TABLE_CLOSE)
+                NEXT_TABLE_OPEN.write(w, title='🇨🇳 A股持仓')
+                w.copy_file(sections['a_rows'][0])
+                w.write(TABLE_CLOSE)
+                w.write(PAGE_TAIL)
+        with self.lock:
+            self.manifest['outputs']['index.html'] = out.digest
+        self._save_manifest()
+        self.changes['index.html'] = out.changed
+        if not out.changed:
+            print("   ⏭️ index.html 内容未变化，跳过写入")
+        return path
 
     def generate_json_data(self, data, analysis):
-        with open(os.path.join(self.output_dir, 'data.json'), 'w', encoding='utf-8') as f:
-            json.dump({'data': data, 'analysis': analysis}, f, ensure_ascii=False)
-        return os.path.join(self.output_dir, 'data.json')
+        path = os.path.join(self.output_dir, 'data.json')
+        # 去掉时间戳等易变字段后比较内容摘要，没变就不重写
+        digest = hash_inputs(strip_volatile(data), strip_volatile(analysis))
+        with self.lock:
+            unchanged = self.manifest['outputs'].get('data.json') == digest
+        if unchanged and os.path.exists(path):
+            print("   ⏭️ data.json 内容未变化，跳过写入")
+            self.changes['data.json'] = False
+            return path
+        # 摘要相同但文件不在本地时只补写文件，不算内容变化
+        with metrics.span('write.data_json'):
+            with AtomicOutput(path) as out, StreamWriter(out) as w:
+                json.dump({'data': data, 'analysis': analysis}, w, ensure_ascii=False)
+        with self.lock:
+            self.manifest['outputs']['data.json'] = digest
+        self._save_manifest()
+        self.changes['data.json'] = not unchanged
+        return path
+
+    def _write_shard(self, out_dir, name, text, rows):
+        """内容摘要没变就跳过；变了则原子写出原文和 .gz/.br 预压缩副本。返回 (分片信息, 是否变化)
+
+        摘要没变但本地缺文件时补写，不算变化
+        """
+        key = f'data/{name}'
+        path = os.path.join(out_dir, name)
+        digest = hash_inputs(text)
+        with self.lock:
+            previous = self.manifest['outputs'].get(key)
+        same = isinstance(previous, dict) and previous.get('sha256') == digest
+        if same and os.path.exists(path):
+            return previous['info'], False
+
+        raw = text.encode('utf-8')
+        atomic_write_bytes(path, raw)
+        info = {'file': name, 'rows': rows, 'bytes': len(raw)}
+        for suffix, blob in compress_variants(text).items():
+            atomic_write_bytes(path + suffix, blob)
+            info[suffix.lstrip('.') + '_bytes'] = len(blob)
+        with self.lock:
+            self.manifest['outputs'][key] = {'sha256': digest, 'info': info}
+        return info, not same
+
+    def generate_columnar_data(self, data, analysis):
+        """列式导出：docs/data/ 下每个市场一个分片 + 分析分片 + 小 manifest，均附带 .gz/.br
+
+        前端先取 manifest.json，再按需懒加载当前展示的市场分片
+        """
+        out_dir = os.path.join(self.output_dir, 'data')
+        markets = {
+            'us_sectors': data.get('us_sectors') or [],
+            'hk_stocks': data['portfolio']['hk_stocks'],
+            'a_stocks': data['portfolio']['a_stocks'],
+        }
+        manifest = {
+            'schema_version': SCHEMA_VERSION,
+            'collected_at': data['collected_at'],
+            'analysis_generated_at': analysis.get('generated_at'),
+            'us_market': data.get('us_market', {}),
+            'risk': data.get('risk'),
+            'markets': {},
+        }
+        changed = False
+        with metrics.span('write.columnar'):
+            for market, rows in markets.items():
+                text = dumps({'schema_version': SCHEMA_VERSION, 'market': market, **to_columnar(rows)})
+                manifest['markets'][market], shard_changed = self._write_shard(out_dir, f'{market}.json', text, len(rows))
+                changed = changed or shard_changed
+            # 时间戳放在 manifest 里，分析分片只随内容变化
+            text = dumps({'schema_version': SCHEMA_VERSION, 'analysis': strip_volatile(analysis)})
+            manifest['analysis'], shard_changed = self._write_shard(out_dir, 'analysis.json', text, 1)
+            changed = changed or shard_changed
+
+            manifest_path = os.path.join(out_dir, 'manifest.json')
+            if changed or not os.path.exists(manifest_path):
+                with AtomicOutput(manifest_path) as out:
+                    out.write(dumps(manifest))
+        self._save_manifest()
+        self.changes['data/'] = changed
+        return manifest_path
@@ -0,0 +1,182 @@
+import time
+from datetime import datetime, time as dtime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from bar_store import market_of
+
+# 收盘后留给行情源结算的时间，之后的收盘价才算最终值
+SETTLE_SECONDS = 30 * 60
+
+# 各交易所常规交易时段（当地时间）；early_close 为半日市的收盘时间
+EXCHANGES = {
+    'us': {'name': '美股', 'tz': 'America/New_York',
+           'hours': [(dtime(9, 30), dtime(16, 0))], 'early_close': dtime(13, 0)},
+    'hk': {'name': '港股', 'tz': 'Asia/Hong_Kong',
+           'hours': [(dtime(9, 30), dtime(12, 0)), (dtime(13, 0), dtime(16, 0))], 'early_close': dtime(12, 0)},
+    'cn': {'name': 'A股', 'tz': 'Asia/Shanghai',
+           'hours': [(dtime(9, 30), dtime(11, 30)), (dtime(13, 0), dtime(15, 0))]},
+}
+
+# 休市日（只列落在工作日的），按交易所公告整理；每年年底补下一年并更新 COVERED_UNTIL
+HOLIDAYS = {
+    # NYSE / Nasdaq
+    'us': [
+        '2025-01-01', '2025-01-09', '2025-01-20', '2025-02-17', '2025-04-18', '2025-05-26',
+        '2025-06-19', '2025-07-04', '2025-09-01', '2025-11-27', '2025-12-25',
+        '2026-01-01', '2026-01-19', '2026-02-16', '2026-04-03', '2026-05-25', '2026-06-19',
+        '2026-07-03', '2026-09-07', '2026-11-26', '2026-12-25',
+        '2027-01-01', '2027-01-18', '2027-02-15', '2027-03-26', '2027-05-31', '2027-06-18',
+        '2027-07-05', '2027-09-06', '2027-11-25', '2027-12-24',
+    ],
+    # HKEX
+    'hk': [
+        '2025-01-01', '2025-01-29', '2025-01-30', '2025-01-31', '2025-04-04', '2025-04-18',
+        '2025-04-21', '2025-05-01', '2025-05-05', '2025-07-01', '2025-10-01', '2025-10-07',
+        '2025-10-29', '2025-12-25', '2025-12-26',
+        '2026-01-01', '2026-02-17', '2026-02-18', '2026-02-19', '2026-04-03', '2026-04-06',
+        '2026-04-07', '2026-05-01', '2026-05-25', '2026-06-19', '2026-07-01', '2026-10-01',
+        '2026-10-19', '2026-12-25',
+        '2027-01-01', '2027-02-08', '2027-02-09', '2027-03-26', '2027-03-29', '2027-04-05',
+        '2027-05-13', '2027-06-09', '2027-07-01', '2027-09-16', '2027-10-01', '2027-10-08',
+        '2027-12-27',
+    ],
+    # 上交所 / 深交所（调休补班的周末也不开市，无需列出）
+    'cn': [
+        '2025-01-01', '2025-01-28', '2025-01-29', '2025-01-30', '2025-01-31', '2025-02-03',
+        '2025-02-04', '2025-04-04', '2025-05-01', '2025-05-02', '2025-05-05', '2025-06-02',
+        '2025-10-01', '2025-10-02', '2025-10-03', '2025-10-06', '2025-10-07', '2025-10-08',
+        '2026-01-01', '2026-01-02', '2026-02-16', '2026-02-17', '2026-02-18', '2026-02-19',
+        '2026-02-20', '2026-02-23', '2026-04-06', '2026-05-01', '2026-05-04', '2026-05-05',
+        '2026-06-19', '2026-09-25', '2026-10-01', '2026-10-02', '2026-10-05', '2026-10-06',
+        '2026-10-07',
+    ],
+}
+
+# 半日市：美股独立日前一天/感恩节次日/平安夜 13:00 收盘，港股除夕/平安夜/年末只开早市
+EARLY_CLOSES = {
+    'us': ['2025-07-03', '2025-11-28', '2025-12-24', '2026-11-27', '2026-12-24', '2027-11-26'],
+    'hk': ['2025-01-28', '2025-12-24', '2025-12-31', '2026-02-16', '2026-12-24', '2026-12-31',
+           '2027-02-05', '2027-12-24', '2027-12-31'],
+}
+
+# 休市表覆盖到的最后一天，之后只按周末判断；scripts/check_calendar.py 在到期前让 CI 失败
+# A股下一年的安排要等国务院年底公布放假通知后才能补
+COVERED_UNTIL = {'us': '2027-12-31', 'hk': '2027-12-31', 'cn': '2026-12-31'}
+
+
+def to_epoch(now=None):
+    """None/datetime/秒数 统一成 UTC 秒"""
+    if now is None:
+        return time.time()
+    if isinstance(now, datetime):
+        return now.timestamp()
+    return float(now)
+
+
+class ExchangeCalendar:
+    """单个交易所的日历：交易日用 numpy 工作日日历（周末 + 休市表）预先算好，时段按当地时区换算成 UTC 秒"""
+
+    def __init__(self, market, name, tz, hours, early_close=None, holidays=(), early_closes=(),
+                 covered_until=None):
+        self.market = market
+        self.name = name
+        self.tz = ZoneInfo(tz)
+        self.hours = hours
+        self.early_close = early_close
+        self.early_days = set(np.array(early_closes, dtype='datetime64[D]').tolist())
+        self.busdays = np.busdaycalendar(holidays=np.array(holidays, dtype='datetime64[D]'))
+        self.covered_until = np.datetime64(covered_until, 'D') if covered_until else None
+        self._warned = False
+
+    def _check_coverage(self, day):
+        if self.covered_until is not None and day > self.covered_until and not self._warned:
+            self._warned = True
+            print(f"⚠️ {self.name}休市表只覆盖到 {self.covered_until}，之后按工作日估算，请补充 trading_calendar.HOLIDAYS")
+
+    def local_date(self, now=None):
+        """交易所当地日期"""
+        return np.datetime64(datetime.fromtimestamp(to_epoch(now), self.tz).date(), 'D')
+
+    def is_session(self, day):
+        day = np.datetime64(day, 'D')
+        self._check_coverage(day)
+        return bool(np.is_busday(day, busdaycal=self.busdays))
+
+    def previous_session(self, day):
+        """严格早于 day 的最近一个交易日"""
+        return np.busday_offset(np.datetime64(day, 'D'), -1, roll='forward', busdaycal=self.busdays)
+
+    def sessions(self, start, end):
+        """[start, end] 之间的全部交易日"""
+        end = np.datetime64(end, 'D')
+        self._check_coverage(end)
+        days = np.arange(np.datetime64(start, 'D'), end + 1)
+        return days[np.is_busday(days, busdaycal=self.busdays)]
+
+    def hours_on(self, day):
+        """交易日各段的 [(开盘, 收盘)] UTC 秒，半日市只保留收盘前的时段；非交易日返回空列表"""
+        day = np.datetime64(day, 'D')
+        if not self.is_session(day):
+            return []
+        d = day.tolist()
+        cap = self.early_close if d in self.early_days else None
+        out = []
+        for start, end in self.hours:
+            if cap is not None:
+                if start >= cap:
+                    continue
+                end = min(end, cap)
+            out.append((datetime.combine(d, start, self.tz).timestamp(),
+                        datetime.combine(d, end, self.tz).timestamp()))
+        return out
+
+    def is_open(self, now=None):
+        now = to_epoch(now)
+        return any(o <= now < c for o, c in self.hours_on(self.local_date(now)))
+
+    def reference_session(self, now=None):
+        """已经开盘的最近一个交易日：盘中和收盘后是当天，开盘前或休市日是上一个交易日"""
+        now = to_epoch(now)
+        day = self.local_date(now)
+        hours = self.hours_on(day)
+        if hours and now >= hours[0][0]:
+            return day
+        return self.previous_session(day)
+
+    def traded_between(self, since, now=None, settle=SETTLE_SECONDS):
+        """(since, now] 之间是否可能产生新行情：有交易时段（含收盘后的结算时间）与之重叠"""
+        if since is None:
+            return True
+        now = to_epoch(now)
+        if now <= since:
+            return False
+        first, last = self.local_date(since), self.local_date(now)
+        if last - first > np.timedelta64(7, 'D'):
+            return True
+        for day in self.sessions(first, last):
+            for o, c in self.hours_on(day):
+                if o <= now and since < c + settle:
+                    return True
+        return False
+
+
+class TradingCalendar:
+    """美股/港股/A股三个交易所的日历，按 bar_store.market_of 的分区名取用"""
+
+    def __init__(self, exchanges=None):
+        self.markets = {
+            m: ExchangeCalendar(m, holidays=HOLIDAYS.get(m, ()), early_closes=EARLY_CLOSES.get(m, ()),
+                                covered_until=COVERED_UNTIL.get(m), **spec)
+            for m, spec in (exchanges or EXCHANGES).items()
+        }
+
+    def __getitem__(self, market):
+        return self.markets[market]
+
+    def for_symbol(self, sym):
+        return self.markets[market_of(sym)]
+
+    def open_markets(self, now=None):
+        return {m for m, cal in self.markets.items() if cal.is_open(now)}
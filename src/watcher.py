@@ -0,0 +1,153 @@
+import time
+from array import array
+from datetime import datetime
+
+from bar_store import market_of
+from metrics import metrics
+from trading_calendar import to_epoch
+
+INDEX_NAMES = {"^GSPC": "sp500", "^IXIC": "nasdaq"}
+
+
+class TickRing:
+    """单只标的的定长环形缓冲：时间戳和价格各用一段连续的 array 存储，写满后覆盖最旧的"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.ts = array('q', bytes(8 * capacity))
+        self.price = array('d', bytes(8 * capacity))
+        self.count = 0
+        self.head = 0    # 下一次写入的位置
+
+    def push(self, ts, price):
+        self.ts[self.head] = ts
+        self.price[self.head] = price
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def last(self):
+        if not self.count:
+            return None
+        i = (self.head - 1) % self.capacity
+        return self.ts[i], self.price[i]
+
+    def items(self):
+        """按时间顺序返回 [(ts, price), ...]"""
+        start = (self.head - self.count) % self.capacity
+        return [(self.ts[(start + k) % self.capacity], self.price[(start + k) % self.capacity])
+                for k in range(self.count)]
+
+
+class IntradayWatcher:
+    """常驻盯盘：DataCollector 保持常驻，按固定间隔只轮询正在交易的市场，
+
+    每只标的的 tick 记在环形缓冲里，只把价格真正变动的标的作为增量推给下游
+    """
+
+    def __init__(self, collector, config, generator=None, analysis=None, interval=60, capacity=512,
+                 on_delta=None, alert_engine=None):
+        self.collector = collector
+        self.config = config
+        self.generator = generator
+        self.analysis = analysis or {}
+        self.interval = interval
+        self.capacity = capacity
+        self.on_delta = on_delta or self.publish
+        self.alert_engine = alert_engine
+        self.rings = {}
+        self.market_data = None
+        self.items = {}     # {代码: market_data 中对应的 dict}，增量直接原地更新
+
+    def start(self):
+        """先完整采集一次，建立各标的到结果 dict 的索引"""
+        self.market_data = self.collector.collect_all(self.config)
+        md = self.market_data
+        for item in md['us_sectors'] + md['portfolio']['hk_stocks'] + md['portfolio']['a_stocks']:
+            self.items[item['code']] = item
+        for sym, name in INDEX_NAMES.items():
+            self.items[sym] = md['us_market'][name]
+        now = int(self.collector.clock())
+        for sym, item in self.items.items():
+            self.ring(sym).push(now, item['price'])
+        self.check_alerts(self.items)
+        return self.market_data
+
+    def ring(self, sym):
+        if sym not in self.rings:
+            self.rings[sym] = TickRing(self.capacity)
+        return self.rings[sym]
+
+    def open_symbols(self, now=None):
+        # 交易时段、午休、节假日和半日市都以采集器的交易日历为准；时间取采集器的时钟，回放时与采集一致
+        if now is None:
+            now = self.collector.clock()
+        open_markets = self.collector.calendar.open_markets(now)
+        return [s for s in self.items if market_of(s) in open_markets]
+
+    def tick(self, now=None):
+        """轮询一次，返回 {代码: (价格, 涨跌幅)}，只包含价格有变动的标的"""
+        if now is None:
+            now = self.collector.clock()
+        symbols = self.open_symbols(now)
+        if not symbols:
+            return {}
+        with metrics.span('watch.tick', tickers=len(symbols)):
+            quotes, report = self.collector.refresh(symbols, now)
+            ts = int(to_epoch(now))
+            deltas = {}
+            for sym, (price, pct) in quotes.items():
+                ring = self.ring(sym)
+                last = ring.last()
+                ring.push(ts, price)
+                if last is None or last[1] != price:
+                    deltas[sym] = (price, pct)
+                    self.items[sym]['price'] = price
+                    self.items[sym]['change_pct'] = pct
+        metrics.incr('watch_ticks')
+        metrics.incr('watch_deltas', len(deltas))
+        if deltas:
+            self.market_data['collected_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.check_alerts(deltas)
+            self.on_delta(deltas, self.market_data)
+        return deltas
+
+    def check_alerts(self, deltas):
+        """只把有变动的标的交给提醒引擎，引擎按索引评估相关规则"""
+        if self.alert_engine is None:
+            return []
+        # 指数行情没有 code 字段，不参与规则评估
+        fired = self.alert_engine.evaluate([self.items[s] for s in deltas if 'code' in self.items[s]])
+        self.market_data['alerts'] = {'fired': fired, 'recent': list(self.alert_engine.state['recent'])}
+        for a in fired:
+            print(f"   🔔 {a['message']}")
+        return fired
+
+    def publish(self, deltas, market_data):
+        """默认下游：增量刷新面板和数据文件（分段哈希保证只重写有变化的市场）"""
+        if self.generator is None:
+            return
+        sections = self.generator.render_market_sections(market_data)
+        self.generator.generate_dashboard(market_data, self.analysis, sections)
+        self.generator.generate_json_data(market_data, self.analysis)
+        self.generator.generate_columnar_data(market_data, self.analysis)
+        print(f"   🔔 {datetime.now().strftime('%H:%M:%S')} 变动 {len(deltas)} 只: "
+              f"{', '.join(list(deltas)[:10])}")
+
+    def run(self, max_ticks=None):
+        if self.market_data is None:
+            self.start()
+        ticks = 0
+        try:
+            while max_ticks is None or ticks < max_ticks:
+                started = time.monotonic()
+                try:
+                    self.tick()
+                except Exception as e:
+                    print(f"   ⚠️ 轮询出错: {e}")
+                ticks += 1
+                if max_ticks is not None and ticks >= max_ticks:
+                    break
+                time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            print("\n👋 盯盘已停止")
+        return ticks
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# src 下是平铺的模块，和 main.py 一样直接加到导入路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from bar_store import BarStore  # noqa: E402
+
+
+def day_seconds(days):
+    """datetime64[D] 数组 → bar 时间戳 (UTC 秒)，和 to_epoch_seconds 对日线的结果一致"""
+    return np.asarray(days, dtype='datetime64[D]').astype('datetime64[s]').astype(np.int64)
+
+
+def random_bars(days, seed, start=100.0):
+    """在给定交易日上生成随机游走的 OHLCV"""
+    rng = np.random.default_rng(seed)
+    close = start * np.exp(np.cumsum(rng.normal(0, 0.02, len(days))))
+    open_ = close * np.exp(rng.normal(0, 0.005, len(days)))
+    return {'ts': day_seconds(days), 'open': open_, 'high': np.maximum(open_, close) * 1.01,
+            'low': np.minimum(open_, close) * 0.99, 'close': close,
+            'volume': rng.integers(1_000, 100_000, len(days)).astype(np.float64)}
+
+
+def busdays(start, end, holidays=()):
+    days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D'))
+    return days[np.is_busday(days, holidays=np.array(holidays, dtype='datetime64[D]'))]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BarStore(root=str(tmp_path / 'bars'))
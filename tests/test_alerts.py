@@ -0,0 +1,86 @@
+import json
+
+import numpy as np
+import pytest
+
+from alerts import AlertEngine
+from bar_store import FIELDS
+from conftest import busdays, random_bars
+from renderer import hash_inputs, strip_volatile
+
+RULES = [
+    {'id': 'big-move', 'kind': 'pct_change', 'ticker': '1810.HK', 'op': 'abs_above', 'threshold': 5},
+    {'id': 'pingan-below-40', 'kind': 'price', 'ticker': '601318.SH', 'op': 'below', 'threshold': 40},
+    {'id': 'pingan-above-60', 'kind': 'price', 'ticker': '601318.SH', 'op': 'above', 'threshold': 60},
+    {'id': 'internet-vs-kweb', 'kind': 'divergence', 'etf': 'KWEB', 'tickers': ['3690.HK', '2400.HK'],
+     'threshold': 3},
+    {'id': 'xiaomi-5d-high', 'kind': 'breakout', 'ticker': '1810.HK', 'days': 5, 'direction': 'up'},
+]
+
+
+@pytest.fixture
+def engine_factory(tmp_path, store):
+    rules_path = tmp_path / 'alerts.json'
+    rules_path.write_text(json.dumps({'rules': RULES}), encoding='utf-8')
+
+    def make():
+        return AlertEngine(rules_path=str(rules_path), state_path=str(tmp_path / 'alert_state.json'), store=store)
+    return make
+
+
+def quote(code, price, change_pct, name=None):
+    return {'code': code, 'name': name or code, 'price': price, 'change_pct': change_pct}
+
+
+def market_data(hk, cn=(), us=()):
+    return {'us_sectors': list(us), 'portfolio': {'hk_stocks': list(hk), 'a_stocks': list(cn)}}
+
+
+def fired_ids(alerts):
+    return sorted(a['rule_id'] for a in alerts)
+
+
+def test_threshold_rules_use_configured_code_form(engine_factory):
+    engine = engine_factory()
+    # 配置写 .SH，行情里是 .SS
+    assert fired_ids(engine.evaluate([quote('601318.SS', 38.5, -2.0)])) == ['pingan-below-40']
+    assert fired_ids(engine.evaluate([quote('1810.HK', 20.0, -5.5)])) == ['big-move']
+    assert engine.evaluate([quote('601318.SS', 50.0, 1.0), quote('0700.HK', 500.0, 9.0)]) == []
+
+
+def test_same_value_fires_once_across_runs(engine_factory):
+    md = market_data([quote('1810.HK', 20.0, 6.0)])
+    first = engine_factory().evaluate_market_data(md)
+    assert fired_ids(first['fired']) == ['big-move']
+
+    # 下一次运行重新采集到同样的行情：不再触发，但 recent 里还在，变更判断看到的内容不变
+    second = engine_factory().evaluate_market_data(md)
+    assert second['fired'] == []
+    assert second['recent'] == first['recent']
+    assert hash_inputs(strip_volatile({'alerts': second})) == hash_inputs(strip_volatile({'alerts': first}))
+
+
+def test_cooldown_blocks_new_value(engine_factory):
+    engine = engine_factory()
+    assert fired_ids(engine.evaluate([quote('1810.HK', 20.0, 6.0)])) == ['big-move']
+    assert engine.evaluate([quote('1810.HK', 20.5, 7.0)]) == []
+    engine.state['rules']['big-move']['fired_at'] -= 241 * 60
+    assert fired_ids(engine.evaluate([quote('1810.HK', 20.5, 7.0)])) == ['big-move']
+
+
+def test_divergence_against_etf(engine_factory):
+    engine = engine_factory()
+    alerts = engine.evaluate([quote('KWEB', 30.0, 0.5), quote('3690.HK', 100.0, 4.0), quote('2400.HK', 10.0, 3.5)])
+    assert fired_ids(alerts) == ['internet-vs-kweb']
+    assert alerts[0]['ticker'] == 'KWEB'
+    assert alerts[0]['members'] == ['3690.HK', '2400.HK']
+    assert alerts[0]['value'] == pytest.approx(3.25)
+
+
+def test_breakout_reads_bar_store(engine_factory, store):
+    bars = random_bars(busdays('2026-09-01', '2026-09-15'), seed=7)
+    store.append('1810.HK', bars['ts'], {f: bars[f] for f in FIELDS})
+    engine = engine_factory()
+    high = float(np.max(bars['close'][-6:-1]))
+    assert 'xiaomi-5d-high' not in fired_ids(engine.evaluate([quote('1810.HK', high * 0.99, 0.0)]))
+    assert 'xiaomi-5d-high' in fired_ids(engine.evaluate([quote('1810.HK', high * 1.01, 0.0)]))
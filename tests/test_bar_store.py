@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+
+from bar_store import FIELDS
+from conftest import busdays, random_bars
+
+
+def columns(bars, sl=slice(None)):
+    return {f: bars[f][sl] for f in FIELDS}
+
+
+def test_append_and_read_range(store):
+    bars = random_bars(busdays('2026-03-02', '2026-03-14'), seed=1)
+    assert store.append('0700.HK', bars['ts'], columns(bars)) == len(bars['ts'])
+    assert store.length('0700.HK') == len(bars['ts'])
+
+    got = store.read('0700.HK', start=int(bars['ts'][2]), end=int(bars['ts'][5]))
+    np.testing.assert_array_equal(got['ts'], bars['ts'][2:6])
+    np.testing.assert_array_equal(got['close'], bars['close'][2:6])
+    np.testing.assert_array_equal(store.tail('0700.HK', 3)['ts'], bars['ts'][-3:])
+
+
+def test_append_refreshes_last_bar_in_place(store):
+    bars = random_bars(busdays('2026-03-02', '2026-03-07'), seed=2)
+    store.append('XLK', bars['ts'], columns(bars))
+    # 盘中重新抓到同一根 bar，外加一根更早的（已存在的不应重写）
+    ts = bars['ts'][-2:]
+    assert store.append('XLK', ts, {'close': np.array([1.0, 2.0])}) == 0
+    got = store.read('XLK')
+    assert len(got['ts']) == len(bars['ts'])
+    assert got['close'][-1] == 2.0
+    assert got['close'][-2] == bars['close'][-2]
+
+
+def test_append_after_partial_write(store):
+    """上次写到一半中断：数据列已追加、ts 还没写，读取按 ts 截断，下一次追加先把多余的尾巴截掉"""
+    bars = random_bars(busdays('2026-03-02', '2026-03-21'), seed=3)
+    store.append('600519.SS', bars['ts'][:5], columns(bars, slice(None, 5)))
+
+    d = store._dir('600519.SS')
+    for field in FIELDS:
+        with open(os.path.join(d, f'{field}.f8'), 'ab') as f:
+            f.write(np.full(3, -1.0).tobytes())
+
+    got = store.read('600519.SS')
+    assert len(got['ts']) == 5
+    np.testing.assert_array_equal(got['close'], bars['close'][:5])
+
+    assert store.append('600519.SS', bars['ts'][5:], columns(bars, slice(5, None))) == len(bars['ts']) - 5
+    for field in FIELDS:
+        assert os.path.getsize(os.path.join(d, f'{field}.f8')) == len(bars['ts']) * 8
+    got = store.read('600519.SS')
+    np.testing.assert_array_equal(got['ts'], bars['ts'])
+    for field in FIELDS:
+        np.testing.assert_array_equal(got[field], bars[field])
+
+
+def test_panels_right_align_missing_history(store):
+    long = random_bars(busdays('2026-03-02', '2026-03-14'), seed=4)
+    short = random_bars(busdays('2026-03-12', '2026-03-14'), seed=5)
+    store.append('XLF', long['ts'], columns(long))
+    store.append('XLE', short['ts'], columns(short))
+
+    panel = store.close_panel(['XLF', 'XLE', 'XLU'], n=4)
+    np.testing.assert_array_equal(panel[:, 0], long['close'][-4:])
+    assert np.isnan(panel[:2, 1]).all()
+    np.testing.assert_array_equal(panel[2:, 1], short['close'])
+    assert np.isnan(panel[:, 2]).all()
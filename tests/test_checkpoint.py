@@ -0,0 +1,69 @@
+import pytest
+
+from checkpoint import Checkpoints
+from renderer import atomic_write_json
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path / 'stages')
+
+
+class Counter:
+    def __init__(self, output):
+        self.output = output
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.output
+
+
+def test_reuses_output_with_same_fingerprint(root):
+    run = Counter({'value': 1, 'collected_at': '10:00'})
+    assert Checkpoints(root).run('collect', 'fp', run) == run.output
+    assert Checkpoints(root).run('collect', 'fp', run) == run.output
+    assert run.calls == 1
+    Checkpoints(root).run('collect', 'other', run)
+    assert run.calls == 2
+
+
+@pytest.mark.parametrize('force', [['collect'], ['all'], ['publish']])
+def test_forced_stages_rerun(root, force):
+    stage = 'publish.default' if force == ['publish'] else 'collect'
+    run = Counter({'value': 1})
+    Checkpoints(root).run(stage, 'fp', run)
+    Checkpoints(root, force=force).run(stage, 'fp', run)
+    assert run.calls == 2
+
+
+def test_expired_checkpoint_reruns(root):
+    run = Counter({'value': 1})
+    cp = Checkpoints(root)
+    cp.run('collect', 'fp', run)
+    # 把保存时间回拨两分钟
+    rec = cp.record('collect')
+    atomic_write_json(cp._path('collect'), {**rec, 'saved_at': rec['saved_at'] - 120})
+    Checkpoints(root, max_age={'collect': 300}).run('collect', 'fp', run)
+    assert run.calls == 1
+    Checkpoints(root, max_age={'collect': 60}).run('collect', 'fp', run)
+    assert run.calls == 2
+
+
+def test_digest_ignores_volatile_fields(root):
+    cp = Checkpoints(root)
+    a = cp.save('collect', {'price': 1, 'collected_at': '10:00', 'alerts': {'fired': [1], 'recent': [1]}})
+    b = cp.save('collect', {'price': 1, 'collected_at': '10:30', 'alerts': {'fired': [], 'recent': [1]}})
+    c = cp.save('collect', {'price': 2, 'collected_at': '10:30', 'alerts': {'fired': [], 'recent': [1]}})
+    assert a['digest'] == b['digest'] != c['digest']
+
+
+def test_keep_and_valid_guards(root):
+    fallback = Counter({'fallback': True})
+    Checkpoints(root).run('analyze', 'fp', fallback, keep=lambda out: not out.get('fallback'))
+    assert Checkpoints(root).record('analyze') is None
+
+    good = Counter({'path': 'docs/index.html'})
+    Checkpoints(root).run('publish', 'fp', good)
+    Checkpoints(root).run('publish', 'fp', good, valid=lambda out: False)
+    assert good.calls == 2
@@ -0,0 +1,121 @@
+"""增量更新与全量重建等价：逐日追加 bar（含盘中刷新最后一根）后，增量状态应与在同一份存储上重建的结果一致"""
+
+import numpy as np
+import pytest
+
+from bar_store import FIELDS
+from conftest import busdays, random_bars
+from correlation import CorrelationEngine, SUM_KEYS
+from indicators import IndicatorEngine
+from risk import RiskEngine
+from trading_calendar import HOLIDAYS
+
+HK = ['0700.HK', '9988.HK', '3690.HK']
+US = ['XLK', 'XLF']
+# 逐日推进的交易日数，保持在窗口以内，确保最后走的是增量路径而不是定期重建
+STEPS = 10
+
+
+def make_bars():
+    hk_days = busdays('2026-01-01', '2026-07-01', HOLIDAYS['hk'])
+    us_days = busdays('2026-01-01', '2026-07-01', HOLIDAYS['us'])
+    bars = {t: random_bars(hk_days, seed=i) for i, t in enumerate(HK)}
+    bars.update({t: random_bars(us_days, seed=10 + i, start=50.0) for i, t in enumerate(US)})
+    # 一只港股停牌一天
+    gap = bars['9988.HK']['ts'] != bars['9988.HK']['ts'][-5]
+    bars['9988.HK'] = {f: v[gap] for f, v in bars['9988.HK'].items()}
+    return bars
+
+
+def fill(store, bars, lo, hi, scale=1.0):
+    """把时间戳落在 [lo, hi) 的 bar 写入存储；scale != 1 时模拟盘中尚未收定的价格"""
+    for t, b in bars.items():
+        m = (b['ts'] >= lo) & (b['ts'] < hi)
+        if m.any():
+            cols = {f: b[f][m] * (scale if f != 'volume' else 1.0) for f in FIELDS}
+            store.append(t, b['ts'][m], cols)
+
+
+def replay(store, bars, update):
+    """先写入除最后 STEPS 天以外的历史，之后每天先写盘中价、再用收盘价刷新，每次写入后都调用 update"""
+    dates = np.unique(np.concatenate([b['ts'] for b in bars.values()]))
+    fill(store, bars, dates[0], dates[-STEPS])
+    update()
+    for d in dates[-STEPS:]:
+        fill(store, bars, d, d + 1, scale=0.97)
+        update()
+        fill(store, bars, d, d + 1)
+        update()
+
+
+def assert_states_close(inc, full, keys):
+    for k in keys:
+        np.testing.assert_allclose(inc[k], full[k], rtol=1e-9, atol=1e-9, equal_nan=True, err_msg=k)
+
+
+def test_indicator_engine_matches_rebuild(store, tmp_path):
+    bars = make_bars()
+    tickers = HK + US
+    engine = IndicatorEngine(store, state_path=str(tmp_path / 'inc.npz'))
+    replay(store, bars, lambda: engine.update(tickers))
+    inc = engine.update(tickers)
+
+    fresh = IndicatorEngine(store, state_path=str(tmp_path / 'full.npz'))
+    full = fresh.update(tickers)
+
+    assert sorted(inc) == sorted(full) == sorted(tickers)
+    for t in tickers:
+        assert sorted(inc[t]) == sorted(full[t])
+        assert inc[t] == pytest.approx(full[t], abs=0.011)
+    np.testing.assert_array_equal(engine.state['last_ts'], fresh.state['last_ts'])
+    np.testing.assert_array_equal(engine.state['count'], fresh.state['count'])
+    assert_states_close(engine.state, fresh.state,
+                        ['prev_close', 'close_sums', 'ema', 'avg_gain', 'avg_loss', 'ret_sum', 'ret_sumsq',
+                         'volume_sum'])
+
+
+def test_correlation_engine_matches_rebuild(store, tmp_path):
+    bars = make_bars()
+    engine = CorrelationEngine(store, window=30, min_periods=10, state_path=str(tmp_path / 'inc.npz'))
+    replay(store, bars, lambda: engine.update(HK, US))
+    inc = engine.update(HK, US)
+    assert int(engine.states['hk']['updates']) > 0
+
+    fresh = CorrelationEngine(store, window=30, min_periods=10, state_path=str(tmp_path / 'full.npz'))
+    full = fresh.update(HK, US)
+
+    a, b = engine.states['hk'], fresh.states['hk']
+    np.testing.assert_array_equal(a['dates'], b['dates'])
+    np.testing.assert_array_equal(a['n'], b['n'])
+    assert_states_close(a, b, ['y', 'x', 'base', 'etf_base', *SUM_KEYS])
+    assert sorted(inc) == sorted(full)
+    for t in full:
+        assert inc[t] == pytest.approx(full[t])
+
+
+def test_risk_engine_matches_rebuild(store, tmp_path):
+    bars = make_bars()
+    holdings = HK + US
+    engine = RiskEngine(store, state_path=str(tmp_path / 'inc.npz'))
+    replay(store, bars, lambda: engine.update(holdings, {'window': 30}))
+    engine.update(holdings, {'window': 30})
+    assert int(engine.state['updates']) > 0
+
+    fresh = RiskEngine(store, state_path=str(tmp_path / 'full.npz'))
+    fresh.update(holdings, {'window': 30})
+
+    np.testing.assert_array_equal(engine.state['dates'], fresh.state['dates'])
+    assert_states_close(engine.state, fresh.state, ['r', 'sum', 'base'])
+
+
+def test_engines_reload_state_from_disk(store, tmp_path):
+    """跨运行：新实例读回落盘状态后继续增量更新，结果同样与重建一致"""
+    bars = make_bars()
+    path = str(tmp_path / 'risk.npz')
+    replay(store, bars, lambda: RiskEngine(store, state_path=path).update(HK, {'window': 20}))
+    reloaded = RiskEngine(store, state_path=path)
+    assert int(reloaded.state['updates']) > 0
+
+    fresh = RiskEngine(store, state_path=str(tmp_path / 'full.npz')).update(HK, {'window': 20})
+    np.testing.assert_array_equal(reloaded.state['dates'], fresh['dates'])
+    assert_states_close(reloaded.state, fresh, ['r', 'sum'])
@@ -0,0 +1,97 @@
+import pytest
+
+from email_sender import EmailSender
+from outbox import Outbox, StubTransport, TransportError
+from download_scheduler import RateLimiter
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(root=str(tmp_path / 'outbox'))
+
+
+def fast():
+    return RateLimiter(rate=1000.0, burst=1000)
+
+
+def message(subject='日报'):
+    return {'from': 'a@x.com', 'to': ['me@x.com'], 'subject': subject, 'html': '<p/>'}
+
+
+def market_data(collected_at, fired=()):
+    alerts = {'fired': list(fired), 'recent': [{'rule_id': 'r1', 'fired_at': '2026-10-16 21:00:00', 'value': 5.2}]}
+    return {'collected_at': collected_at, 'us_sectors': [], 'alerts': alerts,
+            'portfolio': {'hk_stocks': [{'code': '0700.HK', 'name': '腾讯', 'price': 500.0, 'change_pct': 5.2}],
+                          'a_stocks': []}}
+
+
+ANALYSIS = {'market_summary': '震荡', 'top_picks': [], 'generated_at': '2026-10-16 22:00:00'}
+ALERT = {'rule_id': 'r1', 'message': '腾讯 涨跌幅 +5.20% 触发阈值 5%', 'fired_at': '2026-10-16 21:00:00', 'value': 5.2}
+
+
+def test_enqueue_skips_known_keys(outbox):
+    assert outbox.enqueue(message(), 'k1')
+    assert not outbox.enqueue(message(), 'k1')
+    report = outbox.flush(StubTransport(), limiter=fast())
+    assert report.sent == ['k1']
+    # 已发送的键不再入队
+    assert not outbox.enqueue(message(), 'k1')
+    assert outbox.pending() == []
+
+
+def test_aliases_are_recorded_as_sent(outbox):
+    assert outbox.enqueue(message(), 'k1', ['alert-a'])
+    # 全部键都已在队列里（包括作为别名）才跳过
+    assert not outbox.enqueue(message(), 'alert-a')
+    assert outbox.enqueue(message(), 'k2', ['alert-a'])
+    outbox.flush(StubTransport(), limiter=fast())
+    # 发送后别名同样记为已发送
+    assert not outbox.enqueue(message(), 'alert-a')
+    assert not outbox.enqueue(message(), 'k2', ['alert-a'])
+    assert outbox.enqueue(message(), 'k3', ['alert-a', 'alert-b'])
+
+
+def test_retry_reuses_batch_idempotency_key(outbox):
+    outbox.enqueue(message('a'), 'k1')
+    outbox.enqueue(message('b'), 'k2', ['alert-a'])
+    failing = StubTransport(failure_rate=1.0, seed=0)
+    report = outbox.flush(failing, limiter=fast(), max_retries=1, backoff=0)
+    assert sorted(report.pending) == ['k1', 'k2']
+
+    transport = StubTransport()
+    outbox.flush(transport, limiter=fast())
+    outbox.flush(transport, limiter=fast())
+    assert len(transport.batches) == 1
+    assert len(transport.sent) == 2
+
+
+def test_non_retryable_failure_moves_to_failed(outbox):
+    class Rejecting:
+        def send_batch(self, messages, key):
+            raise TransportError('HTTP 422', 422, retryable=False)
+
+    outbox.enqueue(message(), 'k1')
+    report = outbox.flush(Rejecting(), limiter=fast())
+    assert list(report.failed) == ['k1']
+    assert outbox.pending() == []
+
+
+def test_daily_report_not_resent_after_recollect(tmp_path):
+    """同样的行情重新采集后 alerts.fired 变空、采集时间变了，日报不应再发一封；新触发的提醒照样发"""
+    transport = StubTransport()
+    sender = EmailSender(None, 'a@x.com', transport=transport, outbox=Outbox(root=str(tmp_path / 'outbox')))
+
+    assert sender.queue_daily_report('me@x.com', market_data('2026-10-16 22:00:00', [ALERT]), ANALYSIS)
+    sender.outbox.flush(transport, limiter=fast())
+    assert len(transport.sent) == 1
+
+    recollected = market_data('2026-10-16 22:30:00')
+    analysis = {**ANALYSIS, 'generated_at': '2026-10-16 22:30:00'}
+    assert sender.queue_daily_report('me@x.com', recollected, analysis) is None
+
+    again = {**ALERT, 'fired_at': '2026-10-17 09:00:00'}
+    assert sender.queue_daily_report('me@x.com', market_data('2026-10-17 09:00:00', [again]), ANALYSIS)
+    # 收件人不同是另一封
+    assert sender.queue_daily_report(['you@x.com'], recollected, analysis)
+    # 强制发送总是入队
+    assert sender.queue_daily_report('me@x.com', recollected, analysis, force=True)
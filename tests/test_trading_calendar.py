@@ -0,0 +1,51 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pytest
+
+from trading_calendar import TradingCalendar
+
+
+@pytest.fixture(scope='module')
+def calendar():
+    return TradingCalendar()
+
+
+def at(market_tz, text):
+    return datetime.fromisoformat(text).replace(tzinfo=ZoneInfo(market_tz))
+
+
+@pytest.mark.parametrize('market, now, expected', [
+    # 港股农历新年休市三天，除夕是半日市
+    ('hk', '2026-02-18 11:00', '2026-02-16'),
+    ('hk', '2026-02-20 09:00', '2026-02-16'),
+    ('hk', '2026-02-20 09:31', '2026-02-20'),
+    ('hk', '2027-02-09 15:00', '2027-02-05'),
+    # A股国庆长假，调休补班的周末不开市
+    ('cn', '2026-10-05 14:00', '2026-09-30'),
+    ('cn', '2026-10-10 10:00', '2026-10-09'),
+    # 美股感恩节，周一开盘前回到上周五
+    ('us', '2026-11-26 12:00', '2026-11-25'),
+    ('us', '2026-11-30 08:00', '2026-11-27'),
+    ('us', '2026-11-30 16:30', '2026-11-30'),
+])
+def test_reference_session_across_holidays(calendar, market, now, expected):
+    cal = calendar[market]
+    assert cal.reference_session(at(cal.tz.key, now)) == np.datetime64(expected)
+
+
+def test_early_close_ends_after_morning_session(calendar):
+    hk = calendar['hk']
+    assert hk.is_open(at('Asia/Hong_Kong', '2026-02-16 11:00'))
+    assert not hk.is_open(at('Asia/Hong_Kong', '2026-02-16 13:30'))
+    assert hk.is_open(at('Asia/Hong_Kong', '2026-02-20 13:30'))
+
+
+def test_traded_between_skips_closed_stretch(calendar):
+    cn = calendar['cn']
+    # 节前收盘结算之后到节后开盘之前没有新行情
+    since = at('Asia/Shanghai', '2026-09-30 16:00').timestamp()
+    assert not cn.traded_between(since, at('Asia/Shanghai', '2026-10-07 20:00'))
+    assert cn.traded_between(since, at('Asia/Shanghai', '2026-10-08 09:31'))
+